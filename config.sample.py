@@ -8,3 +8,8 @@ MAIN_ROLE_NAME = ""
 GRANT_EMOJI_NAME = ""
 
 
+MEMORY_BACKEND = "json" # or "sqlite"
+METRICS_PORT = 0 # Serves /metrics and /metrics.json on localhost when set (from the supervisor in shards mode)
+HOT_RELOAD = False # "update" reloads grocha.py in place, "restart" still restarts the service
+CACHE_PROFILE = "full" # or "lean": no presences, members fetched on demand, small message cache
+GRODLE_WORD_LIST_FILE_NAME = None # Optional French word list, one word per line: grodle knows these words without asking Wiktionary
@@ -1,16 +1,33 @@
-from collections import defaultdict
+import time
+startup_time = time.perf_counter() # The startup timeline begins before the heavier imports
+
+import asyncio
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import glob
+import http.server
 import json
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
 import random
 import re
+import signal
+import sqlite3
 import string
 import subprocess
 import sys
-import time
+import threading
 import traceback
+import types
 from datetime import datetime, timedelta, timezone
 import unicodedata
-from urllib import parse, request
+from urllib import parse
 
+import aiohttp
 import discord
 import pytz
 
@@ -18,56 +35,1168 @@ import config
 
 native_emoji_regex = "^[\u263a-\U0001ffff]$"
 custom_emoji_regex = "^<a?:(\\w+):(\\d+)>$"
+custom_emoji_id_regex = "<a?:\\w+:(\\d+)>"
 hairspace = '\u200a'
+here_words = {"ici", "here"}
+reaction_fetch_concurrency = 4
+history_page_size = 100
+history_channel_concurrency = 4
+history_requests_per_second = 5
+web_timeout = 10
+geocode_ttl = 7 * 24 * 3600
+onecall_ttl = 5 * 60
+openweather_base_url = "https://api.openweathermap.org"
+wiktionary_timeout = 5
+wiktionary_cache_file_name = "wiktionary-cache.json"
+autoreact_max_reactions = 5
+memory_flush_delay = 5
+default_vote_thresholds = {"greet": 1, "kick": 3} # Distinct voters needed
+command_queue_size = 16 # Commands waiting or running in a guild
+command_concurrency = 4 # Commands running at once in a guild
+command_cost_concurrency = {"light": command_concurrency, "heavy": 1} # Runs at once of the same command
+blocking_command_concurrency = 1 # Blocking commands running at once in a guild, outside of command_concurrency
+guild_rate_limit = (5, 20) # Tokens per second and burst for everything the bot answers in a guild...
+channel_rate_limit = (2, 10) # ...in a channel...
+user_rate_limit = (0.5, 4) # ...and to the commands of a user
+autoreact_reserve = 0.5 # Autoreacts leave this share of the guild and channel buckets to commands
+blocking_workers = 4
+ops_timeout = 120 # Seconds before git or systemctl are killed
+event_loop_lag_interval = 0.5
+lean_message_cache_size = 250 # Recent messages kept by discord.py with the lean cache profile
+supervisor_metrics_interval = 10
+message_max_length = 2000
+weather_conditions = ( # Lowest condition id, emoji by day, emoji by night (None for the moon)
+    (200, ":thunder_cloud_rain:", ":thunder_cloud_rain:"),
+    (300, ":cloud_rain:", ":cloud_rain:"),
+    (600, ":cloud_snow:", ":cloud_snow:"),
+    (800, ":sunny:", None),
+    (801, ":white_sun_small_cloud:", ":cloud:"),
+    (802, ":white_sun_cloud:", ":cloud:"),
+    (803, ":white_sun_cloud:", ":cloud:"),
+    (804, ":cloud:", ":cloud:"),
+)
+weather_condition_ids = [condition[0] for condition in weather_conditions]
+announcement_check_interval = 20
+announcement_prefetch_delay = 5 * 60 # Weather is fetched this long before its announcement...
+announcement_prefetch_ttl = 15 * 60 # ...and kept this long for on-demand requests
+announcement_late_delay = 10 * 60 # Announcements missed by more than this are skipped
+default_announcement_times = {"meteo": "08:00", "weekend": "17:00"}
+
+# cost: "light" or "heavy", cooldown: seconds between two runs in a guild,
+# blocking: may stall its caller for long, so it gets its own slots rather than holding the guild's
+Command = namedtuple("Command", ["name", "callback", "cost", "cooldown", "blocking"])
+
+def command(*aliases, cost = "light", cooldown = 0, blocking = False):
+    def decorate(callback):
+        callback.command_options = {"aliases": aliases, "cost": cost, "cooldown": cooldown, "blocking": blocking}
+        return callback
+    return decorate
+
+def register_commands(cls):
+    # Every on_message_<name> method is a command, reachable by its name and aliases
+    cls.commands = {}
+    for attribute_name, callback in list(vars(cls).items()):
+        if attribute_name.startswith("on_message_"):
+            options = getattr(callback, "command_options", {})
+            name = attribute_name[len("on_message_"):]
+            cmd = Command(name, callback, options.get("cost", "light"), options.get("cooldown", 0), options.get("blocking", False))
+            for word in (name, *options.get("aliases", ())):
+                cls.commands[word] = cmd
+    return cls
+
+class AccentTable(dict):
+    # Code point -> ASCII replacement, computed the first time each code point is met
+    def __missing__(self, code):
+        c = chr(code)
+        self[code] = (c if re.search(native_emoji_regex, c)
+            else unicodedata.normalize('NFKD', c).encode('ASCII', 'ignore').decode('ascii'))
+        return self[code]
+
+accent_table = AccentTable()
 
 def remove_accents(str):
-    return "".join(map(lambda c:
-        c if re.search(native_emoji_regex, c)
-        else unicodedata.normalize('NFKD', c).encode('ASCII', 'ignore').decode('ascii'), str))
+    return str if str.isascii() else str.translate(accent_table)
+
+def split_line(line, limit):
+    # Cut over-long lines between words, or at least never inside a custom emoji
+    while len(line) > limit:
+        cut = line.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            cut = line.rfind("<", 0, limit)
+            if cut <= 0 or line.rfind(">", cut, limit) != -1:
+                cut = limit
+        yield line[:cut]
+        line = line[cut:].lstrip(" ")
+    yield line
+
+def split_message(contents, limit = message_max_length):
+    # Line by line in linear time; a code block cut between two chunks is closed and reopened
+    fence = "```"
+    chunks = []
+    chunk_lines = []
+    chunk_length = 0 # Length of the lines joined, plus one
+    in_fence = False
+    fence_start = None # Index in chunk_lines of the line that opened the current code block
+    for line in contents.split("\n"):
+        for piece in split_line(line, limit - 2 * (len(fence) + 1)):
+            fence_after = in_fence != (piece.count(fence) % 2 == 1)
+            closing_length = len(fence) + 1 if fence_after else 0 # Room for closing the block this piece leaves open
+            if chunk_lines and chunk_length + len(piece) + closing_length > limit:
+                reopen_line = fence
+                if in_fence and fence_start == len(chunk_lines) - 1 and re.search("^```\\w*$", chunk_lines[-1]):
+                    # Nothing in the block yet: it moves to the next chunk rather than leaving an empty one behind
+                    opening_line = chunk_lines.pop()
+                    if len(opening_line) + 1 + len(piece) + closing_length <= limit:
+                        reopen_line = opening_line
+                    chunks.append("\n".join(chunk_lines))
+                else:
+                    chunks.append("\n".join(chunk_lines + ([fence] if in_fence else [])))
+                chunk_lines = [reopen_line] if in_fence else []
+                chunk_length = len(reopen_line) + 1 if in_fence else 0
+                fence_start = 0 if in_fence else None
+            if fence_after and not in_fence:
+                fence_start = len(chunk_lines)
+            chunk_lines.append(piece)
+            chunk_length += len(piece) + 1
+            in_fence = fence_after
+    if chunk_lines:
+        chunks.append("\n".join(chunk_lines))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+class MessageEditor:
+    # Coalesces edits of one message: the latest content wins and unchanged contents are not sent
+    def __init__(self, message):
+        self.message = message
+        self.content = message.content
+        self.pending = None
+        self.task = None
+
+    def edit(self, content):
+        if content == (self.pending if self.pending is not None else self.content):
+            metrics.count("skipped_edits", "message")
+            return
+        if self.pending is not None:
+            metrics.count("skipped_edits", "message") # Replaced before being sent
+        self.pending = content
+        if not self.task or self.task.done():
+            self.task = asyncio.ensure_future(self.send_edits())
+
+    async def send_edits(self):
+        while self.pending is not None:
+            content, self.pending = self.pending, None
+            self.content = content # Already sent as far as the next edits are concerned
+            await self.message.edit(content = content)
+
+    async def flush(self):
+        if self.task:
+            await self.task
+
+def parse_announcement_time(text):
+    # "7h30" or "07:30" -> "07:30", None when it isn't a time of day
+    time_match = re.search("^(\\d{1,2})[:h](\\d{2})$", text)
+    if not time_match or int(time_match.group(1)) > 23 or int(time_match.group(2)) > 59:
+        return None
+    return f"{int(time_match.group(1)):02}:{time_match.group(2)}"
+
+class Histogram:
+    # Log-scaled buckets 2% wide, as in HDR histograms: the same relative precision at any magnitude
+    bucket_base = math.log(1.02)
+
+    def __init__(self):
+        self.buckets = defaultdict(lambda: 0)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def record(self, value):
+        self.buckets[math.floor(math.log(max(value, 1e-6)) / self.bucket_base)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= self.count * percent / 100:
+                return min(self.max, math.exp((bucket + 1) * self.bucket_base))
+        return self.max
+
+class Metrics:
+    # Latency histograms and gauges, keyed by (kind, name): ("command", "meteo"), ("outbound", "openweather")...
+    percentiles = (50, 95, 99)
+
+    def __init__(self):
+        self.histograms = defaultdict(Histogram)
+        self.gauges = {}
+        self.counters = defaultdict(lambda: 0)
+
+    def record(self, kind, name, seconds):
+        self.histograms[(kind, name)].record(seconds)
+
+    @contextmanager
+    def measure(self, kind, name):
+        time_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, name, time.perf_counter() - time_start)
+
+    def set_gauge(self, kind, name, get_value):
+        self.gauges[(kind, name)] = get_value
+
+    def count(self, kind, name, amount = 1):
+        self.counters[(kind, name)] += amount
+
+    def get_state(self):
+        # Raw buckets rather than percentiles, so that states from several processes can be merged
+        return {
+            "histograms": [(kind, name, dict(h.buckets), h.count, h.sum, h.max) for (kind, name), h in self.histograms.items()],
+            "gauges": [(kind, name, get_value()) for (kind, name), get_value in self.gauges.items()],
+            "counters": list(self.counters.items()),
+        }
+
+    def merge(self, state):
+        for kind, name, buckets, count, sum, max_value in state["histograms"]:
+            h = self.histograms[(kind, name)]
+            for bucket, bucket_count in buckets.items():
+                h.buckets[bucket] += bucket_count
+            h.count += count
+            h.sum += sum
+            h.max = max(h.max, max_value)
+        for kind, name, value in state["gauges"]: # Members, messages or memory of several workers add up
+            previous = self.gauges.get((kind, name))
+            total = value + previous() if previous else value
+            self.set_gauge(kind, name, lambda total = total: total)
+        for key, value in state["counters"]:
+            self.counters[key] += value
+
+    def to_json(self):
+        return {
+            "histograms": [{"kind": kind, "name": name, "count": h.count, "sum": h.sum, "max": h.max,
+                **{f"p{p}": h.percentile(p) for p in self.percentiles}} for (kind, name), h in self.histograms.items()],
+            "gauges": [{"kind": kind, "name": name, "value": get_value()} for (kind, name), get_value in self.gauges.items()],
+            "counters": [{"kind": kind, "name": name, "value": value} for (kind, name), value in self.counters.items()],
+        }
+
+    def to_prometheus(self):
+        lines = []
+        for kind in sorted(set(kind for kind, name in self.histograms)):
+            lines.append(f"# TYPE grocha_{kind}_seconds summary")
+            for (k, name), h in self.histograms.items():
+                if k == kind:
+                    lines += [f'grocha_{kind}_seconds{{name="{name}",quantile="{p / 100}"}} {h.percentile(p)}' for p in self.percentiles]
+                    lines.append(f'grocha_{kind}_seconds_sum{{name="{name}"}} {h.sum}')
+                    lines.append(f'grocha_{kind}_seconds_count{{name="{name}"}} {h.count}')
+        for kind in sorted(set(kind for kind, name in self.gauges)):
+            lines.append(f"# TYPE grocha_{kind} gauge")
+            lines += [f'grocha_{kind}{{name="{name}"}} {get_value()}' for (k, name), get_value in self.gauges.items() if k == kind]
+        for kind in sorted(set(kind for kind, name in self.counters)):
+            lines.append(f"# TYPE grocha_{kind}_total counter")
+            lines += [f'grocha_{kind}_total{{name="{name}"}} {value}' for (k, name), value in self.counters.items() if k == kind]
+        return "\n".join(lines) + "\n"
+
+    def render(self, path):
+        # /metrics in Prometheus text format, /metrics.json as JSON
+        if path == "/metrics.json":
+            return json.dumps(self.to_json()), "application/json"
+        return self.to_prometheus(), "text/plain; version=0.0.4"
+
+    async def serve(self, port):
+        # Bare-bones HTTP endpoint on the event loop
+        async def handle(reader, writer):
+            request_line = (await reader.readline()).decode(errors = "ignore").split()
+            body, content_type = self.render(request_line[1] if len(request_line) > 1 else "/metrics")
+            body = body.encode()
+            writer.write(f"HTTP/1.0 200 OK\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+            writer.close()
+        return await asyncio.start_server(handle, "127.0.0.1", port)
+
+    async def watch_event_loop_lag(self):
+        while True:
+            time_start = time.perf_counter()
+            await asyncio.sleep(event_loop_lag_interval)
+            self.record("event_loop", "lag", time.perf_counter() - time_start - event_loop_lag_interval)
+
+metrics = Metrics()
+
+def serve_merged_metrics(port, get_states):
+    # The supervisor's loop blocks waiting for its workers, so its endpoint answers from a thread
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            merged_metrics = Metrics()
+            for state in get_states():
+                merged_metrics.merge(state)
+            body, content_type = merged_metrics.render(self.path)
+            body = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+def get_rss_mb():
+    # Resident memory, Linux only
+    with open("/proc/self/statm") as statm:
+        return round(int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+
+class CachedQuery:
+    # Keeps results for a while and makes concurrent requests for the same key share a single fetch
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.in_flight = {}
+
+    async def get(self, key, fetch, ttl = None, refresh = False):
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic() and not refresh:
+            return entry[1]
+
+        if not key in self.in_flight:
+            self.in_flight[key] = asyncio.ensure_future(fetch())
+            self.in_flight[key].add_done_callback(lambda task: self.in_flight.pop(key, None))
+        value = await asyncio.shield(self.in_flight[key])
+
+        now = time.monotonic()
+        if len(self.entries) > 1000: # Forget expired entries once in a while
+            self.entries = {k: e for k, e in self.entries.items() if e[0] > now}
+        self.entries[key] = (now + (ttl or self.ttl), value)
+        return value
+
+async def run_process(args, on_output = None, timeout = ops_timeout):
+    # Output and errors together, passed on as they come; the process and its children are killed when it takes too long
+    process = await asyncio.create_subprocess_exec(*args, stdout = asyncio.subprocess.PIPE, stderr = asyncio.subprocess.STDOUT, start_new_session = True)
+    output = ""
+    async def read_output():
+        nonlocal output
+        async for line in process.stdout:
+            output += line.decode(errors = "replace")
+            if on_output:
+                on_output(output.strip())
+        await process.wait()
+    try:
+        await asyncio.wait_for(read_output(), timeout)
+    except asyncio.TimeoutError:
+        os.killpg(process.pid, signal.SIGKILL)
+        await process.wait()
+        output += f"\n(killed after {timeout}s)"
+    return output.strip()
+
+class WebClient:
+    # A single pooled HTTP session, created lazily since it must live on the running event loop
+    def __init__(self, timeout = web_timeout):
+        self.timeout = timeout
+        self.session = None
+
+    async def json_query(self, url, timeout = None, name = "web"):
+        if not self.session or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout = aiohttp.ClientTimeout(total = self.timeout))
+        with metrics.measure("outbound", name):
+            async with self.session.get(url, timeout = aiohttp.ClientTimeout(total = timeout or self.timeout)) as response:
+                response.raise_for_status()
+                return await response.json(content_type = None)
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+
+class OpenWeatherClient:
+    def __init__(self, web_client, base_url = openweather_base_url):
+        self.web_client = web_client
+        self.base_url = base_url
+        self.geocode_cache = CachedQuery(geocode_ttl) # Cities don't move much
+        self.onecall_cache = CachedQuery(onecall_ttl)
+
+    async def geocode(self, query):
+        return await self.geocode_cache.get(query.lower(), lambda: self.web_client.json_query(
+            f"{self.base_url}/geo/1.0/direct?q={parse.quote_plus(query)}&limit=1&appid={config.OPENWEATHER_KEY}", name = "openweather"))
+
+    async def forecast(self, lat, lon, prefetch_ttl = None):
+        # Prefetching fetches fresh data and keeps it for prefetch_ttl instead of the usual delay
+        lat, lon = round(lat, 2), round(lon, 2) # ~1km, close enough for a forecast
+        async def fetch():
+            return WeatherForecast(await self.web_client.json_query(
+                f"{self.base_url}/data/2.5/onecall?lat={lat}&lon={lon}&units=metric&lang=fr&appid={config.OPENWEATHER_KEY}", name = "openweather"))
+        return await self.onecall_cache.get((lat, lon), fetch, prefetch_ttl, refresh = prefetch_ttl is not None)
+
+class IntervalLookup:
+    # Value of the first (start, end, value) interval strictly containing a point, found by bisection:
+    # the answer is precomputed for every bound and for every segment between two bounds
+    def __init__(self, intervals, default):
+        def find(x):
+            return next((value for start, end, value in intervals if start < x and x < end), default)
+        self.bounds = sorted(set(bound for start, end, value in intervals for bound in (start, end)))
+        self.at_bounds = list(map(find, self.bounds))
+        self.between_bounds = [default] + [find((a + b) / 2) for a, b in zip(self.bounds, self.bounds[1:])] + [default]
+
+    def get(self, x):
+        i = bisect_left(self.bounds, x)
+        if i < len(self.bounds) and self.bounds[i] == x:
+            return self.at_bounds[i]
+        return self.between_bounds[i]
+
+class WeatherForecast:
+    # A onecall payload parsed once: sun and moon intervals ready for bisection, rendered reports kept
+    def __init__(self, weather):
+        self.weather = weather
+        self.timezone = timezone(timedelta(seconds=weather['timezone_offset']))
+        self.reports = {}
+        self.day_time = IntervalLookup([(d['sunrise'], d['sunset'], True) for d in weather['daily']], False)
+        moon_phase_emojis = {1: ":first_quarter_moon:", 2: ":full_moon:", 3: ":last_quarter_moon:"}
+        self.night_sky = IntervalLookup([(d['moonrise'], d['moonset'], moon_phase_emojis.get(round(d["moon_phase"] * 4), ":new_moon:"))
+            for d in weather['daily']], ":night_with_stars:") # No moon in the sky
+
+    def get_datetime(self, dt):
+        return datetime.fromtimestamp(dt, self.timezone)
+
+    def is_day_time(self, dt):
+        return self.day_time.get(dt)
+
+    def get_night_sky_emoji(self, dt):
+        return self.night_sky.get(dt)
+
+    def get_weather_emoji(self, dt, id):
+        # Take the condition with the highest id equal or below id
+        i = bisect_right(weather_condition_ids, id) - 1
+        if i < 0:
+            return None
+        condition_id, day_emoji, night_emoji = weather_conditions[i]
+        if self.is_day_time(dt):
+            return day_emoji
+        return night_emoji or self.get_night_sky_emoji(dt)
+
+    def get_temp(self, temp_block):
+        if type(temp_block) == dict:
+            return f"{round(min(temp_block.values()))}°/{round(max(temp_block.values()))}°".rjust(6)
+        else:
+            return f"{format(temp_block, '.1f')}°".rjust(6)
+
+    def get_weather_desc(self, weather_block, temp_type):
+        return f"{self.get_weather_emoji(weather_block['dt'], weather_block['weather'][0]['id'])}`{self.get_temp(weather_block[temp_type])}`"
+
+    def render(self, city_name, temp_type):
+        # The report only depends on the payload, so it is built once per city name and temperature type
+        if not (city_name, temp_type) in self.reports:
+            self.reports[(city_name, temp_type)] = self.build_report(city_name, temp_type)
+        return self.reports[(city_name, temp_type)]
+
+    def build_report(self, city_name, temp_type):
+        weather = self.weather
+        current_time = weather['current']['dt']
+        current_date = self.get_datetime(current_time)
+
+        response = [f"MAOU-téo:"]
+        response.append(f"En ce moment à {city_name} ({current_date}) : {self.get_weather_desc(weather['current'], temp_type)}")
+
+        # Rain in the next hour
+        active_minutely = list(filter(lambda m: m['precipitation'] > 0, weather['minutely']))
+        if len(active_minutely) > 0:
+            minutes_to_rain = round((active_minutely[0]['dt'] - current_time) / 60)
+            if minutes_to_rain > 0:
+                response.append(f"Pluie dans {minutes_to_rain} minutes :umbrella:")
+            else:
+                inactive_minutely = list(filter(lambda m: m['precipitation'] == 0, weather['minutely']))
+                if len(inactive_minutely) > 0:
+                    minutes_to_clear = round((inactive_minutely[0]['dt'] - current_time) / 60)
+                    response.append(f"La pluie s'arrêtera dans {minutes_to_clear} minutes :umbrella:")
+                else:
+                    response.append(f"La pluie s'arrêtera dans plus d'une heure :umbrella:")
+        else:
+            response.append(f"Pas de pluie prévue dans l'heure :muscle:")
+
+        # Weather per hour
+        response.append("")
+        def get_weather_for_hour(hour):
+            weather_block = weather['hourly'][hour]
+            date = self.get_datetime(weather_block['dt'])
+            return f"`{format(date.hour, '0>2')}h:`{self.get_weather_desc(weather_block, temp_type)}"
+        for hour in range(0, min(16, len(weather['hourly'])), 4):
+            response.append(" ".join([get_weather_for_hour(h) for h in range(hour, hour + 4)]))
+
+        # Weather per day
+        response.append("")
+        day_name = ("Lun", "Mar", "Mer", "Jeu", "Ven", "Sam", "Dim")
+        def get_weather_for_day(day):
+            weather_block = weather['daily'][day]
+            date = self.get_datetime(weather_block['dt'])
+            return f"`{day_name[date.weekday()]}:`{self.get_weather_desc(weather_block, temp_type)}"
+        response.append(" ".join([get_weather_for_day(day) for day in range(min(6, len(weather['daily'])))]))
+
+        return "\n".join(response)
+
+class WiktionaryClient:
+    def __init__(self, web_client, cache_file_name = wiktionary_cache_file_name, word_list_file_name = None, executor = None):
+        self.web_client = web_client
+        self.executor = executor
+        self.cache_file_name = cache_file_name
+        self.in_flight = CachedQuery(60)
+        self.save_lock = asyncio.Lock()
+
+        # Accent-stripped lowercase word -> wiktionary url, or None when the word isn't in it
+        try:
+            with open(self.cache_file_name, "r") as cache_file:
+                self.cache = json.load(cache_file)
+        except (FileNotFoundError, ValueError): # A damaged cache is only lost lookups
+            self.cache = {}
+
+        # Optional local word list, one word per line: known words need no lookup at all.
+        # It can hold hundreds of thousands of words, so it is read off the event loop when first needed
+        self.word_list_file_name = word_list_file_name
+        self.word_list = {}
+        self.word_list_load = None
+
+    def read_word_list(self):
+        word_list = {}
+        with open(self.word_list_file_name, "r", encoding = "utf-8") as word_list_file:
+            for line in word_list_file:
+                word = line.strip().lower()
+                if word:
+                    word_list.setdefault(remove_accents(word), word)
+        return word_list
+
+    async def get_word_list(self):
+        if self.word_list_file_name and not self.word_list_load:
+            self.word_list_load = asyncio.get_running_loop().run_in_executor(self.executor, self.read_word_list)
+        if self.word_list_load:
+            self.word_list = await asyncio.shield(self.word_list_load)
+        return self.word_list
+
+    async def save_cache(self):
+        # One write at a time, aside then renamed; the temp name is per process since shard workers share the file
+        def write_cache(cache_contents):
+            temp_file_name = f"{self.cache_file_name}.{os.getpid()}.tmp"
+            with open(temp_file_name, "w") as cache_file:
+                cache_file.write(cache_contents)
+            os.replace(temp_file_name, self.cache_file_name)
+        async with self.save_lock:
+            await asyncio.get_running_loop().run_in_executor(None, write_cache, json.dumps(self.cache))
+
+    async def find_word(self, word):
+        key = remove_accents(word).lower()
+        word_list = await self.get_word_list()
+        if key in word_list:
+            return f"https://fr.wiktionary.org/wiki/{parse.quote(word_list[key])}"
+        if key in self.cache:
+            return self.cache[key]
+
+        async def search():
+            wik_search = await self.web_client.json_query(f"https://fr.wiktionary.org/w/api.php?action=query&list=search&srsearch={parse.quote_plus(key)}&format=json", wiktionary_timeout, "wiktionary")
+            for result in wik_search["query"]["search"]:
+                if remove_accents(result["title"]) == key:
+                    return f"https://fr.wiktionary.org/wiki/{result['title']}"
+            return None
+
+        try:
+            self.cache[key] = await self.in_flight.get(key, search)
+        except Exception:
+            return None # Network trouble isn't a miss, don't remember it
+        await self.save_cache()
+        return self.cache[key]
+
+def to_bitset(indices, size):
+    bitmap = bytearray((size + 7) // 8)
+    for n in indices:
+        bitmap[n >> 3] |= 1 << (n & 7)
+    return int.from_bytes(bitmap, "little")
+
+def grodle_feedback(word, grodle):
+    # Per letter: 2 at the right place, 1 elsewhere in the grodle, 0 absent or already accounted for
+    feedback = [2 if w == g else 0 for w, g in zip(word, grodle)]
+    remaining = Counter(g for g, f in zip(grodle, feedback) if not f)
+    for i, w in enumerate(word):
+        if not feedback[i] and remaining[w] > 0:
+            feedback[i] = 1
+            remaining[w] -= 1
+    return feedback
+
+class GrodleIndex:
+    # Words grouped by length, the n-th word of a length being bit n of that length's bitsets.
+    # Narrowing the candidates down to what some feedback allows is then a few big integer ANDs.
+    def __init__(self, words):
+        words_by_length = defaultdict(list)
+        for word in set(map(lambda w: w.upper(), words)):
+            if re.search("^[A-Z]+$", word):
+                words_by_length[len(word)].append(word)
+
+        self.words = {}
+        self.all_words = {}
+        self.at_position = {} # (length, position, letter) -> words with that letter there
+        self.at_least = {} # (length, letter, count) -> words with at least count times that letter
+        for length, length_words in words_by_length.items():
+            positions = defaultdict(list)
+            counts = defaultdict(list)
+            for n, word in enumerate(length_words):
+                for i, letter in enumerate(word):
+                    positions[(length, i, letter)].append(n)
+                for letter, count in Counter(word).items():
+                    for k in range(1, count + 1):
+                        counts[(length, letter, k)].append(n)
+            self.words[length] = set(length_words)
+            self.all_words[length] = (1 << len(length_words)) - 1
+            self.at_position.update((key, to_bitset(indices, len(length_words))) for key, indices in positions.items())
+            self.at_least.update((key, to_bitset(indices, len(length_words))) for key, indices in counts.items())
+
+    def contains(self, word):
+        return word in self.words.get(len(word), ())
+
+    def narrow(self, candidates, word, feedback):
+        length = len(word)
+        for i, (letter, f) in enumerate(zip(word, feedback)):
+            position_words = self.at_position.get((length, i, letter), 0)
+            candidates &= position_words if f == 2 else ~position_words
+        for letter in set(word):
+            found = sum(1 for l, f in zip(word, feedback) if l == letter and f)
+            if found:
+                candidates &= self.at_least.get((length, letter, found), 0)
+            if found < word.count(letter): # A black square means there are no more of this letter
+                candidates &= ~self.at_least.get((length, letter, found + 1), 0)
+        return candidates
+
+    def count_candidates(self, guesses, grodle):
+        candidates = self.all_words.get(len(grodle), 0)
+        for guess in guesses:
+            candidates = self.narrow(candidates, guess, grodle_feedback(guess, grodle))
+        return bin(candidates).count("1")
+
+class WordMatcher:
+    # Aho-Corasick automaton finding every word starting a word of the text, in one pass over it
+    def __init__(self, words = ()):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+        self.dirty = False
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        node = 0
+        for c in word:
+            if not c in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(set())
+                self.goto[node][c] = len(self.goto) - 1
+            node = self.goto[node][c]
+        self.output[node].add(word)
+        self.dirty = True
+
+    def remove(self, word):
+        node = 0
+        for c in word:
+            node = self.goto[node].get(c)
+            if node is None:
+                return
+        self.output[node].discard(word)
+        self.dirty = True
+
+    def build(self):
+        # Failure links only change when words do, so they are recomputed lazily before the next search
+        queue = list(self.goto[0].values())
+        for node in queue:
+            self.fail[node] = 0
+        for node in queue:
+            for c, child in self.goto[node].items():
+                fail = self.fail[node]
+                while fail and not c in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(c, 0)
+                queue.append(child)
+        self.dirty = False
+
+    def find(self, text):
+        if self.dirty:
+            self.build()
+        found = set()
+        node = 0
+        for i, c in enumerate(text):
+            while node and not c in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(c, 0)
+            match_node = node
+            while match_node:
+                for word in self.output[match_node]:
+                    start = i - len(word) + 1
+                    if start == 0 or not (text[start - 1].isalnum() or text[start - 1] == "_"):
+                        found.add(word)
+                match_node = self.fail[match_node]
+        return found
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self):
+        async with self.lock: # Waiters are served in order
+            while True:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def try_acquire_all(buckets, cost = 1, reserve = 0):
+    # Takes cost tokens from every bucket or from none, leaving at least reserve of each bucket's capacity
+    for bucket in buckets:
+        bucket.refill()
+    if not all(bucket.tokens - cost >= reserve * bucket.capacity for bucket in buckets):
+        return False
+    for bucket in buckets:
+        bucket.tokens -= cost
+    return True
+
+class HistoryReader:
+    # Pages through several channels at once, every REST call paced by a shared token bucket
+    def __init__(self, token_bucket, channel_concurrency = history_channel_concurrency, page_size = history_page_size):
+        self.token_bucket = token_bucket
+        self.channel_concurrency = channel_concurrency
+        self.page_size = page_size
+
+    async def read(self, channel_cursors, on_page, on_channel_done = None):
+        # channel_cursors: list of (channel, message id to read before, or None for the most recent)
+        # on_page(channel, messages) is awaited for each page, newest messages first
+        queue = asyncio.Queue()
+        for channel_cursor in channel_cursors:
+            queue.put_nowait(channel_cursor)
+
+        async def read_channels():
+            while not queue.empty():
+                channel, before = queue.get_nowait()
+                while True:
+                    await self.token_bucket.acquire()
+                    messages = await channel.history(limit = self.page_size, before = before and discord.Object(id = before), oldest_first = False).flatten()
+                    if messages:
+                        await on_page(channel, messages)
+                        before = messages[-1].id
+                    if len(messages) < self.page_size:
+                        break
+                if on_channel_done:
+                    await on_channel_done(channel)
+
+        await asyncio.gather(*[read_channels() for i in range(min(self.channel_concurrency, queue.qsize()))])
+
+def set_in(data, path, value):
+    for key in path[:-1]:
+        data = data.setdefault(key, {})
+    data[path[-1]] = value
+
+def delete_in(data, path):
+    for key in path[:-1]:
+        data = data.get(key, {})
+    data.pop(path[-1], None)
+
+class JsonGuildMemory:
+    # JSON snapshot plus an append-only journal of changes since it was written.
+    # Each change costs one small append; snapshots are written in the background after a quiet delay.
+    def __init__(self, file_name, flush_delay = memory_flush_delay):
+        self.file_name = file_name
+        self.journal_file_name = os.path.splitext(file_name)[0] + ".journal"
+        self.flush_delay = flush_delay
+        self.flush_handle = None
+        self.flush_lock = asyncio.Lock()
+        self.write_lock = threading.Lock() # Background flushes and flush_now write from different threads
 
-def json_query(url):
-    return json.loads(request.urlopen(url).read())
+        try:
+            with open(self.file_name, "r") as memory_file:
+                self.data = json.load(memory_file)
+        except FileNotFoundError:
+            self.data = {}
+        self.journal_seq = self.data.pop("_journal_seq", 0)
+        self.snapshot_seq = self.journal_seq
 
+        # Recover changes made after the last snapshot
+        recovered = False
+        try:
+            with open(self.journal_file_name, "r") as journal_file:
+                for line in journal_file:
+                    recovered = True
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break # Torn last line from a crash mid-append
+                    if entry["seq"] > self.journal_seq:
+                        self.apply(entry)
+                        self.journal_seq = entry["seq"]
+        except FileNotFoundError:
+            pass
+
+        self.journal_file = open(self.journal_file_name, "a")
+        if recovered: # Start over from a clean snapshot and an empty journal
+            self.flush_now()
+
+        # Emoji id -> count running totals, so that a leaderboard doesn't walk every day of every user
+        self.emoji_usage_total = defaultdict(lambda: 0)
+        self.emoji_usage_by_channel = defaultdict(lambda: defaultdict(lambda: 0))
+        self.emoji_usage_by_user = defaultdict(lambda: defaultdict(lambda: 0))
+        self.emoji_usage_by_channel_user = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: 0)))
+        for channel_id, channel_usage in self.data.get("emoji_usage", {}).items():
+            for user_id, user_usage in channel_usage.items():
+                for day_usage in user_usage.values():
+                    for emoji_id, count in day_usage.items():
+                        self.add_emoji_usage_totals(channel_id, user_id, emoji_id, count)
+
+    def apply(self, entry):
+        if "value" in entry:
+            set_in(self.data, entry["path"], entry["value"])
+        else:
+            delete_in(self.data, entry["path"])
+
+    def write(self, path, **value):
+        self.journal_seq += 1
+        entry = {"seq": self.journal_seq, "path": path, **value}
+        self.apply(entry)
+        self.journal_file.write(json.dumps(entry) + "\n")
+        self.journal_file.flush()
+        self.schedule_flush()
+
+    def set(self, path, value):
+        self.write(path, value = value)
+
+    def delete(self, path):
+        self.write(path)
+
+    # Autoreact triggers and emoji usage live in the tree here, in tables with SqliteGuildMemory: both go through these
+    async def get_autoreact_emojis(self, words = None):
+        # Trigger -> its emojis, for the given triggers or all of them
+        autoreact = self.data.get("autoreact", {})
+        return {word: list(autoreact[word]) for word in (autoreact if words is None else words) if autoreact.get(word)}
+
+    def set_autoreact(self, word, emoji):
+        self.set(["autoreact", word, emoji], True)
+
+    def delete_autoreact(self, word, emoji = None):
+        word_emojis = self.data.get("autoreact", {}).get(word)
+        if word_emojis is None:
+            return
+        if emoji is None or set(word_emojis) <= {emoji}: # A trigger goes with its last emoji
+            self.delete(["autoreact", word])
+        elif emoji in word_emojis:
+            self.delete(["autoreact", word, emoji])
+
+    def count_emoji_usage(self, channel_id, user_id, day, emoji_id, delta = 1):
+        path = ["emoji_usage", channel_id, user_id, day, emoji_id]
+        count = self.data.get("emoji_usage", {}).get(channel_id, {}).get(user_id, {}).get(day, {}).get(emoji_id, 0)
+        self.set(path, max(0, count + delta))
+        self.add_emoji_usage_totals(channel_id, user_id, emoji_id, max(0, count + delta) - count)
+
+    def add_emoji_usage_totals(self, channel_id, user_id, emoji_id, delta):
+        self.emoji_usage_total[emoji_id] += delta
+        self.emoji_usage_by_channel[channel_id][emoji_id] += delta
+        self.emoji_usage_by_user[user_id][emoji_id] += delta
+        self.emoji_usage_by_channel_user[channel_id][user_id][emoji_id] += delta
+
+    async def get_emoji_usage(self, channel_ids = None, user_ids = None):
+        # Emoji id -> count, only in these channels and from these users when given
+        if channel_ids is None and user_ids is None:
+            totals = [self.emoji_usage_total]
+        elif user_ids is None:
+            totals = [self.emoji_usage_by_channel[c] for c in channel_ids if c in self.emoji_usage_by_channel]
+        elif channel_ids is None:
+            totals = [self.emoji_usage_by_user[u] for u in user_ids if u in self.emoji_usage_by_user]
+        else:
+            totals = [self.emoji_usage_by_channel_user[c][u] for c in channel_ids if c in self.emoji_usage_by_channel_user
+                for u in user_ids if u in self.emoji_usage_by_channel_user[c]]
+        usage = defaultdict(lambda: 0)
+        for total in totals:
+            for emoji_id, count in total.items():
+                usage[emoji_id] += count
+        return usage
+
+    def schedule_flush(self):
+        if self.flush_handle:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self.flush_now()
+        self.flush_handle = loop.call_later(self.flush_delay, lambda: asyncio.ensure_future(self.flush()))
+
+    def write_snapshot(self, contents, seq):
+        # Write aside then rename, so the snapshot on disk is always complete. A background flush
+        # overtaken by flush_now would put older contents back, it is dropped instead
+        temp_file_name = self.file_name + ".tmp"
+        with self.write_lock, metrics.measure("outbound", "disk"):
+            if seq < self.snapshot_seq:
+                return
+            with open(temp_file_name, "w") as memory_file:
+                memory_file.write(contents)
+                memory_file.flush()
+                os.fsync(memory_file.fileno())
+            os.replace(temp_file_name, self.file_name)
+            self.snapshot_seq = seq
+
+    def truncate_journal(self, seq):
+        # Changes made while the snapshot was written stay in the journal until the next one
+        if self.journal_seq == seq:
+            self.journal_file.close()
+            self.journal_file = open(self.journal_file_name, "w")
+
+    async def flush(self):
+        self.flush_handle = None
+        async with self.flush_lock:
+            seq = self.journal_seq
+            contents = json.dumps({**self.data, "_journal_seq": seq})
+            await asyncio.get_running_loop().run_in_executor(None, self.write_snapshot, contents, seq)
+            self.truncate_journal(seq)
+
+    def flush_now(self):
+        if self.flush_handle:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        seq = self.journal_seq
+        self.write_snapshot(json.dumps({**self.data, "_journal_seq": seq}), seq)
+        self.truncate_journal(seq)
+
+class SqliteGuildMemory:
+    # One row per leaf of the memory tree, keyed by its path (keys joined by \x1f), so that a vote
+    # or a grodle letter is a single indexed row. The tree is read once at startup; writes are applied
+    # to it right away and run in order on a dedicated database thread.
+    # Autoreact triggers and emoji usage grow with the server: they have tables of their own, never
+    # loaded whole, and are queried on the database thread after the writes submitted before.
+    emoji_usage_upsert = ("INSERT INTO emoji_usage (channel_id, user_id, day, emoji_id, count) VALUES (?1, ?2, ?3, ?4, max(0, ?5)) "
+        "ON CONFLICT (channel_id, user_id, day, emoji_id) DO UPDATE SET count = max(0, count + ?5)")
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.executor = ThreadPoolExecutor(max_workers = 1)
+        self.connection = sqlite3.connect(file_name, check_same_thread = False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS memory (path TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS autoreact (word TEXT NOT NULL, emoji TEXT NOT NULL, PRIMARY KEY (word, emoji))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS emoji_usage (channel_id TEXT NOT NULL, user_id TEXT NOT NULL, day TEXT NOT NULL, "
+                "emoji_id TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (channel_id, user_id, day, emoji_id))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS emoji_usage_by_user ON emoji_usage (user_id, channel_id)")
+            self.move_to_tables()
+
+        self.data = {}
+        for path, value in self.connection.execute("SELECT path, value FROM memory ORDER BY path"):
+            path = path.split("\x1f")
+            value = json.loads(value)
+            if value == {}: # Empty branch, keep whatever children came before it
+                value = self.get(path[:-1]).get(path[-1], {})
+            set_in(self.data, path, value)
+
+    def move_to_tables(self):
+        # Files from before the tables kept autoreact and emoji usage in the tree
+        autoreact_rows, emoji_usage_rows = [], []
+        for path, value in self.connection.execute("SELECT path, value FROM memory WHERE path >= 'autoreact' AND path < 'autoreact\x20' OR path >= 'emoji_usage' AND path < 'emoji_usage\x20'"):
+            path = path.split("\x1f")
+            value = json.loads(value)
+            if path[0] == "autoreact" and len(path) == 3:
+                autoreact_rows.append(tuple(path[1:]))
+            elif path[0] == "emoji_usage" and len(path) == 5 and isinstance(value, int):
+                emoji_usage_rows.append((*path[1:], value))
+        self.connection.executemany("INSERT OR IGNORE INTO autoreact (word, emoji) VALUES (?, ?)", autoreact_rows)
+        self.connection.executemany(self.emoji_usage_upsert, emoji_usage_rows)
+        self.connection.execute("DELETE FROM memory WHERE path >= 'autoreact' AND path < 'autoreact\x20' OR path >= 'emoji_usage' AND path < 'emoji_usage\x20'")
+
+    def get(self, path):
+        data = self.data
+        for key in path:
+            data = data.setdefault(key, {})
+        return data
+
+    def get_rows(self, path, value):
+        if isinstance(value, dict) and value:
+            return [row for key, child in value.items() for row in self.get_rows(path + [key], child)]
+        return [("\x1f".join(path), json.dumps(value))]
+
+    def write_rows(self, path, rows):
+        path = "\x1f".join(path)
+        with metrics.measure("outbound", "disk"), self.connection:
+            self.connection.execute("DELETE FROM memory WHERE path = ? OR (path >= ? AND path < ?)", (path, path + "\x1f", path + "\x20"))
+            self.connection.executemany("INSERT OR REPLACE INTO memory (path, value) VALUES (?, ?)", rows)
+
+    def write_sql(self, sql, rows):
+        with metrics.measure("outbound", "disk"), self.connection:
+            self.connection.executemany(sql, rows)
+
+    def submit(self, write, *args):
+        future = self.executor.submit(write, *args)
+        future.add_done_callback(lambda f: f.exception() and traceback.print_exception(f.exception()))
+
+    async def query(self, sql, parameters = ()):
+        def fetch():
+            with metrics.measure("outbound", "disk"):
+                return self.connection.execute(sql, parameters).fetchall()
+        return await asyncio.wrap_future(self.executor.submit(fetch))
+
+    def set(self, path, value):
+        set_in(self.data, path, value)
+        self.submit(self.write_rows, path, self.get_rows(path, value))
+
+    def delete(self, path):
+        delete_in(self.data, path)
+        self.submit(self.write_rows, path, [])
+
+    async def get_autoreact_emojis(self, words = None):
+        if words is None:
+            rows = await self.query("SELECT word, emoji FROM autoreact ORDER BY rowid")
+        else:
+            words = list(words)
+            rows = await self.query(f"SELECT word, emoji FROM autoreact WHERE word IN ({', '.join('?' * len(words))}) ORDER BY rowid", words)
+        autoreact = {}
+        for word, emoji in rows:
+            autoreact.setdefault(word, []).append(emoji)
+        return autoreact
+
+    def set_autoreact(self, word, emoji):
+        self.submit(self.write_sql, "INSERT OR IGNORE INTO autoreact (word, emoji) VALUES (?, ?)", [(word, emoji)])
+
+    def delete_autoreact(self, word, emoji = None):
+        if emoji is None:
+            self.submit(self.write_sql, "DELETE FROM autoreact WHERE word = ?", [(word,)])
+        else:
+            self.submit(self.write_sql, "DELETE FROM autoreact WHERE word = ? AND emoji = ?", [(word, emoji)])
+
+    def count_emoji_usage(self, channel_id, user_id, day, emoji_id, delta = 1):
+        self.add_emoji_usage([(channel_id, user_id, day, emoji_id, delta)])
+
+    def add_emoji_usage(self, rows):
+        # (channel id, user id, day, emoji id, delta) rows, counts never going below 0
+        self.submit(self.write_sql, self.emoji_usage_upsert, rows)
+
+    async def get_emoji_usage(self, channel_ids = None, user_ids = None):
+        conditions, parameters = [], []
+        for column, ids in [("channel_id", channel_ids), ("user_id", user_ids)]:
+            if ids is not None:
+                ids = list(ids)
+                conditions.append(f"{column} IN ({', '.join('?' * len(ids))})")
+                parameters += ids
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return dict(await self.query(f"SELECT emoji_id, SUM(count) FROM emoji_usage {where} GROUP BY emoji_id", parameters))
+
+    def flush_now(self):
+        self.executor.submit(lambda: None).result()
+
+def open_guild_memory(file_name_base):
+    if getattr(config, "MEMORY_BACKEND", "json") == "sqlite":
+        return SqliteGuildMemory(file_name_base + ".sqlite")
+    return JsonGuildMemory(file_name_base + ".json")
+
+def migrate_memory_files():
+    # Import every memory-*.json (and its pending journal) into its SQLite counterpart
+    for file_name in glob.glob("memory-*.json"):
+        file_name_base = os.path.splitext(file_name)[0]
+        json_memory = JsonGuildMemory(file_name)
+        sqlite_memory = SqliteGuildMemory(file_name_base + ".sqlite")
+        for key, value in json_memory.data.items():
+            if key == "autoreact":
+                for word, word_emojis in value.items():
+                    for emoji in word_emojis:
+                        sqlite_memory.set_autoreact(word, emoji)
+            elif key == "emoji_usage":
+                sqlite_memory.add_emoji_usage([(channel_id, user_id, day, emoji_id, count) for channel_id, channel_usage in value.items()
+                    for user_id, user_usage in channel_usage.items() for day, day_usage in user_usage.items() for emoji_id, count in day_usage.items()])
+            else:
+                sqlite_memory.set([key], value)
+        sqlite_memory.flush_now()
+        print(f"Migrated {file_name} to {sqlite_memory.file_name}")
+
+@register_commands
 class GrochaGuild:
     def __init__(self, bot, guild):
         self.bot = bot
         self.user = self.bot.user
         self.server = guild
-        self.memory_file_name = f"memory-{self.server.id}.json"
-        self.greet_messages_in_wait = {}
-        self.kick_messages_in_wait = {}
-        self.chan_welcome = self.get_channel_by_name(config.WELCOME_CHANNEL_NAME)
-        self.chan_main = self.get_channel_by_name(config.MAIN_CHANNEL_NAME)
-        self.chan_debug = self.get_channel_by_name(config.DEBUG_CHANNEL_NAME)
-        self.role_main = self.get_role_by_name(config.MAIN_ROLE_NAME)
-        self.profile_time = defaultdict(lambda: 0)
-        self.profile_count = defaultdict(lambda: 0)
+        self.memory_file_name = f"memory-{self.server.id}"
+        self.index_channels()
+        self.index_roles()
+        self.index_emojis()
+        self.command_last_run = {}
+        self.command_tasks = set()
+        self.command_semaphore = asyncio.Semaphore(command_concurrency)
+        self.blocking_command_semaphore = asyncio.Semaphore(blocking_command_concurrency)
+        self.command_semaphores = {}
+        self.commands_in_flight = set() # Heavy commands running or waiting, by channel and words
+        self.rate_bucket = TokenBucket(*guild_rate_limit)
+        self.channel_rate_buckets = {}
+        self.user_rate_buckets = {}
+        metrics.set_gauge("command_queue_depth", str(self.server.id), lambda: len(self.command_tasks))
+
+        self.emoji_backfill_running = False
+        self.memory_load_time = 0
+        self.announcement_prefetches = {}
 
         if not self.role_main:
             raise Exception(f"<!!> Can't find role named {config.MAIN_ROLE_NAME}")
 
-        self.grant_emoji = self.get_emoji_by_name(config.GRANT_EMOJI_NAME)
-
-        try:
-            with open(self.memory_file_name, "r") as memory_file:
-                self.memory = json.load(memory_file)
-        except FileNotFoundError:
-            self.memory = {}
+    async def load(self):
+        # Reading and parsing the memory file happens off the event loop
+        time_start = time.perf_counter()
+        self.memory_store = await asyncio.get_running_loop().run_in_executor(self.bot.blocking_executor, open_guild_memory, self.memory_file_name)
+        self.memory_load_time = time.perf_counter() - time_start
+        self.memory = self.memory_store.data # Read only, changes go through memory_store
+
+        # Autoreact triggers (word -> emojis) and emoji usage (channel id, user id, day, emoji id -> count)
+        # are only reached through memory_store's own calls
+
+        # Pending greet/kick votes: message id -> {"kind", "members": [ids], "voters": {user id: True}}
+        if not "votes" in self.memory:
+            self.memory_store.set(["votes"], {})
+
+        # Emoji usage: anything older than this message id is left to the backfill
+        if not "emoji_index_start" in self.memory:
+            self.memory_store.set(["emoji_index_start"], (int(time.time() * 1000) - discord.utils.DISCORD_EPOCH) << 22)
+
+        # Grodle games: channel id -> game number -> {"word", "known_letters", "known_absent_letters", "guesses"}
+        if "grodle" in self.memory: # The single game from before, moved to the main channel
+            self.memory_store.set(["grodle_games", str(self.chan_main.id), "1"], {"word": self.memory["grodle"], "known_letters": self.memory.get("grodle_known_letters", {}), "known_absent_letters": self.memory.get("grodle_known_absent_letters", {}), "guesses": []})
+            for key in ["grodle", "grodle_known_letters", "grodle_known_absent_letters"]:
+                self.memory_store.delete([key])
+        for channel_id, channel_games in list(self.memory.get("grodle_games", {}).items()):
+            if "word" in channel_games: # One game per channel, from before games were numbered
+                self.memory_store.set(["grodle_games", channel_id], {"1": channel_games})
+
+        # Cleaning can wait until the first events are answered
+        self.autoreact_matcher = WordMatcher(await self.memory_store.get_autoreact_emojis())
+        asyncio.ensure_future(self.clean())
+
+        self.announcement_task = asyncio.ensure_future(self.run_announcements())
+
+    # Name and id lookups go through dicts rebuilt whenever the gateway reports a change.
+    # Names keep the first match in the server's order, like discord.utils.get did.
+    def index_channels(self):
+        self.channels_by_name = {c.name: c for c in reversed(self.server.channels)}
+        self.chan_welcome = self.get_channel_by_name(config.WELCOME_CHANNEL_NAME)
+        self.chan_main = self.get_channel_by_name(config.MAIN_CHANNEL_NAME)
+        self.chan_debug = self.get_channel_by_name(config.DEBUG_CHANNEL_NAME)
 
-        # Autoreact memory
-        if not "autoreact" in self.memory:
-            self.memory["autoreact"] = {}
+    def index_roles(self):
+        self.roles_by_name = {r.name: r for r in reversed(self.server.roles)}
+        self.role_main = self.get_role_by_name(config.MAIN_ROLE_NAME)
 
-        self.clean()
+    def index_emojis(self):
+        self.emojis_by_name = {e.name: e for e in reversed(self.server.emojis)}
+        self.emojis_by_id = {str(e.id): e for e in self.server.emojis}
+        self.grant_emoji = self.get_emoji_by_name(config.GRANT_EMOJI_NAME)
 
     def get_channel_by_name(self, channel_name):
-        return discord.utils.get(self.server.channels, name = channel_name)
+        return self.channels_by_name.get(channel_name)
 
     def get_role_by_name(self, role_name):
-        return discord.utils.get(self.server.roles, name = role_name)
+        return self.roles_by_name.get(role_name)
 
     def get_emoji_by_name(self, emoji_name):
-        return discord.utils.get(self.server.emojis, name = emoji_name)
+        return self.emojis_by_name.get(emoji_name)
 
     def emoji_to_string(self, emoji):
         if type(emoji) == str:
@@ -90,18 +1219,41 @@ class GrochaGuild:
     def get_text_channels(self):
         return list(filter(lambda c : isinstance(c, discord.channel.TextChannel), self.server.channels))
 
-    def save_memory(self):
-        with open(self.memory_file_name, "w") as memory_file:
-            json.dump(self.memory, memory_file)
+    def get_emoji_by_id(self, emoji_id):
+        return self.emojis_by_id.get(str(emoji_id))
+
+    def count_emoji_usage(self, channel_id, user_id, date, emoji_id, delta = 1):
+        if user_id == self.user.id:
+            return False # Bot reactions are not usage
+        if not self.get_emoji_by_id(emoji_id):
+            return False # Only this server's emojis are counted
+        self.memory_store.count_emoji_usage(str(channel_id), str(user_id), date.strftime("%Y-%m-%d"), str(emoji_id), delta)
+        return True
 
-    def clean(self):
-         # Clean obsolete autoreact words and emojis
-        for word in self.memory["autoreact"].copy():
-            for emoji in self.memory["autoreact"][word].copy():
-                if not self.is_emoji_string(emoji):
-                    self.memory["autoreact"][word].pop(emoji, None)
-            if len(self.memory["autoreact"][word]) == 0:
-                self.memory["autoreact"].pop(word, None)
+    def is_emoji_indexed(self, channel_id, message_id):
+        # Older messages are left to the backfill until it has gone past them, so no reaction is counted twice
+        if message_id >= self.memory["emoji_index_start"]:
+            return True
+        cursor = self.memory.get("emoji_backfill", {}).get(str(channel_id), self.memory["emoji_index_start"])
+        return cursor is None or message_id >= cursor
+
+    def count_message_emoji_usage(self, message):
+        counted = False
+        for emoji_id in re.findall(custom_emoji_id_regex, message.content):
+            counted |= self.count_emoji_usage(message.channel.id, message.author.id, message.created_at, emoji_id)
+        return counted
+
+    async def clean(self):
+        # Clean obsolete autoreact words and emojis
+        words = []
+        for word, word_emojis in (await self.memory_store.get_autoreact_emojis()).items():
+            gone = list(filter(lambda e: not self.is_emoji_string(e), word_emojis))
+            for emoji in gone:
+                self.memory_store.delete_autoreact(word, emoji)
+            if len(gone) < len(word_emojis):
+                words.append(word)
+
+        self.autoreact_matcher = WordMatcher(words)
 
     async def on_ready(self):
         print(f"Connected on Discord server {self.server}")
@@ -109,51 +1261,79 @@ class GrochaGuild:
         sys.stderr.flush()
 
         if self.chan_debug:
-            await self.chan_debug.send(f'MAOOWWWWWW _(I just awakened)_')
+            await self.chan_debug.send(f'MAOOWWWWWW _(I just awakened)_\n`{self.bot.get_startup_timeline()}`')
+
+        await self.reconcile_votes()
 
     async def on_member_join(self, member):
         message = await self.chan_main.send(f"MAOU! **{member.name}** vient d'arriver sur le serveur.\nRéagis à ce message avec l'emoji {self.emoji_to_string(self.grant_emoji)} pour lui donner les droits!")
-        self.greet_messages_in_wait[message.id] = member
-
-    async def on_reaction_add(self, reaction, user):
-        message = reaction.message
-
-        if message.id in self.greet_messages_in_wait.keys():
-            member = self.greet_messages_in_wait[message.id]
-            #print(f"Bienvenue à {member.name} !")
-
-            users_emoji = []
-            for r in message.reactions:
-                if r.emoji == self.grant_emoji:
-                    users = await r.users().flatten()
-                    for u in users:
-                        users_emoji.append(u.name)
-
-            users_emoji = list(set(users_emoji))
-
-            if users_emoji:
-                await member.add_roles(self.role_main, reason=f"Permission accordée par {', '.join(users_emoji)} & Grocha le {(datetime.now() + timedelta(1)).strftime('%Y-%m-%d %H:%M:%S')}")
-                del self.greet_messages_in_wait[message.id]
+        self.memory_store.set(["votes", str(message.id)], {"kind": "greet", "members": [member.id], "voters": {}})
 
-        if message.id in self.kick_messages_in_wait.keys():
-            members = self.kick_messages_in_wait[message.id]
+    def get_vote_threshold(self, kind):
+        return self.memory.get("vote_thresholds", {}).get(kind, default_vote_thresholds[kind])
 
-            users_emoji = []
+    async def reconcile_votes(self):
+        # Catch up with the reactions made while the bot was away, one fetch per pending vote
+        for message_id in list(self.memory["votes"]):
+            try:
+                message = await self.chan_main.fetch_message(int(message_id))
+            except discord.NotFound:
+                self.memory_store.delete(["votes", message_id])
+                continue
+            voters = {}
             for r in message.reactions:
                 if r.emoji == self.grant_emoji:
-                    users = await r.users().flatten()
-                    for u in users:
-                        users_emoji.append(u.name)
-
-            users_emoji = list(set(users_emoji))
-
-            if len(users_emoji) > 2:
-                try:
-                    for m in members:
-                        await self.server.kick(m, reason=f"Utilisateur kické par {', '.join(users_emoji)} & Grocha le {(datetime.now() + timedelta(1)).strftime('%Y-%m-%d %H:%M:%S')}")
-                    del self.kick_messages_in_wait[message.id]
-                except Exception as e:
-                    await self.deal_with_exception(e, message.channel)
+                    voters = {str(u.id): True for u in await r.users().flatten() if u != self.user}
+            if not message_id in self.memory["votes"]: # Settled by a reaction while we were fetching
+                continue
+            self.memory_store.set(["votes", message_id, "voters"], voters)
+            await self.check_vote(message_id)
+
+    async def check_vote(self, message_id):
+        vote = self.memory["votes"][message_id]
+        if len(vote["voters"]) < self.get_vote_threshold(vote["kind"]):
+            return
+
+        self.memory_store.delete(["votes", message_id])
+        members = await self.get_members(vote["members"])
+        voter_names = {str(m.id): m.name for m in await self.get_members(vote["voters"])}
+        voters = list(map(lambda v: voter_names.get(v, v), vote["voters"]))
+        date = (datetime.now() + timedelta(1)).strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            for m in members:
+                if vote["kind"] == "greet":
+                    await m.add_roles(self.role_main, reason=f"Permission accordée par {', '.join(voters)} & Grocha le {date}")
+                else:
+                    await self.server.kick(m, reason=f"Utilisateur kické par {', '.join(voters)} & Grocha le {date}")
+        except Exception as e:
+            await self.deal_with_exception(e, self.chan_main)
+
+    async def get_members(self, member_ids):
+        # The lean cache profile keeps no members, the missing ones are requested from the gateway
+        member_ids = list(map(int, member_ids))
+        members = {m.id: m for m in filter(None, map(self.server.get_member, member_ids))}
+        missing_ids = [i for i in member_ids if not i in members]
+        if missing_ids:
+            members.update((m.id, m) for m in await self.server.query_members(user_ids = missing_ids[:100]))
+        return [members[i] for i in member_ids if i in members]
+
+    # Raw events come for every message, cached or not; usage is booked on the day the message was posted
+    async def on_raw_reaction_add(self, payload):
+        if payload.emoji.id and self.is_emoji_indexed(payload.channel_id, payload.message_id):
+            self.count_emoji_usage(payload.channel_id, payload.user_id, discord.utils.snowflake_time(payload.message_id), payload.emoji.id)
+
+        message_id = str(payload.message_id)
+        if message_id in self.memory["votes"] and self.grant_emoji and payload.emoji.id == self.grant_emoji.id and payload.user_id != self.user.id:
+            self.memory_store.set(["votes", message_id, "voters", str(payload.user_id)], True)
+            await self.check_vote(message_id)
+
+    async def on_raw_reaction_remove(self, payload):
+        if payload.emoji.id and self.is_emoji_indexed(payload.channel_id, payload.message_id):
+            self.count_emoji_usage(payload.channel_id, payload.user_id, discord.utils.snowflake_time(payload.message_id), payload.emoji.id, -1)
+
+        message_id = str(payload.message_id)
+        if message_id in self.memory["votes"] and self.grant_emoji and payload.emoji.id == self.grant_emoji.id:
+            self.memory_store.delete(["votes", message_id, "voters", str(payload.user_id)])
 
     async def on_message(self, message):
         message_is_from_bot = message.author.id == self.user.id
@@ -163,28 +1343,80 @@ class GrochaGuild:
         message_is_replying_to_bot = message.reference and message.reference.resolved and message.reference.resolved.author.id == self.user.id
 
         try:
+            self.count_message_emoji_usage(message)
+
             message_split = remove_accents(message.content).lower().split()
             if (self.user.mentioned_in(message) # Command mentioning the bot?
             and not message.mention_everyone # No it's mentioning everyone
             and not message_is_replying_to_bot): # No it's just replying
-                word_callback = None
-                for word in message_split:
-                    word_callback = getattr(self, "on_message_" + word, None)
-                    if word_callback:
-                        time_start = time.perf_counter()
-                        await word_callback(message, message_split)
-                        self.profile_time[word] += time.perf_counter() - time_start
-                        self.profile_count[word] += 1
-                        break
-                if not word_callback:
+                cmd = next(filter(None, map(self.commands.get, message_split)), None)
+                command_key = (message.channel.id, tuple(filter(lambda w: not w.startswith('<@'), message_split)))
+                if not try_acquire_all(self.get_rate_buckets(message, True)):
+                    metrics.count("shed", "command") # Flooding, even an answer would make it worse
+                elif not cmd:
                     await message.reply("MAOU?")
+                elif cmd.cost == "heavy" and command_key in self.commands_in_flight:
+                    metrics.count("deduplicated", cmd.name) # The same answer is already on its way to this channel
+                elif time.monotonic() - self.command_last_run.get(cmd.name, -cmd.cooldown) < cmd.cooldown:
+                    await message.reply(f"MAOU... _(encore un peu de patience avant le prochain {cmd.name})_")
+                elif len(self.command_tasks) >= command_queue_size:
+                    metrics.count("shed", "queue_full")
+                    await message.reply("MAOU... _(trop de choses à faire, réessaie plus tard)_")
+                else:
+                    self.command_last_run[cmd.name] = time.monotonic()
+                    metrics.count("queued", cmd.name)
+                    task = asyncio.ensure_future(self.run_command(cmd, message, message_split))
+                    self.command_tasks.add(task)
+                    task.add_done_callback(self.command_tasks.discard)
+                    if cmd.cost == "heavy":
+                        self.commands_in_flight.add(command_key)
+                        task.add_done_callback(lambda t: self.commands_in_flight.discard(command_key))
             else: # Look for autoreactions
-                for word in message_split:
-                    if word in self.memory["autoreact"]:
-                        for emoji in self.memory["autoreact"][word]:
-                            if random.random() > 0.5:
-                                await message.add_reaction(emoji)
+                with metrics.measure("autoreact", "match"):
+                    words = self.autoreact_matcher.find(" ".join(message_split))
+                    emojis = set()
+                    if words:
+                        for word_emojis in (await self.memory_store.get_autoreact_emojis(words)).values():
+                            emojis.update(filter(lambda e: random.random() > 0.5, word_emojis))
+                    emojis = list(emojis)[:autoreact_max_reactions]
+
+                # Autoreacts go first when busy, commands keep the rest of the buckets
+                if emojis and (len(self.command_tasks) > command_queue_size // 2 or not try_acquire_all(self.get_rate_buckets(message), len(emojis), autoreact_reserve)):
+                    metrics.count("shed", "autoreact")
+                elif emojis:
+                    with metrics.measure("autoreact", "react"):
+                        await asyncio.gather(*[message.add_reaction(emoji) for emoji in emojis])
+
+        except Exception as e:
+            await self.deal_with_exception(e, message.channel)
+
+        sys.stderr.flush()
+        sys.stdout.flush()
 
+    def get_rate_buckets(self, message, with_user = False):
+        buckets = [self.rate_bucket]
+        limits = [(self.channel_rate_buckets, message.channel.id, channel_rate_limit)]
+        if with_user:
+            limits.append((self.user_rate_buckets, message.author.id, user_rate_limit))
+        for buckets_by_id, key, (rate, capacity) in limits:
+            if not key in buckets_by_id:
+                if len(buckets_by_id) >= 1000: # Forget full buckets once in a while, they are the same as new ones
+                    for old_key, bucket in list(buckets_by_id.items()):
+                        bucket.refill()
+                        if bucket.tokens >= bucket.capacity:
+                            del buckets_by_id[old_key]
+                buckets_by_id[key] = TokenBucket(rate, capacity)
+            buckets.append(buckets_by_id[key])
+        return buckets
+
+    async def run_command(self, cmd, message, message_split):
+        # Commands run in the background so that a slow one only holds back its own kind
+        if not cmd.name in self.command_semaphores:
+            self.command_semaphores[cmd.name] = asyncio.Semaphore(command_cost_concurrency[cmd.cost])
+        try:
+            async with self.command_semaphores[cmd.name], (self.blocking_command_semaphore if cmd.blocking else self.command_semaphore):
+                with metrics.measure("blocking_command" if cmd.blocking else "command", cmd.name):
+                    await cmd.callback(self, message, message_split)
         except Exception as e:
             await self.deal_with_exception(e, message.channel)
 
@@ -206,23 +1438,28 @@ class GrochaGuild:
         await self.chan_debug.send(f'_Le bobo de Grocha :_\n```{exception_str}```')
 
     async def reply_large(self, message, reply_contents):
-        reply_lines = reply_contents.split("\n")
-        reply_body = ""
-        for reply_line in reply_lines:
-            new_reply_body = f"{reply_body}{reply_line}\n"
-            if len(new_reply_body) > 2000:
-                await message.reply(reply_body)
-                reply_body = f"{reply_line}\n"
-            else:
-                reply_body = new_reply_body
-        if len(reply_body) > 0:
-            await message.reply(reply_body)
+        # Discord keeps the order of messages only if each one is sent after the previous one is acknowledged
+        for chunk in split_message(reply_contents):
+            await message.reply(chunk)
 
     async def on_message_kick(self, message, message_split):
         members = list(filter(lambda u: u != self.user, message.mentions))
         if members:
-            message = await self.chan_main.send(f"MAOU! **{', '.join(list(map(lambda m: m.name, members)))}** est sur le point d'être kické.\nRéagissez à ce message avec au moins 3 emojis {self.emoji_to_string(self.grant_emoji)} pour valider la décision!")
-            self.kick_messages_in_wait[message.id] = members
+            message = await self.chan_main.send(f"MAOU! **{', '.join(list(map(lambda m: m.name, members)))}** est sur le point d'être kické.\nRéagissez à ce message avec au moins {self.get_vote_threshold('kick')} emojis {self.emoji_to_string(self.grant_emoji)} pour valider la décision!")
+            self.memory_store.set(["votes", str(message.id)], {"kind": "kick", "members": list(map(lambda m: m.id, members)), "voters": {}})
+
+    async def on_message_votes(self, message, message_split):
+        # "votes kick 4" sets how many distinct voters a kick needs, for those who could kick by themselves
+        changes = [(kind, int(count)) for kind, count in zip(message_split, message_split[1:]) if kind in default_vote_thresholds and count.isdigit() and int(count) > 0]
+        if changes and not (message.author.guild_permissions.kick_members or message.author.guild_permissions.manage_guild):
+            return await message.reply("MAOU! :no_entry: _(seuls ceux qui peuvent kicker changent les seuils)_")
+        for kind, count in changes:
+            self.memory_store.set(["vote_thresholds", kind], count)
+
+        reply_message = f"MAOU-tes : {len(self.memory['votes'])} en attente"
+        for kind in default_vote_thresholds:
+            reply_message += f"\n`{kind}` : {self.get_vote_threshold(kind)} {self.emoji_to_string(self.grant_emoji)} nécessaires"
+        await message.reply(reply_message)
 
     async def on_message_lick(self, message, message_split):
         members = list(filter(lambda u: u != self.user, message.mentions))
@@ -232,56 +1469,88 @@ class GrochaGuild:
         lick = self.emoji_to_string(self.get_emoji_by_name('lick'))
         message = await message.reply(f"{lick} {f' {lick} '.join(list(map(lambda m: m.mention, members)))} {lick}")
 
+    def get_emojis_leaderboard(self, usage):
+        # Sort emojis from most to least used, dropping the ones with no score or gone from the server
+        sorted_usage = sorted(filter(lambda u: u[1] > 0, usage.items()), key = lambda u: -u[1])
+        return "-".join([f'{self.emoji_to_string(emoji)}`{str(score)}`' for emoji, score in
+            ((self.get_emoji_by_id(emoji_id), score) for emoji_id, score in sorted_usage) if emoji])
+
+    @command("emoji", cost = "heavy")
     async def on_message_emojis(self, message, message_split):
-        response = await message.reply('E-MAOU-jis...')
-        emojis = list(map(lambda e : {"emoji": e, "score": 0, "string": self.emoji_to_string(e)}, self.server.emojis))
-        async def update_emojis_response(final = False):
-            # Filter emojis with no score
-            filtered_emojis = filter(lambda e: e["score"] > 0, emojis)
+        if "backfill" in message_split:
+            return await self.backfill_emojis(message)
+
+        if here_words.intersection(message_split):
+            channel_ids = {str(message.channel.id)}
+        elif len(message.channel_mentions) > 0:
+            channel_ids = set(map(lambda c: str(c.id), message.channel_mentions))
+        else:
+            channel_ids = None
 
-            # Sort emojis from most to least used
-            sorted_emojis = sorted(filtered_emojis, key = lambda e : -e["score"])
+        user_ids = set(map(lambda u: str(u.id), filter(lambda u: u != self.user, message.mentions))) # Always remove bot
+        if not user_ids:
+            user_ids = None
 
-            # Put emojis with their scores into strings
-            sorted_emojis = list(map(lambda e : f'{self.emoji_to_string(e["emoji"])}`{str(e["score"])}`', sorted_emojis))
+        leaderboard = self.get_emojis_leaderboard(await self.memory_store.get_emoji_usage(channel_ids, user_ids))
+        await message.reply(split_message(f"E-MAOU-jis :\n{leaderboard}")[0])
 
-            # Join into a single string
-            sorted_emojis = "-".join(sorted_emojis)
+    async def backfill_emojis(self, message):
+        if self.emoji_backfill_running:
+            return await message.reply("MAOU! _(je suis déjà en train de fouiller l'historique)_")
+        self.emoji_backfill_running = True
 
+        response = MessageEditor(await message.reply('E-MAOU-jis...'))
+        async def update_emojis_response(final = False):
+            leaderboard = self.get_emojis_leaderboard(await self.memory_store.get_emoji_usage())
             if final:
-                sorted_emojis = "E-MAOU-jis :\n" + sorted_emojis
+                leaderboard = "E-MAOU-jis :\n" + leaderboard
             else:
-                sorted_emojis = "E-MAOU-jis : (calcul en cours)\n" + sorted_emojis
+                leaderboard = "E-MAOU-jis : (calcul en cours)\n" + leaderboard
+            response.edit(split_message(leaderboard)[0])
 
-            await response.edit(content = sorted_emojis[:2000])
+        # Fetch each reaction's users once, a few at a time
+        reaction_fetch_semaphore = asyncio.Semaphore(reaction_fetch_concurrency)
+        async def count_reaction_usage(m, r):
+            async with reaction_fetch_semaphore:
+                await self.bot.history_reader.token_bucket.acquire()
+                users = await r.users().flatten()
+            for u in users:
+                self.count_emoji_usage(m.channel.id, u.id, m.created_at, r.emoji.id)
 
-        if "ici" in message_split or "here" in message_split:
-            channels = [message.channel]
-        elif len(message.channel_mentions) > 0:
-            channels = message.channel_mentions
-        else:
-            channels = self.get_text_channels()
-
-        valid_users = message.mentions
-        if len(valid_users) <= 1: # Only bot
-            valid_users = self.server.members
-        valid_users = list(filter(lambda u: u != self.user, valid_users)) # Always remove bot
+        # Channel id -> id of the oldest message already counted, or None once the channel is done
+        backfill_cursors = self.memory.get("emoji_backfill", {})
 
         next_update_dt = datetime.now()
-        for channel in channels:
-            async for m in channel.history(limit = 1000, oldest_first = False):
-                if next_update_dt <= datetime.now():
-                    next_update_dt = datetime.now() + timedelta(seconds = 1)
-                    await update_emojis_response()
-                for e in emojis:
-                    if m.author in valid_users:
-                        e["score"] += m.content.count(e["string"]) # Count emojis in text
-                    for r in (r for r in m.reactions if e["emoji"] == r.emoji): # Count reactions
-                        e["score"] += sum(u in valid_users for u in await r.users().flatten())
+        async def on_page(channel, messages):
+            nonlocal next_update_dt
+            for m in messages:
+                self.count_message_emoji_usage(m)
+            await asyncio.gather(*[count_reaction_usage(m, r) for m in messages for r in m.reactions # Count reactions
+                if getattr(r.emoji, "id", None) and self.get_emoji_by_id(r.emoji.id)])
+
+            # Save progress after each page so an interrupted backfill can resume
+            self.memory_store.set(["emoji_backfill", str(channel.id)], messages[-1].id)
+
+            if next_update_dt <= datetime.now():
+                next_update_dt = datetime.now() + timedelta(seconds = 1)
+                await update_emojis_response()
+
+        async def on_channel_done(channel):
+            self.memory_store.set(["emoji_backfill", str(channel.id)], None)
+
+        channel_cursors = [(channel, backfill_cursors.get(str(channel.id), self.memory["emoji_index_start"])) for channel in self.get_text_channels()]
+        try:
+            await self.bot.history_reader.read([c for c in channel_cursors if c[1] is not None], on_page, on_channel_done)
+        finally:
+            self.emoji_backfill_running = False
 
         await update_emojis_response(True)
+        await response.flush()
 
     async def on_message_weekend(self, message, message_split):
+        await message.reply(self.get_weekend_message())
+
+    def get_weekend_message(self):
         # We are in France, we speak French... OK?
         current_date = datetime.now(pytz.timezone('Europe/Paris'))
         weekend_date = current_date + timedelta(
@@ -292,61 +1561,73 @@ class GrochaGuild:
         )
         waiting_time = weekend_date - current_date
         if waiting_time <= timedelta(0):
-            await message.reply(f"MAOU! {self.emoji_to_string(self.grant_emoji)} (c'est le weekend!)")
+            return f"MAOU! {self.emoji_to_string(self.grant_emoji)} (c'est le weekend!)"
         elif waiting_time <= timedelta(hours = 1):
-            await message.reply(f"MAOU... :eyes: (plus que {waiting_time} avant le weekend...)")
+            return f"MAOU... :eyes: (plus que {waiting_time} avant le weekend...)"
         else:
-            await message.reply(f"MAOU... :disappointed: (encore {waiting_time} avant le weekend...)")
+            return f"MAOU... :disappointed: (encore {waiting_time} avant le weekend...)"
 
     async def on_message_autoreact(self, message, message_split):
+        # Single words, or "quoted phrases" for triggers of several words
+        phrase_regex = '["“«]([^"”»]+)["”»]'
+        phrases = map(lambda p: " ".join(remove_accents(p).lower().split()), re.findall(phrase_regex, message.content))
         word_regex = "^\\w+$"
-        words = list(filter(lambda w: not w in ["autoreact", "remove"] and re.search(word_regex, w), message_split))
+        unquoted_split = remove_accents(re.sub(phrase_regex, " ", message.content)).lower().split()
+        words = list(filter(None, phrases)) + list(filter(lambda w: not w in ["autoreact", "remove"] and re.search(word_regex, w), unquoted_split))
         emojis = list(filter(lambda w: self.is_emoji_string(w), message_split))
         is_removing = "remove" in message_split
 
         if len(words) == len(emojis) == 0:
-            autoreact_digest = f"MAOW-toreacts :\n"
-            for word in self.memory["autoreact"]:
-                word_emojis = self.memory["autoreact"][word]
-                word_emojis = word_emojis.keys()
-                autoreact_digest += f"`{word}` → {''.join([e for e in word_emojis])}\n"
-            await self.reply_large(message, autoreact_digest)
+            autoreact_digest = ["MAOW-toreacts :"]
+            for word, word_emojis in (await self.memory_store.get_autoreact_emojis()).items():
+                autoreact_digest.append(f"`{word}` → {''.join(word_emojis)}")
+            await self.reply_large(message, "\n".join(autoreact_digest))
 
         for word in words:
-            if not word in self.memory["autoreact"]:
-                self.memory["autoreact"][word] = {}
             for emoji in emojis:
                 if is_removing:
-                    self.memory["autoreact"][word].pop(emoji, None)
+                    self.memory_store.delete_autoreact(word, emoji)
                 else:
-                    self.memory["autoreact"][word][emoji] = True
-        self.save_memory()
-
+                    self.memory_store.set_autoreact(word, emoji)
+        remaining = await self.memory_store.get_autoreact_emojis(words) if words else {}
+        for word in words:
+            if word in remaining:
+                self.autoreact_matcher.add(word)
+            else:
+                self.autoreact_matcher.remove(word)
+
+    def get_city_query(self, text):
+        city_match = re.search("à ([\\w-]+(,\\s*[\\w-]+)?)", text)
+        return city_match.group(1) if city_match else None
+
+    async def get_weather_location(self, city_query):
+        # (lat, lon, city name), or None for an unknown city
+        if not city_query: # Default to Paris
+            return (48.85341, 2.3488, 'Paris')
+
+        query = city_query
+        if query.count(",") == 1:
+            query += ",Placeholder" # Needed for state hint to take effect
+        geo = await self.bot.openweather.geocode(query)
+        if not geo:
+            return None
+        geo = geo[0]
+        city_name = geo['name']
+        if 'local_names' in geo and 'fr' in geo['local_names']: city_name = geo['local_names']['fr']
+        if 'state' in geo: city_name += ', ' + geo['state']
+        if 'country' in geo: city_name += ', ' + geo['country']
+        return (geo['lat'], geo['lon'], city_name)
+
+    @command("weather", cost = "heavy")
     async def on_message_meteo(self, message, message_split):
         # Look for city in message
-        city_regex = "à ([\\w-]+(,\\s*[\\w-]+)?)"
-        city_match = re.search(city_regex, message.content)
-        if city_match:
-            query = city_match.group(1)
-            if query.count(",") == 1:
-                query += ",Placeholder" # Needed for state hint to take effect
-            geo = json_query(f"https://api.openweathermap.org/geo/1.0/direct?q={parse.quote_plus(query)}&limit=1&appid={config.OPENWEATHER_KEY}")
-            if geo:
-                geo = geo[0]
-                lat = geo['lat']
-                lon = geo['lon']
-                city_name = geo['name']
-                if 'local_names' in geo and 'fr' in geo['local_names']: city_name = geo['local_names']['fr']
-                if 'state' in geo: city_name += ', ' + geo['state']
-                if 'country' in geo: city_name += ', ' + geo['country']
-            else:
-                return await message.reply(f":disappointed: Je ne connais pas de ville nommée {city_match.group(1)}")
-        else: # Default to Paris
-            lat = 48.85341
-            lon = 2.3488
-            city_name = 'Paris'
+        city_query = self.get_city_query(message.content)
+        location = await self.get_weather_location(city_query)
+        if not location:
+            return await message.reply(f":disappointed: Je ne connais pas de ville nommée {city_query}")
+        lat, lon, city_name = location
 
-        weather = json_query(f"https://api.openweathermap.org/data/2.5/onecall?lat={lat}&lon={lon}&units=metric&lang=fr&appid={config.OPENWEATHER_KEY}")
+        forecast = await self.bot.openweather.forecast(lat, lon)
         temp_type = 'feels_like'
 
         if re.search("ressenti", message.content):
@@ -354,85 +1635,70 @@ class GrochaGuild:
         elif re.search("exact", message.content):
             temp_type = 'temp'
 
-        def get_datetime(dt):
-            return datetime.fromtimestamp(dt, timezone(timedelta(seconds=weather['timezone_offset'])))
-        def is_day_time(dt):
-            return len([d for d in weather['daily'] if d['sunrise'] < dt and dt < d['sunset']]) > 0
-        def get_night_sky_emoji(dt):
-            for d in [d for d in weather['daily'] if d['moonrise'] < dt and dt < d['moonset']]:
-                phase = round(d["moon_phase"] * 4)
-                if phase == 1: return ":first_quarter_moon:"
-                elif phase == 2: return ":full_moon:"
-                elif phase == 3: return ":last_quarter_moon:"
-                else: return ":new_moon:"
-            return ":night_with_stars:" # No moon in the sky
-        def get_weather_emoji(dt, id):
-            day_time = is_day_time(dt)
-            weather_emoji = [
-                (200, ":thunder_cloud_rain:"),
-                (300, ":cloud_rain:"),
-                (600, ":cloud_snow:"),
-                (800, ":sunny:" if day_time else get_night_sky_emoji(dt)),
-                (801, ":white_sun_small_cloud:" if day_time else ":cloud:"),
-                (802, ":white_sun_cloud:" if day_time else ":cloud:"),
-                (803, ":white_sun_cloud:" if day_time else ":cloud:"),
-                (804, ":cloud:"),
-            ]
-            weather_emoji.reverse()
-            # Take first value equal or below id
-            for pair in weather_emoji:
-                if pair[0] <= id:
-                    return pair[1]
-
-        def get_temp(temp_block):
-            if type(temp_block) == dict:
-                return f"{round(min(temp_block.values()))}°/{round(max(temp_block.values()))}°".rjust(6)
-            else:
-                return f"{format(temp_block, '.1f')}°".rjust(6)
-        def get_weather_desc(weather_block):
-            return f"{get_weather_emoji(weather_block['dt'], weather_block['weather'][0]['id'])}`{get_temp(weather_block[temp_type])}`"
-
-        current_time = weather['current']['dt']
-        current_date = get_datetime(current_time)
+        response = forecast.render(city_name, temp_type)
+        await message.reply(response)
 
-        response = f"MAOU-téo:"
-        response += f"\nEn ce moment à {city_name} ({current_date}) : {get_weather_desc(weather['current'])}"
+    @command("announcements")
+    async def on_message_annonces(self, message, message_split):
+        # "annonces meteo 7h30 à Lyon" posts the forecast every day in this channel,
+        # "annonces weekend 17:00" the weekend countdown on Fridays, "annonces meteo off" stops it
+        for kind in default_announcement_times:
+            if kind in message_split:
+                if "off" in message_split:
+                    self.memory_store.delete(["announcements", kind])
+                    continue
+                time_words = list(filter(lambda w: re.search("^\\d{1,2}[:h]\\d{2}$", w), message_split))
+                announcement_time = parse_announcement_time(time_words[0]) if time_words else default_announcement_times[kind]
+                if not announcement_time:
+                    return await message.reply(f":confused: {time_words[0]} n'est pas une heure valide")
+                self.memory_store.set(["announcements", kind], {"time": announcement_time, "channel_id": message.channel.id, "city": self.get_city_query(message.content)})
+
+        reply_message = "MAOU-nonces :"
+        for kind, announcement in self.memory.get("announcements", {}).items():
+            channel = self.server.get_channel(announcement["channel_id"])
+            reply_message += f"\n`{kind}` à {announcement['time']} dans {channel.mention if channel else '?'}"
+            if announcement.get("city"): reply_message += f" ({announcement['city']})"
+        await message.reply(reply_message)
 
-        # Rain in the next hour
-        active_minutely = list(filter(lambda m: m['precipitation'] > 0, weather['minutely']))
-        if len(active_minutely) > 0:
-            minutes_to_rain = round((active_minutely[0]['dt'] - current_time) / 60)
-            if minutes_to_rain > 0:
-                response += f"\nPluie dans {minutes_to_rain} minutes :umbrella:"
-            else:
-                inactive_minutely = list(filter(lambda m: m['precipitation'] == 0, weather['minutely']))
-                if len(inactive_minutely) > 0:
-                    minutes_to_clear = round((inactive_minutely[0]['dt'] - current_time) / 60)
-                    response += f"\nLa pluie s'arrêtera dans {minutes_to_clear} minutes :umbrella:"
+    async def run_announcements(self):
+        while True:
+            await asyncio.sleep(announcement_check_interval)
+            try:
+                await self.check_announcements(datetime.now(pytz.timezone('Europe/Paris')))
+            except Exception as e:
+                await self.deal_with_exception(e, None)
+
+    async def check_announcements(self, now):
+        today = now.strftime("%Y-%m-%d")
+        for kind, announcement in list(self.memory.get("announcements", {}).items()):
+            if announcement.get("last") == today or (kind == "weekend" and now.weekday() != 4): # Weekend is on Fridays only
+                continue
+            if not parse_announcement_time(announcement.get("time", "")):
+                continue
+            hour, minute = map(int, announcement["time"].split(":"))
+            announcement_date = now.replace(hour = hour, minute = minute, second = 0, microsecond = 0)
+
+            # Warm the weather cache, on-demand requests around the announcement benefit from it too
+            if kind == "meteo" and self.announcement_prefetches.get(kind) != today and announcement_date - timedelta(seconds = announcement_prefetch_delay) <= now < announcement_date:
+                self.announcement_prefetches[kind] = today
+                location = await self.get_weather_location(announcement.get("city"))
+                if location:
+                    await self.bot.openweather.forecast(location[0], location[1], announcement_prefetch_ttl)
+
+            if announcement_date <= now < announcement_date + timedelta(seconds = announcement_late_delay):
+                if not kind in self.memory.get("announcements", {}): # Turned off while prefetching
+                    continue
+                self.memory_store.set(["announcements", kind, "last"], today)
+                channel = self.server.get_channel(announcement["channel_id"])
+                if not channel:
+                    continue
+                if kind == "meteo":
+                    location = await self.get_weather_location(announcement.get("city"))
+                    if location:
+                        forecast = await self.bot.openweather.forecast(location[0], location[1])
+                        await channel.send(forecast.render(location[2], 'feels_like'))
                 else:
-                    response += f"\nLa pluie s'arrêtera dans plus d'une heure :umbrella:"
-        else:
-            response += f"\nPas de pluie prévue dans l'heure :muscle:"
-
-        # Weather per hour
-        response += "\n"
-        def get_weather_for_hour(hour):
-            weather_block = weather['hourly'][hour]
-            date = get_datetime(weather_block['dt'])
-            return f"`{format(date.hour, '0>2')}h:`{get_weather_desc(weather_block)}"
-        for hour in range(0, min(16, len(weather['hourly'])), 4):
-            response += "\n" + " ".join([get_weather_for_hour(h) for h in range(hour, hour + 4)])
-
-        # Weather per day
-        response += "\n"
-        def get_weather_for_day(day):
-            day_name = ("Lun", "Mar", "Mer", "Jeu", "Ven", "Sam", "Dim")
-            weather_block = weather['daily'][day]
-            date = get_datetime(weather_block['dt'])
-            return f"`{day_name[date.weekday()]}:`{get_weather_desc(weather_block)}"
-        response += "\n" + " ".join([get_weather_for_day(day) for day in range(min(6, len(weather['daily'])))])
-
-        await message.reply(response)
+                    await channel.send(self.get_weekend_message())
 
     async def on_message_revolution(self, message, message_split):
         await message.reply(f'''MAOU! {self.emoji_to_string("com")}
@@ -450,42 +1716,55 @@ Il est grand temps que les communistes exposent à la face du monde entier, leur
 C'est à cette fin que des communistes de diverses nationalités se sont réunis à Londres et ont rédigé le Manifeste suivant, qui est publié en anglais, français, allemand, italien, flamand et danois.
 ```''')
 
+    async def get_grodle_candidates_message(self, game):
+        grodle_index = await self.bot.get_grodle_index()
+        if not grodle_index.all_words.get(len(game["word"])):
+            return ""
+        count = grodle_index.count_candidates(game["guesses"], game["word"])
+        return f"\n_({count} mot{'s' if count > 1 else ''} du dictionnaire correspond{'ent' if count > 1 else ''} encore)_"
+
+    async def get_grodle_hints_message(self, game):
+        # Compute known letters
+        grodle_known_letters = game["known_letters"]
+        grodle_letters = hairspace.join(map(lambda t:
+            f':regional_indicator_{t[1].lower()}:' if str(t[0]) in grodle_known_letters
+            else ':question:', enumerate(game["word"])))
+
+        # Create hint message
+        reply_message = f':ledger: Voici les lettres connues pour le moment :\n{grodle_letters}'
+        grodle_known_absent_letters = game["known_absent_letters"]
+        if len(grodle_known_absent_letters) > 10:
+            # Show possible letters
+            grodle_possible_letters = ''.join(filter(lambda l: not l in grodle_known_absent_letters, string.ascii_uppercase))
+            grodle_possible_letters = hairspace.join(map(lambda c: f':regional_indicator_{c.lower()}:', grodle_possible_letters))
+            reply_message += f'\nVoici les lettres possibles :\n{grodle_possible_letters}'
+        elif len(grodle_known_absent_letters) > 0:
+            # Show absent letters
+            grodle_impossible_letters = hairspace.join(map(lambda c: f':regional_indicator_{c.lower()}:', grodle_known_absent_letters.keys()))
+            reply_message += f'\nVoici les lettres absentes du mot :\n{grodle_impossible_letters}'
+        return reply_message + await self.get_grodle_candidates_message(game)
+
+    @command(cost = "heavy")
     async def on_message_grodle(self, message, message_split):
+        # Each channel can have several games at once, numbered: "grodle 2 mot" guesses in game 2
+        # (the number is only needed when two games have words of the same length),
+        # "grodle nouveau ||mot||" starts one more game
         words = list(filter(lambda w : not w.startswith('<@') and w != "grodle", message_split))
-        grodle = self.memory.get("grodle", "")
-
-        def find_word_in_wiktionary(word):
-            try:
-                wik_search = json_query(f"https://fr.wiktionary.org/w/api.php?action=query&list=search&srsearch={word}&format=json")
-                for result in wik_search["query"]["search"]:
-                    if remove_accents(result["title"]) == word.lower():
-                        return f"https://fr.wiktionary.org/wiki/{result['title']}"
-            except Exception:
-                return None
-            return None
-
-        # There's an active grodle and the command has no word: display hints
-        if grodle != "" and len(words) < 1:
-            # Compute known letters
-            grodle_known_letters = self.memory.get("grodle_known_letters", {})
-            grodle_letters = hairspace.join(map(lambda t:
-                f':regional_indicator_{t[1].lower()}:' if str(t[0]) in grodle_known_letters
-                else ':question:', enumerate(grodle)))
-
-            # Create hint message
-            reply_message = f':ledger: Voici les lettres connues pour le moment :\n{grodle_letters}'
-            grodle_known_absent_letters = self.memory.get("grodle_known_absent_letters", {})
-            if len(grodle_known_absent_letters) > 10:
-                # Show possible letters
-                grodle_possible_letters = ''.join(filter(lambda l: not l in grodle_known_absent_letters, string.ascii_uppercase))
-                grodle_possible_letters = hairspace.join(map(lambda c: f':regional_indicator_{c.lower()}:', grodle_possible_letters))
-                reply_message += f'\nVoici les lettres possibles :\n{grodle_possible_letters}'
-            elif len(grodle_known_absent_letters) > 0:
-                # Show absent letters
-                grodle_impossible_letters = hairspace.join(map(lambda c: f':regional_indicator_{c.lower()}:', grodle_known_absent_letters.keys()))
-                reply_message += f'\nVoici les lettres absentes du mot :\n{grodle_impossible_letters}'
-
-            return await message.reply(reply_message)
+        game_ids = list(filter(str.isdigit, words))
+        is_new_game = any(map(lambda w: w in ["nouveau", "new"], words))
+        words = list(filter(lambda w: not w.isdigit() and not w in ["nouveau", "new"], words))
+        channel_path = ["grodle_games", str(message.channel.id)]
+        channel_games = self.memory.get("grodle_games", {}).get(channel_path[1], {})
+        if game_ids and not game_ids[0] in channel_games:
+            return await message.reply(f":confused: Il n'y a pas de partie n°{game_ids[0]} ici !")
+        games = {game_ids[0]: channel_games[game_ids[0]]} if game_ids else channel_games
+        def game_label(game_id):
+            return f"_(partie n°{game_id})_ " if len(channel_games) > 1 else ""
+
+        # There are active grodles and the command has no word: display hints
+        if games and not is_new_game and len(words) < 1:
+            hints = [game_label(game_id) + await self.get_grodle_hints_message(game) for game_id, game in sorted(games.items())]
+            return await self.reply_large(message, "\n\n".join(hints))
 
         if len(words) != 1:
             return await message.reply("Proposez un (seul) mot !")
@@ -499,118 +1778,422 @@ C'est à cette fin que des communistes de diverses nationalités se sont réunis
         if not re.search(word_regex, word):
             return await message.reply(f"Le mot contient des caractères interdits")
 
-        if grodle == "":
-            self.memory["grodle"] = word
+        if is_new_game or not channel_games:
+            game_id = str(max(map(int, channel_games), default = 0) + 1)
+            self.memory_store.set(channel_path + [game_id], {"word": word, "known_letters": {}, "known_absent_letters": {}, "guesses": []})
             channel = message.channel
             author = message.author
             await message.delete()
             reply_message = f":mag: {author.mention} propose un nouveau mot de {len(word)} lettres à deviner !"
-            if find_word_in_wiktionary(word) != None:
+            if channel_games:
+                reply_message += f" _(partie n°{game_id})_"
+            if (await self.bot.get_grodle_index()).contains(word) or await self.bot.wiktionary.find_word(word) != None:
                 reply_message += f" Je l'ai trouvé dans le dictionnaire !"
             else:
                 reply_message += f" Je ne l'ai pas trouvé dans le dictionnaire..."
-            await channel.send(reply_message)
-        elif len(word) != len(grodle):
-            await message.reply(f':confused: Le mot actuel contient {len(self.memory["grodle"])} lettres !')
+            return await channel.send(reply_message)
+
+        matching_games = {game_id: game for game_id, game in games.items() if len(game["word"]) == len(word)}
+        if len(games) == 1 and not matching_games:
+            return await message.reply(f':confused: Le mot actuel contient {len(next(iter(games.values()))["word"])} lettres !')
+        elif not matching_games:
+            lengths = ", ".join(sorted(set(map(lambda game: str(len(game["word"])), games.values()))))
+            return await message.reply(f':confused: Les mots actuels contiennent {lengths} lettres !')
+        elif len(matching_games) > 1:
+            return await message.reply(f":thinking: Plusieurs parties ont un mot de {len(word)} lettres, précise laquelle : `grodle <numéro> mot` ({', '.join(map(lambda i: f'n°{i}', sorted(matching_games)))})")
+
+        game_id, game = next(iter(matching_games.items()))
+        game_path = channel_path + [game_id]
+        grodle = game["word"]
+        feedback = grodle_feedback(word, grodle)
+        for i, f in enumerate(feedback):
+            if f == 2:
+                self.memory_store.set(game_path + ["known_letters", str(i)], True)
+            elif not word[i] in grodle: # This letter is definitely not in the grodle
+                self.memory_store.set(game_path + ["known_absent_letters", word[i]], True)
+
+        grodle_letters = hairspace.join(map(lambda c: f':regional_indicator_{c.lower()}:', word))
+        grodle_emojis = hairspace.join(map(lambda f: [':black_large_square:', ':yellow_square:', ':green_square:'][f], feedback))
+
+        if word == grodle:
+            other_games = len(channel_games) > 1
+            self.memory_store.delete(game_path)
+            reply_message = f":tada: {game_label(game_id)}Bien joué {message.author.mention} !\n{grodle_letters}\n{grodle_emojis}"
+            wik_url = await self.bot.wiktionary.find_word(word)
+            if wik_url != None:
+                reply_message += f"\n(<{wik_url}>)"
+            reply_message += f"\nPour proposer un nouveau mot : `@{self.user.name} grodle {'nouveau ' if other_games else ''}||mot||`"
+            await message.reply(reply_message)
         else:
-            grodle_emojis = [None] * len(word)
-            letter_count = defaultdict(lambda: 0)
-            for i in range(len(word)):
-                if word[i] == grodle[i]:
-                    grodle_emojis[i] = ':green_square:'
-                    self.memory.setdefault("grodle_known_letters", {})[str(i)] = True
-                    letter_count[word[i]] += 1
-
-            for i in range(len(word)):
-                if not grodle_emojis[i]:
-                    if word[i] in grodle and grodle.count(word[i]) > letter_count[word[i]]:
-                        grodle_emojis[i] = ':yellow_square:'
-                        letter_count[word[i]] += 1
-                    else:
-                        grodle_emojis[i] = ':black_large_square:'
-
-                    # This letter is definitely not in the grodle
-                    if not word[i] in grodle:
-                        self.memory.setdefault("grodle_known_absent_letters", {})[word[i]] = True
-
-            grodle_letters = hairspace.join(map(lambda c: f':regional_indicator_{c.lower()}:', word))
-            grodle_emojis = hairspace.join(grodle_emojis)
-
-            if word == grodle:
-                self.memory.pop("grodle", None)
-                self.memory.pop("grodle_known_letters", None)
-                self.memory.pop("grodle_known_absent_letters", None)
-                reply_message = f":tada: Bien joué {message.author.mention} !\n{grodle_letters}\n{grodle_emojis}"
-                wik_url = find_word_in_wiktionary(word)
-                if wik_url != None:
-                    reply_message += f"\n(<{wik_url}>)"
-                reply_message += f"\nPour proposer un nouveau mot : `@{self.user.name} grodle ||mot||`"
-                await message.reply(reply_message)
-            else:
-                await message.reply(f":disappointed: {word} n'est pas le bon mot !\n{grodle_letters}\n{grodle_emojis}")
-
-        self.save_memory()
+            self.memory_store.set(game_path + ["guesses"], game["guesses"] + [word])
+            reply_message = f":disappointed: {game_label(game_id)}{word} n'est pas le bon mot !\n{grodle_letters}\n{grodle_emojis}"
+            reply_message += await self.get_grodle_candidates_message(self.memory["grodle_games"][channel_path[1]][game_id])
+            await message.reply(reply_message)
 
     async def on_message_hurt(self, message, message_split):
         raise Exception("*grocha vient de chier une ogive, tape un sprint et se prend une porte*")
 
     async def on_message_version(self, message, message_split):
-        sha1 = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
-        date = subprocess.run(['git', 'log', '-1', '--format=%cd'], capture_output=True, text=True).stdout.strip()
-        await message.reply(f'MAOU :date:\nSha1: `{sha1}`\nDate: `{date}`')
+        build_info = await self.bot.get_build_info()
+        await message.reply(f'MAOU :date:\nSha1: `{build_info["sha1"]}`\nDate: `{build_info["date"]}`')
 
     async def on_message_profile(self, message, message_split):
-        reply_message = 'Profile:\n'
-        for key in self.profile_time:
-            avg_time = self.profile_time[key] / self.profile_count[key]
-            reply_message += f"{key.capitalize()} : {avg_time:.3f}\n"
+        profile_metrics = metrics
+        if self.bot.supervisor: # Gather every worker process' numbers
+            profile_metrics = Metrics()
+            for state in await self.bot.ask_supervisor({"op": "profile", "state": metrics.get_state()}):
+                profile_metrics.merge(state)
+
+        reply_message = 'Profile: _(nombre, p50/p95/p99/max en ms)_\n'
+        for (kind, name), h in sorted(profile_metrics.histograms.items()):
+            reply_message += f"{kind.capitalize()} {name} : {h.count}, {'/'.join(f'{h.percentile(p) * 1000:.1f}' for p in profile_metrics.percentiles)}/{h.max * 1000:.1f}\n"
+        for (kind, name), get_value in sorted(profile_metrics.gauges.items()):
+            if kind != "command_queue_depth" or name == str(self.server.id): # Only this guild's queue
+                reply_message += f"{kind.capitalize()} : {get_value()}\n"
+        for (kind, name), value in sorted(profile_metrics.counters.items()):
+            reply_message += f"{kind.capitalize()} {name} : {value}\n"
+
+        await self.reply_large(message, reply_message)
+
+    @command(cost = "heavy", cooldown = 30, blocking = True)
+    async def on_message_update(self, message, message_split):
+        response = MessageEditor(await message.reply('MAOU! _(updating myself!)_'))
+        def show_results(output, log = ""):
+            response.edit(f'MAOU! _(updating myself!)_\n**Results**\n```{output}\n\n{log}```'[:message_max_length])
 
-        await message.reply(reply_message)
+        output = await self.bot.update_code(show_results)
+        show_results(output, (await self.bot.get_build_info())["log"])
+        await response.flush()
 
-    async def on_message_update(self, message, message_split):
-        rebase_process = subprocess.run(["git", "pull", "--rebase", "--autostash"], text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        log_process = subprocess.run(["git", "log", "-10", "--pretty=format:%h - %s (%cr) <%an>"], text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if getattr(config, "HOT_RELOAD", False) and not self.bot.supervisor:
+            await self.hot_reload(message)
 
-        result_string = f'MAOU! _(updating myself!)_\n**Results**\n```{rebase_process.stdout.strip()}\n\n{log_process.stdout.strip()}```'
-        await message.reply(result_string[:2000])
+    async def hot_reload(self, message):
+        try:
+            await self.bot.reload_code()
+        except Exception as e:
+            await message.reply(f"MAOU :scream_cat: _(le nouveau code ne se charge pas, je garde l'ancien)_\n```{type(e).__name__}: {e}```"[:2000])
+        else:
+            await message.reply(f"MAOU! {self.emoji_to_string('lick')} _(nouveau code chargé sans redémarrer)_")
 
+    @command(cooldown = 30, blocking = True)
     async def on_message_restart(self, message, message_split):
         await message.reply(f'MAOU~ _(takin a short nap bruh)_')
-        restart_results = subprocess.run(['systemctl', '--user', 'restart', 'bot-grocha'], capture_output=True, text=True).stderr.strip()
+        if self.bot.supervisor: # Let the supervisor restart every worker process
+            return await self.bot.ask_supervisor({"op": "restart"})
+        restart_results = await run_process(['systemctl', '--user', 'restart', 'bot-grocha'])
 
     async def on_message_clean(self, message, message_split):
         await message.reply(f"{self.emoji_to_string('lick')} _(auto-nettoyage)_")
-        self.clean()
+        await self.clean()
 
 
-class GrochaBot(discord.Client):
-    def __init__(self):
+class GrochaBot(discord.AutoShardedClient):
+    # Runs all shards by itself by default, or only shard_ids when started by the supervisor
+    def __init__(self, shard_ids = None, shard_count = None, supervisor = None):
         intents = discord.Intents.default()
         intents.members = True
         intents.reactions = True
         intents.presences = True
 
-        discord.Client.__init__(self, intents=intents)
+        cache_options = {}
+        if getattr(config, "CACHE_PROFILE", "full") == "lean":
+            # Members are fetched when a vote needs them, reactions are tracked through raw events
+            intents.presences = False
+            cache_options = {"member_cache_flags": discord.MemberCacheFlags.none(), "chunk_guilds_at_startup": False, "max_messages": lean_message_cache_size}
 
-        self.guild_clients = {}
+        discord.AutoShardedClient.__init__(self, intents=intents, shard_ids=shard_ids, shard_count=shard_count, **cache_options)
 
-    def get_guild_client(self, guild_id):
-        if not guild_id in self.guild_clients.keys():
-            self.guild_clients[guild_id] = GrochaGuild(self, self.get_guild(guild_id))
-        return self.guild_clients[guild_id]
+        self.guild_clients = {}
+        self.guild_client_loads = {}
+        self.startup_phases = {"import": time.perf_counter() - startup_time}
+        self.startup_phase_start = time.perf_counter()
+        self.history_reader = HistoryReader(TokenBucket(history_requests_per_second, history_requests_per_second))
+        self.web_client = WebClient()
+        self.blocking_executor = ThreadPoolExecutor(max_workers = blocking_workers)
+        self.openweather = OpenWeatherClient(self.web_client)
+        self.wiktionary = WiktionaryClient(self.web_client, word_list_file_name = getattr(config, "GRODLE_WORD_LIST_FILE_NAME", None), executor = self.blocking_executor)
+        self.grodle_index_load = None
+        self.ops = CachedQuery(math.inf) # Build info until the next update, and the update or reload in progress
+        self.update_listeners = []
+        self.metrics_started = False
+        self.supervisor = supervisor
+        self.supervisor_lock = asyncio.Lock()
+        self.supervisor_reply = None
+        self.supervisor_listening = False
+
+        # Time every Discord REST call, by route
+        http_request = self.http.request
+        async def timed_http_request(route, **kwargs):
+            with metrics.measure("discord", f"{route.method} {route.path}"):
+                return await http_request(route, **kwargs)
+        self.http.request = timed_http_request
+
+    async def close(self):
+        for guild_client in self.guild_clients.values():
+            guild_client.memory_store.flush_now()
+        await self.web_client.close()
+        await discord.AutoShardedClient.close(self)
+
+    def listen_to_supervisor(self):
+        if not self.supervisor_listening:
+            self.supervisor_listening = True
+            self.loop.add_reader(self.supervisor.fileno(), self.on_supervisor_message)
+
+    def on_supervisor_message(self):
+        # Answers to ask_supervisor, or news the supervisor sends to every worker
+        try:
+            while self.supervisor.poll():
+                message = self.supervisor.recv()
+                if message["op"] == "reply":
+                    self.supervisor_reply.set_result(message["value"])
+                elif message["op"] == "updated": # Another worker may have asked, the code changed for all
+                    self.ops.entries.pop("build_info", None)
+        except (EOFError, ConnectionResetError): # No supervisor to restart us anymore
+            self.loop.remove_reader(self.supervisor.fileno())
+            asyncio.ensure_future(self.close())
+
+    async def ask_supervisor(self, request):
+        # One request at a time, so the next reply on the pipe is always its answer
+        self.listen_to_supervisor()
+        async with self.supervisor_lock:
+            self.supervisor_reply = self.loop.create_future()
+            await self.loop.run_in_executor(self.blocking_executor, self.supervisor.send, request)
+            return await self.supervisor_reply
+
+    async def report_metrics(self):
+        while True:
+            await asyncio.sleep(supervisor_metrics_interval)
+            async with self.supervisor_lock: # Concurrent sends on the pipe would interleave their bytes
+                await self.loop.run_in_executor(self.blocking_executor, self.supervisor.send, {"op": "metrics", "state": metrics.get_state()})
+
+    async def get_build_info(self):
+        async def read_build_info():
+            sha1, date, log = await asyncio.gather(
+                run_process(['git', 'rev-parse', 'HEAD']),
+                run_process(['git', 'log', '-1', '--format=%cd']),
+                run_process(["git", "log", "-10", "--pretty=format:%h - %s (%cr) <%an>"]))
+            return {"sha1": sha1, "date": date, "log": log}
+        return await self.ops.get("build_info", read_build_info)
+
+    async def update_code(self, on_output):
+        if self.supervisor: # Pulled once by the supervisor, so that workers never race on the repository
+            return await self.ask_supervisor({"op": "update"})
+
+        # Updates asked from several guilds at once share a single pull, every reply following its output
+        def show_output(output):
+            for listener in self.update_listeners:
+                listener(output)
+        async def pull():
+            output = await run_process(["git", "pull", "--rebase", "--autostash"], show_output)
+            self.ops.entries.pop("build_info", None)
+            return output
+
+        self.update_listeners.append(on_output)
+        try:
+            return await self.ops.get("update", pull, refresh = True)
+        finally:
+            self.update_listeners.remove(on_output)
+
+    async def reload_code(self):
+        return await self.ops.get("reload", self.load_new_code, refresh = True)
+
+    async def load_new_code(self):
+        # Runs the current grocha.py as a fresh module, then moves the bot and every guild onto its classes.
+        # Nothing is swapped until the new code has compiled and run, so a broken update keeps the old code
+        file_name = os.path.abspath(__file__)
+        code = await self.loop.run_in_executor(self.blocking_executor, lambda: compile(open(file_name, encoding = "utf-8").read(), file_name, "exec"))
+        with metrics.measure("reload", "code"):
+            module = types.ModuleType(f"grocha_{time.monotonic_ns()}")
+            module.__file__ = file_name
+            exec(code, module.__dict__)
+            bot_class, guild_class = module.GrochaBot, module.GrochaGuild # Both must exist before anything moves
+
+            # Counters and the startup timeline carry over, the gateway connection and guild state are untouched
+            module.metrics = metrics
+            module.startup_time = startup_time
+            swapped = []
+            try:
+                for instance, new_class in [(self, bot_class)] + [(g, guild_class) for g in self.guild_clients.values()]:
+                    swapped.append((instance, instance.__class__))
+                    instance.__class__ = new_class
+                    if hasattr(new_class, "on_reload"): # Lets the new code set up what its __init__ would have
+                        instance.on_reload()
+            except Exception:
+                for instance, old_class in swapped:
+                    instance.__class__ = old_class
+                raise
+
+    async def get_grodle_index(self):
+        # Built from the local word list the first time a game needs it
+        if not self.grodle_index_load:
+            async def load():
+                word_list = await self.wiktionary.get_word_list()
+                return await self.loop.run_in_executor(self.blocking_executor, GrodleIndex, word_list.keys())
+            self.grodle_index_load = asyncio.ensure_future(load())
+        return await asyncio.shield(self.grodle_index_load)
+
+    async def load_guild_client(self, guild_id):
+        guild_client = GrochaGuild(self, self.get_guild(guild_id))
+        await guild_client.load()
+        self.guild_clients[guild_id] = guild_client
+        return guild_client
+
+    async def get_guild_client(self, guild_id):
+        # Guilds load concurrently as soon as the gateway announces them; events wait for their own guild only
+        if not guild_id in self.guild_client_loads:
+            self.guild_client_loads[guild_id] = asyncio.ensure_future(self.load_guild_client(guild_id))
+        return await asyncio.shield(self.guild_client_loads[guild_id])
+
+    def end_startup_phase(self, phase):
+        if not phase in self.startup_phases:
+            now = time.perf_counter()
+            self.startup_phases[phase] = now - self.startup_phase_start
+            self.startup_phase_start = now
+            metrics.record("startup", phase, self.startup_phases[phase])
+
+    def get_startup_timeline(self):
+        return " → ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.startup_phases.items())
+
+    async def on_connect(self):
+        self.end_startup_phase("login")
+
+    async def on_guild_available(self, guild):
+        await self.get_guild_client(guild.id)
+
+    async def on_guild_join(self, guild):
+        await self.get_guild_client(guild.id)
 
     async def on_ready(self):
-        for guild in self.guilds:
-            await self.get_guild_client(guild.id).on_ready()
+        if not self.metrics_started: # on_ready fires again after reconnections
+            self.metrics_started = True
+            self.loop.create_task(metrics.watch_event_loop_lag())
+            self.loop.create_task(self.get_build_info()) # Read once, version answers from memory
+            self.loop.create_task(self.wiktionary.get_word_list()) # In the background, startup doesn't wait for it
+            self.set_cache_gauges()
+            if self.supervisor:
+                self.listen_to_supervisor()
+                self.loop.create_task(self.report_metrics())
+            if getattr(config, "METRICS_PORT", None) and not self.supervisor: # Otherwise the supervisor serves every worker's
+                await metrics.serve(config.METRICS_PORT)
+
+        guild_clients = await asyncio.gather(*[self.get_guild_client(guild.id) for guild in self.guilds])
+        self.end_startup_phase("guild init")
+        if not "memory load" in self.startup_phases: # Slowest guild, they load in parallel
+            self.startup_phases["memory load"] = max([g.memory_load_time for g in guild_clients], default = 0)
+        print(f"Startup: {self.get_startup_timeline()}")
+
+        await asyncio.gather(*[guild_client.on_ready() for guild_client in guild_clients])
+
+    def set_cache_gauges(self):
+        # What the cache profile changes
+        metrics.set_gauge("cached_members", "", lambda: sum(map(lambda g: len(g.members), self.guilds)))
+        metrics.set_gauge("cached_messages", "", lambda: len(self.cached_messages))
+        if os.path.exists("/proc/self/statm"):
+            metrics.set_gauge("memory_rss_mb", "", get_rss_mb)
 
     async def on_member_join(self, member):
-        await self.get_guild_client(member.guild.id).on_member_join(member)
+        with metrics.measure("event", "member_join"):
+            await (await self.get_guild_client(member.guild.id)).on_member_join(member)
 
-    async def on_reaction_add(self, reaction, user):
-        await self.get_guild_client(user.guild.id).on_reaction_add(reaction, user)
+    async def on_raw_reaction_add(self, payload):
+        if payload.guild_id:
+            with metrics.measure("event", "raw_reaction_add"):
+                await (await self.get_guild_client(payload.guild_id)).on_raw_reaction_add(payload)
 
-    async def on_message(self, message):
-        await self.get_guild_client(message.guild.id).on_message(message)
+    async def on_raw_reaction_remove(self, payload):
+        if payload.guild_id:
+            with metrics.measure("event", "raw_reaction_remove"):
+                await (await self.get_guild_client(payload.guild_id)).on_raw_reaction_remove(payload)
+
+    async def on_guild_emojis_update(self, guild, before, after):
+        (await self.get_guild_client(guild.id)).index_emojis()
+
+    async def on_guild_channel_create(self, channel):
+        (await self.get_guild_client(channel.guild.id)).index_channels()
+
+    async def on_guild_channel_delete(self, channel):
+        (await self.get_guild_client(channel.guild.id)).index_channels()
+
+    async def on_guild_channel_update(self, before, after):
+        (await self.get_guild_client(after.guild.id)).index_channels()
+
+    async def on_guild_role_create(self, role):
+        (await self.get_guild_client(role.guild.id)).index_roles()
 
-client = GrochaBot()
-client.run(config.BOT_TOKEN)
+    async def on_guild_role_delete(self, role):
+        (await self.get_guild_client(role.guild.id)).index_roles()
+
+    async def on_guild_role_update(self, before, after):
+        (await self.get_guild_client(after.guild.id)).index_roles()
+
+    async def on_message(self, message):
+        with metrics.measure("event", "message"):
+            await (await self.get_guild_client(message.guild.id)).on_message(message)
+
+def run_shard_worker(shard_ids, shard_count, connection):
+    client = GrochaBot(shard_ids = shard_ids, shard_count = shard_count, supervisor = connection)
+    client.run(config.BOT_TOKEN)
+
+def run_supervisor(shard_count, process_count, run_worker = run_shard_worker):
+    # Splits the shards across worker processes, restarts the ones that die, and answers their
+    # requests: aggregated metrics for profile, a single pull for update, restart of every worker for restart
+    workers = {} # Connection -> (process, shard ids)
+    worker_states = {} # Connection -> latest metrics state
+    # Spawned rather than forked: a restarted worker imports grocha.py as it is on disk, not a copy of our
+    # old code, and doesn't inherit the metrics thread
+    context = multiprocessing.get_context("spawn")
+    def start_worker(shard_ids):
+        connection, worker_connection = context.Pipe()
+        process = context.Process(target = run_worker, args = (shard_ids, shard_count, worker_connection))
+        process.start()
+        workers[connection] = (process, shard_ids)
+
+    for i in range(process_count):
+        start_worker(list(range(i, shard_count, process_count)))
+
+    if getattr(config, "METRICS_PORT", None):
+        serve_merged_metrics(config.METRICS_PORT, lambda: list(worker_states.values()))
+
+    while True:
+        for connection in multiprocessing.connection.wait(list(workers)):
+            try:
+                request = connection.recv()
+            except (EOFError, ConnectionResetError): # Killed workers can reset the pipe rather than close it
+                process, shard_ids = workers.pop(connection)
+                worker_states.pop(connection, None)
+                process.join()
+                print(f"Worker for shards {shard_ids} exited ({process.exitcode}), restarting it")
+                start_worker(shard_ids)
+                continue
+
+            if request["op"] == "metrics":
+                worker_states[connection] = request["state"]
+            elif request["op"] == "profile":
+                worker_states[connection] = request["state"]
+                connection.send({"op": "reply", "value": list(worker_states.values())})
+            elif request["op"] == "update": # Requests are answered one after the other, so pulls never overlap
+                try:
+                    output = subprocess.run(["git", "pull", "--rebase", "--autostash"], text = True, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, timeout = ops_timeout).stdout.strip()
+                except subprocess.TimeoutExpired:
+                    output = f"(killed after {ops_timeout}s)"
+                for worker_connection in workers: # Build info is read again everywhere, before the answer
+                    try:
+                        worker_connection.send({"op": "updated"})
+                    except OSError:
+                        pass # Dead worker, restarted when its EOF is read
+                connection.send({"op": "reply", "value": output})
+            elif request["op"] == "restart":
+                connection.send({"op": "reply", "value": None})
+                for process, shard_ids in workers.values():
+                    process.terminate() # Workers close cleanly on SIGTERM, flushing their memory
+                # Their connections are closed now: the EOF branch starts them again
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["migrate"]:
+        migrate_memory_files()
+    elif sys.argv[1:2] == ["shards"]: # grocha.py shards <shard count> <process count>
+        run_supervisor(int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        client = GrochaBot()
+        client.run(config.BOT_TOKEN)
@@ -0,0 +1,96 @@
+import asyncio
+import importlib.util
+import os
+import sys
+
+import pytest
+
+# grocha reads its settings from a config module; the sample one, completed with test names, stands in for it
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+config_spec = importlib.util.spec_from_file_location("config", os.path.join(root_dir, "config.sample.py"))
+config = importlib.util.module_from_spec(config_spec)
+config_spec.loader.exec_module(config)
+config.WELCOME_CHANNEL_NAME = "bienvenue"
+config.MAIN_CHANNEL_NAME = "general"
+config.DEBUG_CHANNEL_NAME = "debug"
+config.MAIN_ROLE_NAME = "chat"
+config.GRANT_EMOJI_NAME = "grant"
+config.OPENWEATHER_KEY = "test"
+config.METRICS_PORT = 0
+sys.modules["config"] = config
+sys.path.insert(0, root_dir)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import grocha
+from fake_discord import FakeDiscord, FakeGuild, FakePermissions, FakeUser, FakeWebClient
+
+def build_guild(api):
+    me = FakeUser(api, api.snowflake(), "Grocha", bot = True)
+    guild = FakeGuild(api, api.snowflake(), "Chats", me)
+    me.guild = guild
+    for name in ["bienvenue", "general", "debug", "jeux"]:
+        guild.add_channel(name)
+    guild.add_role("chat")
+    for name in ["grant", "lick", "com", "miaou", "ronron"]:
+        guild.add_emoji(name)
+    guild.add_member("admin", permissions = FakePermissions(kick_members = True, manage_guild = True))
+    for i in range(20):
+        guild.add_member(f"chat{i}")
+    return guild
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+    asyncio.set_event_loop(None)
+
+@pytest.fixture(autouse = True)
+def in_tmp_dir(tmp_path, monkeypatch):
+    # Memory and cache files land in a fresh directory for each test
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def unlimited_rates(monkeypatch):
+    # The bot's own rate limits would shed a fast replay
+    for name in ["guild_rate_limit", "channel_rate_limit", "user_rate_limit"]:
+        monkeypatch.setattr(grocha, name, (1e9, 1e9))
+    monkeypatch.setattr(grocha, "command_queue_size", 10**6)
+
+@pytest.fixture
+def api():
+    return FakeDiscord()
+
+@pytest.fixture
+def fake_guild(api):
+    return build_guild(api)
+
+@pytest.fixture
+def bot(loop, fake_guild):
+    # A real GrochaBot that never connects: its user and guild come from the fake layer
+    async def create():
+        return grocha.GrochaBot()
+    bot = loop.run_until_complete(create())
+    bot._connection.user = fake_guild.me
+    bot._connection._guilds[fake_guild.id] = fake_guild
+    bot.web_client = FakeWebClient()
+    bot.openweather.web_client = bot.web_client
+    bot.wiktionary.web_client = bot.web_client
+    bot.ops.entries["build_info"] = (float("inf"), {"sha1": "0" * 40, "date": "today", "log": ""})
+    yield bot
+    for guild_client in bot.guild_clients.values():
+        guild_client.announcement_task.cancel()
+        for task in list(guild_client.command_tasks):
+            task.cancel()
+    loop.run_until_complete(bot.close())
+    loop.run_until_complete(asyncio.sleep(0))
+    bot.blocking_executor.shutdown()
+
+@pytest.fixture
+def guild_client(loop, bot, fake_guild):
+    guild_client = loop.run_until_complete(bot.get_guild_client(fake_guild.id))
+    loop.run_until_complete(asyncio.sleep(0)) # Lets the deferred clean run
+    return guild_client
@@ -0,0 +1,303 @@
+import asyncio
+import bisect
+import re
+import time
+
+import discord
+
+# In-process stand-ins for the parts of discord.py a GrochaGuild talks to. Every REST call goes
+# through FakeDiscord, which adds the configured latency, paces calls like Discord's rate limits
+# (waiting instead of failing, as discord.py does on a 429) and keeps a log of what was called.
+
+class FakeDiscord:
+    def __init__(self, latency = 0, rate_limit = None):
+        self.latency = latency
+        self.rate_limit = rate_limit # (calls, per seconds) for each route, or None
+        self.calls = []
+        self.rate_limited = 0
+        self.route_calls = {}
+        self.last_id = 0
+
+    def snowflake(self, timestamp = None):
+        # Increasing ids, stamped with the time like Discord's
+        self.last_id = max(self.last_id + 1, (int((timestamp or time.time()) * 1000) - discord.utils.DISCORD_EPOCH) << 22)
+        return self.last_id
+
+    async def call(self, route):
+        self.calls.append(route)
+        if self.rate_limit:
+            # Each call takes the first slot that keeps the route under its calls per window
+            calls, per = self.rate_limit
+            route_calls = self.route_calls.setdefault(route, [])
+            now = time.monotonic()
+            slot = max(now, route_calls[-calls] + per) if len(route_calls) >= calls else now
+            route_calls.append(slot)
+            del route_calls[:-calls]
+            if slot > now:
+                self.rate_limited += 1
+                await asyncio.sleep(slot - now)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+class FakePermissions:
+    def __init__(self, kick_members = False, manage_guild = False):
+        self.kick_members = kick_members
+        self.manage_guild = manage_guild
+
+class FakeUser:
+    def __init__(self, api, id, name, bot = False, guild = None, permissions = None):
+        self.api = api
+        self.id = id
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.guild = guild
+        self.guild_permissions = permissions or FakePermissions()
+        self.roles = []
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    def mentioned_in(self, message):
+        return message.mention_everyone or any(u.id == self.id for u in message.mentions)
+
+    async def add_roles(self, *roles, reason = None):
+        await self.api.call("PUT /guilds/{guild_id}/members/{user_id}/roles/{role_id}")
+        self.roles += roles
+
+class FakeEmoji:
+    def __init__(self, id, name, animated = False):
+        self.id = id
+        self.name = name
+        self.animated = animated
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return f'<{"a" if self.animated else ""}:{self.name}:{self.id}>'
+
+class FakeRole:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+class FakeAsyncList:
+    # What channel.history() and reaction.users() return: only flatten() is used
+    def __init__(self, api, route, get_items):
+        self.api = api
+        self.route = route
+        self.get_items = get_items
+
+    async def flatten(self):
+        await self.api.call(self.route)
+        return self.get_items()
+
+class FakeReaction:
+    def __init__(self, message, emoji):
+        self.message = message
+        self.emoji = emoji
+        self.user_list = []
+
+    @property
+    def count(self):
+        return len(self.user_list)
+
+    def users(self):
+        return FakeAsyncList(self.message.api, "GET /channels/{channel_id}/messages/{message_id}/reactions/{emoji}", lambda: list(self.user_list))
+
+class FakeMessage:
+    def __init__(self, api, channel, author, content, id = None, reference = None):
+        self.api = api
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.id = id or api.snowflake()
+        self.created_at = discord.utils.snowflake_time(self.id)
+        self.reference = reference
+        self.reactions = []
+        self.deleted = False
+        self.mention_everyone = "@everyone" in content or "@here" in content
+        self.mentions = [u for u in map(channel.guild.find_user, map(int, re.findall("<@!?(\\d+)>", content))) if u]
+        self.channel_mentions = [c for c in map(channel.guild.get_channel, map(int, re.findall("<#(\\d+)>", content))) if c]
+
+    async def reply(self, content):
+        return await self.channel.send(content, reference = self)
+
+    async def edit(self, content = None):
+        await self.api.call("PATCH /channels/{channel_id}/messages/{message_id}")
+        self.content = content
+
+    async def delete(self):
+        await self.api.call("DELETE /channels/{channel_id}/messages/{message_id}")
+        self.deleted = True
+        self.channel.messages.remove(self)
+
+    async def add_reaction(self, emoji):
+        await self.api.call("PUT /channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me")
+        self.react(self.guild.me, emoji)
+
+    def react(self, user, emoji):
+        # Records a reaction without any REST call, as when it comes from the gateway
+        if isinstance(emoji, str) and re.search("^<a?:\\w+:\\d+>$", emoji):
+            emoji = self.guild.get_emoji(int(emoji.split(":")[-1][:-1])) or emoji
+        reaction = next((r for r in self.reactions if r.emoji == emoji), None)
+        if not reaction:
+            reaction = FakeReaction(self, emoji)
+            self.reactions.append(reaction)
+        if not user in reaction.user_list:
+            reaction.user_list.append(user)
+        return reaction
+
+    def unreact(self, user, emoji):
+        for reaction in self.reactions:
+            if reaction.emoji == emoji and user in reaction.user_list:
+                reaction.user_list.remove(user)
+
+class FakeResponse:
+    status = 404
+    reason = "Not Found"
+
+class FakeTextChannel(discord.TextChannel):
+    # A TextChannel as far as isinstance() is concerned, with messages kept in a list, oldest first
+    def __init__(self, api, guild, id, name):
+        self.api = api
+        self.guild = guild
+        self.id = id
+        self.name = name
+        self.messages = []
+
+    def __repr__(self):
+        return f"<FakeTextChannel name={self.name}>"
+
+    async def send(self, content = None, reference = None):
+        await self.api.call("POST /channels/{channel_id}/messages")
+        message = FakeMessage(self.api, self, self.guild.me, content or "", reference = reference)
+        self.messages.append(message)
+        return message
+
+    def post(self, author, content, timestamp = None):
+        # A message from someone else, as the gateway would deliver it
+        message = FakeMessage(self.api, self, author, content, id = self.api.snowflake(timestamp))
+        self.messages.append(message)
+        return message
+
+    def history(self, limit = 100, before = None, oldest_first = False):
+        def get_page():
+            # Messages are kept in id order, so a page is a slice found by bisection
+            end = len(self.messages) if before is None else bisect.bisect_left(self.messages, before.id, key = lambda m: m.id)
+            return self.messages[max(0, end - limit):end][::-1]
+        return FakeAsyncList(self.api, "GET /channels/{channel_id}/messages", get_page)
+
+    async def fetch_message(self, id):
+        await self.api.call("GET /channels/{channel_id}/messages/{message_id}")
+        message = next((m for m in self.messages if m.id == id), None)
+        if not message:
+            raise discord.NotFound(FakeResponse(), "Unknown Message")
+        return message
+
+class FakeGuild:
+    def __init__(self, api, id, name, me):
+        self.api = api
+        self.id = id
+        self.name = name
+        self.me = me
+        self.channels = []
+        self.roles = []
+        self.emojis = []
+        self.members = []
+        self.kicked = []
+
+    def __str__(self):
+        return self.name
+
+    def add_channel(self, name):
+        channel = FakeTextChannel(self.api, self, self.api.snowflake(), name)
+        self.channels.append(channel)
+        return channel
+
+    def add_role(self, name):
+        role = FakeRole(self.api.snowflake(), name)
+        self.roles.append(role)
+        return role
+
+    def add_emoji(self, name, animated = False):
+        emoji = FakeEmoji(self.api.snowflake(), name, animated)
+        self.emojis.append(emoji)
+        return emoji
+
+    def add_member(self, name, **kwargs):
+        member = FakeUser(self.api, self.api.snowflake(), name, guild = self, **kwargs)
+        self.members.append(member)
+        return member
+
+    def get_channel(self, id):
+        return next((c for c in self.channels if c.id == id), None)
+
+    def get_member(self, id):
+        return next((m for m in self.members if m.id == id), None)
+
+    def get_emoji(self, id):
+        return next((e for e in self.emojis if e.id == id), None)
+
+    def find_user(self, id):
+        return self.me if id == self.me.id else self.get_member(id)
+
+    async def query_members(self, user_ids = None):
+        await self.api.call("GATEWAY REQUEST_GUILD_MEMBERS")
+        return [m for m in self.members if m.id in user_ids]
+
+    async def kick(self, member, reason = None):
+        await self.api.call("DELETE /guilds/{guild_id}/members/{user_id}")
+        self.kicked.append(member)
+        self.members.remove(member)
+
+def raw_reaction_payload(message, user, emoji):
+    # What on_raw_reaction_add/remove receive
+    partial_emoji = discord.PartialEmoji(name = emoji.name, id = emoji.id) if isinstance(emoji, FakeEmoji) else discord.PartialEmoji(name = emoji)
+    return discord.RawReactionActionEvent({"message_id": message.id, "channel_id": message.channel.id, "user_id": user.id, "guild_id": message.guild.id}, partial_emoji, "REACTION_ADD")
+
+class FakeWebClient:
+    # Answers json_query from canned payloads by URL prefix, counting the calls
+    def __init__(self, payloads = None, latency = 0):
+        self.payloads = payloads or {}
+        self.latency = latency
+        self.calls = []
+
+    async def json_query(self, url, timeout = None, name = "web"):
+        self.calls.append(url)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for prefix, payload in self.payloads.items():
+            if url.startswith(prefix):
+                return payload(url) if callable(payload) else payload
+        raise Exception(f"No payload for {url}")
+
+    async def close(self):
+        pass
+
+def onecall_payload(now, precipitation = 0):
+    # The parts of an OpenWeather onecall answer that WeatherForecast reads, starting at the Unix time now
+    day = {"weather": [{"id": 800}], "temp": {"min": 8, "max": 17}, "feels_like": {"day": 15, "night": 6}}
+    return {
+        "timezone_offset": 7200,
+        "current": {"dt": now, "weather": [{"id": 801}], "temp": 14.2, "feels_like": 13.1},
+        "minutely": [{"dt": now + 60 * i, "precipitation": precipitation} for i in range(60)],
+        "hourly": [{"dt": now + 3600 * i, "weather": [{"id": 500 if i % 5 == 0 else 800}], "temp": 12 + i / 4, "feels_like": 11 + i / 4} for i in range(48)],
+        "daily": [dict(day, dt = now + 86400 * i, sunrise = now + 86400 * i - 3600, sunset = now + 86400 * i + 36000,
+            moonrise = now + 86400 * i + 40000, moonset = now + 86400 * i + 70000, moon_phase = 0.5) for i in range(8)],
+    }
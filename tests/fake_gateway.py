@@ -0,0 +1,64 @@
+import os
+import time
+
+# Stand-in for run_shard_worker in supervisor tests. It speaks the supervisor pipe protocol like a
+# GrochaBot worker would, and writes what happens to the file named by $FAKE_WORKER_LOG. It is
+# started in spawned processes, so it must not import grocha (nor the config it needs).
+
+def log(line):
+    with open(os.environ["FAKE_WORKER_LOG"], "a") as log_file:
+        log_file.write(line + "\n")
+
+def read_log():
+    with open(os.environ["FAKE_WORKER_LOG"]) as log_file:
+        return log_file.read().splitlines()
+
+def wait_for(condition, timeout = 20):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError(read_log())
+        time.sleep(0.02)
+
+def metrics_state(shard):
+    return {"histograms": [("command", "meteo", {10: 1}, 1, 0.1, 0.1)], "gauges": [("cached_members", "", 100 * (shard + 1))], "counters": [(("shed", "command"), 1)]}
+
+def run_fake_worker(shard_ids, shard_count, connection):
+    # First start of shard 0: asks for profile, update then restart. Second start of shard 1: exits on its own.
+    # Everyone else reports metrics and logs the news it gets until the supervisor goes away
+    shard = shard_ids[0]
+    generation = read_log().count(f"start {shard}")
+    log(f"start {shard}")
+    connection.send({"op": "metrics", "state": metrics_state(shard)})
+    log(f"metrics {shard}")
+
+    if shard == 1 and generation == 1:
+        log(f"exit {shard}")
+        return
+
+    if shard == 0 and generation == 0:
+        wait_for(lambda: read_log().count("metrics 1") == 1)
+        time.sleep(0.1) # Let the supervisor read shard 1's metrics
+        connection.send({"op": "profile", "state": metrics_state(shard)})
+        states = connection.recv()["value"]
+        log(f"profile {len(states)} {sum(state['gauges'][0][2] for state in states)}")
+
+        connection.send({"op": "update"})
+        for message in iter(connection.recv, None):
+            if message["op"] == "updated":
+                log(f"updated {shard}")
+            else:
+                log(f"update replied {message['value'].splitlines()[-1]}")
+                break
+
+        wait_for(lambda: "updated 1" in read_log()) # Every worker got the news
+        connection.send({"op": "restart"})
+        connection.recv()
+        log("restart replied")
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        log(f"{message['op']} {shard}")
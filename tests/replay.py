@@ -0,0 +1,168 @@
+import asyncio
+import json
+import random
+import time
+import tracemalloc
+
+import grocha
+from fake_discord import raw_reaction_payload
+
+# Event streams are lists of dicts, as stored one per line in a recording:
+#   {"at": 0.5, "type": "message", "channel": "general", "author": "chat3", "content": "..."}
+#   {"at": 0.7, "type": "reaction_add", "message": 12, "user": "chat4", "emoji": "miaou"}
+# "at" is in seconds from the start, "message" is the index of a message event earlier in the stream,
+# "emoji" a custom emoji name of the guild or a native emoji. "handler" optionally names what is measured.
+
+def load_events(file_name):
+    with open(file_name, encoding = "utf-8") as events_file:
+        return [json.loads(line) for line in events_file if line.strip()]
+
+def save_events(events, file_name):
+    with open(file_name, "w", encoding = "utf-8") as events_file:
+        for event in events:
+            events_file.write(json.dumps(event, ensure_ascii = False) + "\n")
+
+chat_words = ["miaou", "croquettes", "sieste", "chat", "ronron", "soleil", "pluie", "demain", "ce soir", "pourquoi", "été", "fenêtre", "oiseau", "très", "bientôt", "ça"]
+
+def synthetic_events(guild, count, rate = 50, commands = ("emojis", "grodle", "autoreact"), seed = 0):
+    # A chat mostly made of plain messages, with reactions to them and a few commands for the bot
+    rng = random.Random(seed)
+    members = [m.name for m in guild.members]
+    emojis = [e.name for e in guild.emojis] + ["😺", "👍"]
+    events = []
+    message_indices = []
+    at = 0
+    for i in range(count):
+        at += rng.expovariate(rate)
+        roll = rng.random()
+        if message_indices and roll < 0.3:
+            event_type = "reaction_add" if roll < 0.25 else "reaction_remove"
+            events.append({"at": at, "type": event_type, "message": rng.choice(message_indices[-50:]), "user": rng.choice(members), "emoji": rng.choice(emojis)})
+            continue
+        if roll < 0.35 and commands:
+            command = rng.choice(commands)
+            content = f"<@{guild.me.id}> {command}"
+            if command == "grodle":
+                content += " " + rng.choice(["chats", "sieste", "pluie", "miaou"])
+            elif command == "autoreact":
+                emoji = rng.choice(guild.emojis[1:])
+                content += f" {rng.choice(chat_words[:6])} <:{emoji.name}:{emoji.id}>"
+            events.append({"at": at, "type": "message", "channel": "general", "author": rng.choice(members), "content": content, "handler": command})
+        else:
+            content = " ".join(rng.choice(chat_words) for _ in range(rng.randint(3, 25)))
+            if rng.random() < 0.2:
+                emoji = rng.choice(guild.emojis)
+                content += f" <:{emoji.name}:{emoji.id}>"
+            events.append({"at": at, "type": "message", "channel": rng.choice(["general", "jeux"]), "author": rng.choice(members), "content": content})
+        message_indices.append(len(events) - 1)
+    return events
+
+class Report:
+    def __init__(self):
+        self.histograms = {}
+        self.overall = grocha.Histogram() # Every event, whatever its handler
+        self.retained_blocks = {}
+        self.peak_bytes = {}
+        self.event_count = 0
+        self.duration = 0
+
+    def record(self, handler, seconds, blocks = 0, peak = 0):
+        self.histograms.setdefault(handler, grocha.Histogram()).record(seconds)
+        self.overall.record(seconds)
+        self.retained_blocks[handler] = self.retained_blocks.get(handler, 0) + blocks
+        self.peak_bytes[handler] = max(self.peak_bytes.get(handler, 0), peak)
+
+    @property
+    def throughput(self):
+        return self.event_count / self.duration if self.duration else 0
+
+    def summary(self):
+        lines = [f"{self.event_count} events in {self.duration:.2f}s, {self.throughput:.0f} events/s, p50/p99 {self.overall.percentile(50) * 1000:.2f}/{self.overall.percentile(99) * 1000:.2f} ms"]
+        for handler, h in sorted(self.histograms.items()):
+            percentiles = "/".join(f"{h.percentile(p) * 1000:.2f}" for p in grocha.Metrics.percentiles)
+            lines.append(f"{handler}: {h.count}, p50/p95/p99 {percentiles} ms, max {h.max * 1000:.2f} ms, {self.retained_blocks[handler] / h.count:.1f} blocks kept/event, peak {self.peak_bytes[handler] / 1024:.0f} KiB")
+        return "\n".join(lines)
+
+class Replayer:
+    # Feeds events to a GrochaGuild as the bot would, and measures each one until it is fully answered,
+    # including the command task it may have started
+    def __init__(self, guild_client, fake_guild, speed = 0, trace_allocations = False, overlap = False):
+        self.guild_client = guild_client
+        self.guild = fake_guild
+        self.speed = speed # 1 replays in real time, 10 ten times faster, 0 as fast as possible
+        self.trace_allocations = trace_allocations
+        # Events start on time even when earlier ones aren't answered yet, as in a flood. A message then also waits
+        # for the commands other messages started meanwhile, so its latency is an upper bound.
+        self.overlap = overlap
+        self.messages = {}
+        self.members_by_name = {m.name: m for m in fake_guild.members}
+        self.members_by_name[fake_guild.me.name] = fake_guild.me
+        self.channels_by_name = {c.name: c for c in fake_guild.channels}
+        self.emojis_by_name = {e.name: e for e in fake_guild.emojis}
+
+    def get_handler(self, event):
+        if "handler" in event:
+            return event["handler"]
+        return "on_message" if event["type"] == "message" else f"raw_{event['type']}"
+
+    async def dispatch(self, index, event):
+        if event["type"] == "message":
+            message = self.channels_by_name[event["channel"]].post(self.members_by_name[event["author"]], event["content"])
+            self.messages[index] = message
+            tasks_before = set(self.guild_client.command_tasks)
+            await self.guild_client.on_message(message)
+            await asyncio.gather(*(self.guild_client.command_tasks - tasks_before))
+            return
+
+        message = self.messages.get(event["message"])
+        if not message or message.deleted:
+            return
+        user = self.members_by_name[event["user"]]
+        emoji = self.emojis_by_name.get(event["emoji"], event["emoji"])
+        payload = raw_reaction_payload(message, user, emoji)
+        if event["type"] == "reaction_add":
+            message.react(user, emoji)
+            await self.guild_client.on_raw_reaction_add(payload)
+        else:
+            message.unreact(user, emoji)
+            await self.guild_client.on_raw_reaction_remove(payload)
+
+    async def measure(self, report, index, event):
+        blocks_before, memory_before = 0, 0
+        if self.trace_allocations: # Blocks still allocated after the event, and its peak above what was there
+            blocks_before = len(tracemalloc.take_snapshot().traces)
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        event_start = time.perf_counter()
+        await self.dispatch(index, event)
+        seconds = time.perf_counter() - event_start
+        blocks, peak = 0, 0
+        if self.trace_allocations:
+            peak = tracemalloc.get_traced_memory()[1] - memory_before
+            blocks = max(0, len(tracemalloc.take_snapshot().traces) - blocks_before)
+        report.record(self.get_handler(event), seconds, blocks, peak)
+        report.event_count += 1
+
+    async def replay(self, events):
+        report = Report()
+        if self.trace_allocations:
+            tracemalloc.start()
+        start = time.perf_counter()
+        overlapping = []
+        try:
+            for index, event in enumerate(events):
+                if self.speed:
+                    delay = start + event.get("at", 0) / self.speed - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if self.overlap:
+                    overlapping.append(asyncio.ensure_future(self.measure(report, index, event)))
+                    await asyncio.sleep(0) # Lets it reach the bot before the next event
+                else:
+                    await self.measure(report, index, event)
+            await asyncio.gather(*overlapping)
+        finally:
+            if self.trace_allocations:
+                tracemalloc.stop()
+        report.duration = time.perf_counter() - start
+        return report
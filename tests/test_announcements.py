@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+import pytz
+
+from fake_discord import onecall_payload
+
+paris = pytz.timezone("Europe/Paris")
+
+def at(day, hour, minute, second = 0):
+    # Thursday the 15th, Friday the 16th...
+    return paris.localize(datetime(2026, 10, day, hour, minute, second))
+
+@pytest.fixture
+def weather(bot):
+    calls = {"geo": 0, "onecall": 0}
+    def geocode(url):
+        calls["geo"] += 1
+        return [{"name": "Lyon", "lat": 45.75, "lon": 4.85, "country": "FR"}]
+    def onecall(url):
+        calls["onecall"] += 1
+        return onecall_payload(int(datetime.now().timestamp()))
+    bot.web_client.payloads["https://api.openweathermap.org/geo/"] = geocode
+    bot.web_client.payloads["https://api.openweathermap.org/data/"] = onecall
+    return calls
+
+@pytest.fixture
+def channel(fake_guild):
+    return next(c for c in fake_guild.channels if c.name == "jeux")
+
+def run_clock(loop, guild_client, times):
+    # The scheduler only knows the time it is given: a virtual clock is a list of check times
+    for now in times:
+        loop.run_until_complete(guild_client.check_announcements(now))
+
+def get_posts(channel):
+    return [m.content for m in channel.messages]
+
+def test_morning_forecast_is_prefetched_then_posted_once(loop, guild_client, weather, channel):
+    guild_client.memory_store.set(["announcements", "meteo"], {"time": "08:00", "channel_id": channel.id, "city": "Lyon"})
+
+    run_clock(loop, guild_client, [at(15, 7, 50), at(15, 7, 54, 59)])
+    assert weather == {"geo": 0, "onecall": 0}
+
+    run_clock(loop, guild_client, [at(15, 7, 55, 20), at(15, 7, 58)])
+    assert weather == {"geo": 1, "onecall": 1} # Prefetched once
+    assert get_posts(channel) == []
+
+    run_clock(loop, guild_client, [at(15, 8, 0, 10), at(15, 8, 0, 30), at(15, 8, 5)])
+    assert weather["onecall"] == 1 # The post used the prefetched forecast
+    assert len(get_posts(channel)) == 1
+    assert get_posts(channel)[0].startswith("MAOU-téo:")
+    assert guild_client.memory["announcements"]["meteo"]["last"] == "2026-10-15"
+
+    run_clock(loop, guild_client, [at(16, 7, 56), at(16, 8, 0, 5)])
+    assert len(get_posts(channel)) == 2
+
+def test_on_demand_request_uses_the_prefetch(loop, guild_client, weather, channel):
+    guild_client.memory_store.set(["announcements", "meteo"], {"time": "08:00", "channel_id": channel.id, "city": None})
+    run_clock(loop, guild_client, [at(15, 7, 56)])
+    assert weather["onecall"] == 1
+    loop.run_until_complete(guild_client.bot.openweather.forecast(48.85341, 2.3488))
+    assert weather["onecall"] == 1
+
+def test_late_announcement_is_skipped(loop, guild_client, weather, channel):
+    guild_client.memory_store.set(["announcements", "meteo"], {"time": "08:00", "channel_id": channel.id, "city": None})
+    run_clock(loop, guild_client, [at(15, 8, 11), at(15, 12, 0)])
+    assert get_posts(channel) == []
+
+def test_weekend_countdown_on_fridays_only(loop, guild_client, weather, channel):
+    guild_client.memory_store.set(["announcements", "weekend"], {"time": "17:00", "channel_id": channel.id, "city": None})
+    run_clock(loop, guild_client, [at(15, 17, 0, 30), at(16, 16, 59), at(16, 17, 0, 30), at(16, 17, 1)])
+    assert len(get_posts(channel)) == 1
+    assert "weekend" in get_posts(channel)[0]
+
+def test_invalid_time_is_ignored(loop, guild_client, weather, channel):
+    guild_client.memory_store.set(["announcements", "meteo"], {"time": "25:00", "channel_id": channel.id, "city": None})
+    run_clock(loop, guild_client, [at(15, 0, 0), at(15, 8, 0)])
+    assert get_posts(channel) == []
+    assert weather["onecall"] == 0
+
+def test_turned_off_while_prefetching(loop, guild_client, weather, channel):
+    guild_client.memory_store.set(["announcements", "meteo"], {"time": "17:03", "channel_id": channel.id, "city": "Lyon"})
+    guild_client.memory_store.set(["announcements", "weekend"], {"time": "17:00", "channel_id": channel.id, "city": None})
+    geocode = guild_client.bot.web_client.payloads["https://api.openweathermap.org/geo/"]
+    def geocode_then_turn_off(url):
+        guild_client.memory_store.delete(["announcements", "weekend"])
+        return geocode(url)
+    guild_client.bot.web_client.payloads["https://api.openweathermap.org/geo/"] = geocode_then_turn_off
+
+    run_clock(loop, guild_client, [at(16, 17, 1)])
+    assert get_posts(channel) == []
+    assert not "weekend" in guild_client.memory["announcements"]
+
+def command(loop, guild_client, channel, author, content):
+    message = channel.post(author, f"<@{guild_client.user.id}> {content}")
+    loop.run_until_complete(guild_client.on_message(message))
+    loop.run_until_complete(asyncio.gather(*guild_client.command_tasks))
+    return channel.messages[-1].content
+
+def test_annonces_command(loop, guild_client, fake_guild, channel):
+    author = fake_guild.members[1]
+    assert "n'est pas une heure valide" in command(loop, guild_client, channel, author, "annonces meteo 24:00")
+    assert "n'est pas une heure valide" in command(loop, guild_client, channel, author, "annonces meteo 7h60")
+    assert not "meteo" in guild_client.memory.get("announcements", {})
+
+    assert "`meteo` à 07:30" in command(loop, guild_client, channel, author, "annonces meteo 7h30 à Lyon")
+    assert guild_client.memory["announcements"]["meteo"] == {"time": "07:30", "channel_id": channel.id, "city": "Lyon"}
+    command(loop, guild_client, channel, author, "annonces meteo off")
+    assert not "meteo" in guild_client.memory["announcements"]
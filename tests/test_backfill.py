@@ -0,0 +1,111 @@
+import asyncio
+import random
+import time
+
+import discord
+import pytest
+
+import grocha
+from fake_discord import FakeMessage
+from replay import chat_words
+
+def fill_history(fake_guild, message_count, seed = 2):
+    # Messages from before the bot's emoji index, with custom emojis in some and reactions on others
+    rng = random.Random(seed)
+    channels = [c for c in fake_guild.channels if c.name in ["general", "jeux"]]
+    start = time.time() - message_count - 3600
+    for i in range(message_count):
+        channel = rng.choice(channels)
+        content = " ".join(rng.choice(chat_words) for _ in range(rng.randint(3, 15)))
+        if rng.random() < 0.2:
+            content += " " + " ".join(str(rng.choice(fake_guild.emojis)) for _ in range(rng.randint(1, 3)))
+        message_id = ((int((start + i) * 1000) - discord.utils.DISCORD_EPOCH) << 22) + i % 4096
+        message = FakeMessage(fake_guild.api, channel, rng.choice(fake_guild.members), content, id = message_id)
+        channel.messages.append(message)
+        if rng.random() < 0.1:
+            for emoji in rng.sample(fake_guild.emojis, rng.randint(1, 3)) + ["😺"]:
+                for user in rng.sample(fake_guild.members, rng.randint(1, 4)):
+                    message.react(user, emoji)
+
+async def old_count_emojis(guild_client, channels, valid_users):
+    # The emojis command before the usage index: every emoji looked for in every message, reaction users fetched per emoji.
+    # It stopped at 1000 messages a channel, here it reads the whole history like the backfill.
+    emojis = list(map(lambda e : {"emoji": e, "score": 0, "string": guild_client.emoji_to_string(e)}, guild_client.server.emojis))
+    for channel in channels:
+        before = None
+        while True:
+            page = await channel.history(limit = 100, before = before, oldest_first = False).flatten()
+            for m in page:
+                for e in emojis:
+                    if m.author in valid_users:
+                        e["score"] += m.content.count(e["string"]) # Count emojis in text
+                    for r in (r for r in m.reactions if e["emoji"] == r.emoji): # Count reactions
+                        e["score"] += sum(u in valid_users for u in await r.users().flatten())
+            if len(page) < 100:
+                break
+            before = page[-1]
+    return {str(e["emoji"].id): e["score"] for e in emojis if e["score"] > 0}
+
+def fill_guild(loop, bot, fake_guild, message_count):
+    # 200 emojis, which must exist before the guild client indexes them, then the history
+    for i in range(len(fake_guild.emojis), 200):
+        fake_guild.add_emoji(f"chat{i}", animated = i % 10 == 0)
+    guild_client = loop.run_until_complete(bot.get_guild_client(fake_guild.id))
+    loop.run_until_complete(asyncio.sleep(0))
+    fill_history(fake_guild, message_count)
+    bot.history_reader.token_bucket = grocha.TokenBucket(1e9, 1e9)
+    return guild_client
+
+def run_old(loop, guild_client):
+    valid_users = list(filter(lambda u: u != guild_client.user, guild_client.server.members))
+    return loop.run_until_complete(old_count_emojis(guild_client, guild_client.get_text_channels(), valid_users))
+
+def run_backfill(loop, guild_client, fake_guild):
+    general = next(c for c in fake_guild.channels if c.name == "general")
+    message = general.post(fake_guild.members[0], f"<@{fake_guild.me.id}> emojis backfill")
+    loop.run_until_complete(guild_client.backfill_emojis(message))
+    usage = loop.run_until_complete(guild_client.memory_store.get_emoji_usage())
+    return {emoji_id: count for emoji_id, count in usage.items() if count > 0}
+
+def test_backfill_counts_like_old_implementation(loop, bot, fake_guild):
+    guild_client = fill_guild(loop, bot, fake_guild, 5000)
+    assert run_backfill(loop, guild_client, fake_guild) == run_old(loop, guild_client)
+
+@pytest.mark.parametrize("implementation", ["old", "new"])
+def test_backfill_benchmark(benchmark, loop, bot, fake_guild, implementation):
+    guild_client = fill_guild(loop, bot, fake_guild, 50000)
+    def run():
+        return run_old(loop, guild_client) if implementation == "old" else run_backfill(loop, guild_client, fake_guild)
+    usage = benchmark.pedantic(run, rounds = 1, iterations = 1)
+    benchmark.extra_info["reaction fetches"] = fake_guild.api.calls.count("GET /channels/{channel_id}/messages/{message_id}/reactions/{emoji}")
+    assert len(usage) == 200
+
+def test_backfill_resumes_from_cursor(loop, monkeypatch, bot, fake_guild):
+    # Discord stops answering after 10 pages: the next backfill starts from the saved cursors, counting nothing twice
+    guild_client = fill_guild(loop, bot, fake_guild, 3000)
+    expected = run_old(loop, guild_client)
+    api = fake_guild.api
+    call = api.call
+    pages = []
+    failing = True
+    async def call_then_fail(route):
+        if route == "GET /channels/{channel_id}/messages":
+            if failing and len(pages) >= 10:
+                raise ConnectionError()
+            pages.append(route)
+        await call(route)
+    monkeypatch.setattr(api, "call", call_then_fail)
+
+    with pytest.raises(ConnectionError):
+        run_backfill(loop, guild_client, fake_guild)
+    loop.run_until_complete(asyncio.sleep(0.01)) # Lets the other channels hit the failure too
+    assert len(pages) == 10
+    assert any(guild_client.memory["emoji_backfill"].values())
+
+    failing = False
+    assert run_backfill(loop, guild_client, fake_guild) == expected
+    # Every page read once over both runs
+    start = guild_client.memory["emoji_index_start"]
+    page_size = bot.history_reader.page_size
+    assert len(pages) == sum(len([m for m in c.messages if m.id < start]) // page_size + 1 for c in guild_client.get_text_channels())
+    assert not any(guild_client.memory["emoji_backfill"].values())
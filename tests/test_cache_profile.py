@@ -0,0 +1,102 @@
+import gc
+import random
+import time
+import tracemalloc
+
+import discord
+import pytest
+
+import grocha
+from replay import chat_words
+
+# Gateway payloads as Discord sends them, fed straight to discord.py's connection state: what the cache
+# profile keeps of a guild depends on discord.py alone, not on the fake layer
+
+def snowflake(timestamp):
+    return (int(timestamp * 1000) - discord.utils.DISCORD_EPOCH) << 22
+
+def user_payload(user_id):
+    return {"id": str(user_id), "username": f"chat{user_id % 100000}", "discriminator": f"{user_id % 10000:04}", "avatar": None}
+
+def guild_create_payload(guild_id, member_count, with_presences, rng):
+    # GUILD_CREATE once every member is known, as after chunking
+    now = time.time()
+    channel_ids = [guild_id + 1 + i for i in range(4)]
+    member_ids = [snowflake(now - 10**7) + i for i in range(member_count)]
+    members = [{"user": user_payload(member_id), "roles": [], "joined_at": "2021-06-01T12:00:00+00:00", "deaf": False, "mute": False, "nick": None}
+        for member_id in member_ids]
+    payload = {
+        "id": str(guild_id), "name": f"Chats {guild_id}", "owner_id": str(member_ids[0]), "member_count": member_count, "large": member_count > 250,
+        "channels": [{"id": str(channel_id), "type": 0, "name": name, "position": i, "permission_overwrites": []}
+            for i, (channel_id, name) in enumerate(zip(channel_ids, ["bienvenue", "general", "debug", "jeux"]))],
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+        "emojis": [{"id": str(guild_id + 100 + i), "name": f"chat{i}", "roles": [], "require_colons": True, "managed": False, "animated": False, "available": True} for i in range(50)],
+        "members": members,
+    }
+    if with_presences:
+        payload["presences"] = [{"user": {"id": str(member_id)}, "status": rng.choice(["online", "idle", "dnd"]), "client_status": {"desktop": "online"},
+            "activities": [{"name": "Minecraft", "type": 0, "created_at": int(now * 1000)}]} for member_id in member_ids if rng.random() < 0.6]
+    return payload, channel_ids, member_ids
+
+def message_create_payload(message_id, guild_id, channel_id, author_id, content):
+    return {"id": str(message_id), "guild_id": str(guild_id), "channel_id": str(channel_id), "type": 0, "content": content,
+        "author": user_payload(author_id), "member": {"roles": [], "joined_at": "2021-06-01T12:00:00+00:00", "deaf": False, "mute": False, "nick": None},
+        "timestamp": "2022-06-01T12:00:00+00:00", "edited_timestamp": None, "tts": False, "mention_everyone": False,
+        "mentions": [], "mention_roles": [], "attachments": [], "embeds": [], "pinned": False}
+
+def feed_gateway(bot, guild_count, member_count, message_count, seed = 22):
+    state = bot._connection
+    state.dispatch = lambda *args, **kwargs: None # Only the cache matters here, not the bot's handlers
+    rng = random.Random(seed)
+    for g in range(guild_count):
+        guild_id = snowflake(time.time() - 10**8) + g * 1000
+        payload, channel_ids, member_ids = guild_create_payload(guild_id, member_count, bot.intents.presences, rng)
+        state._add_guild_from_data(payload)
+        for i in range(message_count):
+            content = " ".join(rng.choice(chat_words) for _ in range(rng.randint(3, 25)))
+            state.parse_message_create(message_create_payload(guild_id + 10**6 + i, guild_id, rng.choice(channel_ids), rng.choice(member_ids), content))
+
+def measure_cache(loop, monkeypatch, profile, guild_count, member_count, message_count):
+    monkeypatch.setattr(grocha.config, "CACHE_PROFILE", profile)
+    async def create():
+        return grocha.GrochaBot()
+    bot = loop.run_until_complete(create())
+    try:
+        gc.collect()
+        objects_before = len(gc.get_objects())
+        rss_before = grocha.get_rss_mb()
+        tracemalloc.start()
+        feed_gateway(bot, guild_count, member_count, message_count)
+        gc.collect()
+        traced_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        bot.set_cache_gauges()
+        return {
+            "traced MiB": round(traced_bytes / 2**20, 1),
+            "objects": len(gc.get_objects()) - objects_before,
+            "RSS MiB": round(grocha.get_rss_mb() - rss_before, 1),
+            "cached_members": grocha.metrics.gauges[("cached_members", "")](),
+            "cached_messages": grocha.metrics.gauges[("cached_messages", "")](),
+        }
+    finally:
+        loop.run_until_complete(bot.close())
+        bot.blocking_executor.shutdown()
+
+@pytest.mark.parametrize("profile", ["full", "lean"])
+@pytest.mark.parametrize("member_count", [1000, 10000])
+def test_cache_memory(benchmark, loop, monkeypatch, profile, member_count):
+    # Two guilds of the same size, each with 2000 messages
+    results = benchmark.pedantic(measure_cache, args = (loop, monkeypatch, profile, 2, member_count, 2000), rounds = 1, iterations = 1)
+    benchmark.extra_info.update(results)
+    if profile == "full":
+        assert results["cached_members"] == 2 * member_count
+        assert results["cached_messages"] == 1000 # discord.py's default
+    else:
+        assert results["cached_members"] == 0
+        assert results["cached_messages"] == grocha.lean_message_cache_size
+
+def test_lean_keeps_less(loop, monkeypatch):
+    full = measure_cache(loop, monkeypatch, "full", 1, 10000, 2000)
+    lean = measure_cache(loop, monkeypatch, "lean", 1, 10000, 2000)
+    assert lean["traced MiB"] < full["traced MiB"] / 2
+    assert lean["objects"] < full["objects"] / 2
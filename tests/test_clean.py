@@ -0,0 +1,45 @@
+import discord
+import pytest
+
+from conftest import build_guild
+
+def add_autoreacts(guild_client, fake_guild, count):
+    # Each trigger gets two custom emojis and a native one
+    emojis = [str(e) for e in fake_guild.emojis]
+    for i in range(count):
+        for emoji in [emojis[i % len(emojis)], emojis[(i * 7) % len(emojis)], "😺"]:
+            guild_client.memory_store.set_autoreact(f"mot{i}", emoji)
+
+@pytest.fixture
+def big_guild_client(loop, bot, api):
+    # build_guild with 500 emojis, all indexed by the guild client
+    fake_guild = build_guild(api)
+    for i in range(495):
+        fake_guild.add_emoji(f"chat{i}", animated = i % 10 == 0)
+    bot._connection._guilds[fake_guild.id] = fake_guild
+    guild_client = loop.run_until_complete(bot.get_guild_client(fake_guild.id))
+    add_autoreacts(guild_client, fake_guild, 5000)
+    return guild_client
+
+def test_clean_removes_gone_emojis(loop, big_guild_client):
+    guild_client = big_guild_client
+    gone = guild_client.server.emojis[-1]
+    guild_client.memory_store.set_autoreact("parti", str(gone))
+    guild_client.memory_store.set_autoreact("mot1", "<:faux:123>")
+    guild_client.server.emojis.remove(gone)
+    guild_client.index_emojis()
+    loop.run_until_complete(guild_client.clean())
+    autoreact = loop.run_until_complete(guild_client.memory_store.get_autoreact_emojis())
+    assert not "parti" in autoreact
+    assert not "<:faux:123>" in autoreact["mot1"]
+    assert len(autoreact) == 5000
+    assert not "parti" in guild_client.autoreact_matcher.find("parti")
+
+@pytest.mark.parametrize("lookup", ["scan", "index"])
+def test_clean_benchmark(benchmark, loop, big_guild_client, lookup):
+    # 5000 autoreact entries over 500 emojis; "scan" looks emojis up in the guild list as before the index
+    guild_client = big_guild_client
+    if lookup == "scan":
+        guild_client.get_emoji_by_name = lambda emoji_name: discord.utils.get(guild_client.server.emojis, name = emoji_name)
+    benchmark(lambda: loop.run_until_complete(guild_client.clean()))
+    assert len(loop.run_until_complete(guild_client.memory_store.get_autoreact_emojis())) == 5000
@@ -0,0 +1,41 @@
+import random
+
+import pytest
+
+import grocha
+from replay import chat_words
+
+def old_find_command(guild_client, message_split):
+    # How on_message found its command before the registry
+    for word in message_split:
+        word_callback = getattr(guild_client, "on_message_" + word, None)
+        if word_callback:
+            return word_callback
+    return None
+
+def find_command(guild_client, message_split):
+    return next(filter(None, map(guild_client.commands.get, message_split)), None)
+
+def long_mention(guild_client, rng, word_count, command_name = None):
+    words = [f"<@{guild_client.user.id}>"] + [rng.choice(chat_words) for _ in range(word_count)]
+    if command_name:
+        words.insert(rng.randint(len(words) - 5, len(words)), command_name)
+    return grocha.remove_accents(" ".join(words)).lower().split()
+
+def test_registry_finds_the_same_commands(guild_client):
+    rng = random.Random(6)
+    names = [cmd.name for cmd in grocha.GrochaGuild.commands.values()]
+    for i in range(200):
+        message_split = long_mention(guild_client, rng, rng.randint(0, 50), rng.choice(names + [None]))
+        cmd = find_command(guild_client, message_split)
+        old_callback = old_find_command(guild_client, message_split)
+        assert (cmd and cmd.callback.__get__(guild_client)) == old_callback
+
+@pytest.mark.parametrize("lookup", ["getattr", "registry"])
+@pytest.mark.parametrize("command_name", ["emojis", None])
+def test_command_lookup_benchmark(benchmark, guild_client, lookup, command_name):
+    # A 300 words mention, with the command at its end or with no command at all
+    message_split = long_mention(guild_client, random.Random(6), 300, command_name)
+    find = old_find_command if lookup == "getattr" else find_command
+    found = benchmark(find, guild_client, message_split)
+    assert bool(found) == bool(command_name)
@@ -0,0 +1,53 @@
+import random
+import time
+
+import grocha
+from fake_discord import onecall_payload
+from replay import Replayer, chat_words
+
+def flood_events(guild, count, rate, seed = 24):
+    # A raid: messages full of autoreact triggers and the same few commands asked again and again, from everyone
+    rng = random.Random(seed)
+    members = [m.name for m in guild.members]
+    events = []
+    for i in range(count):
+        at = i / rate
+        channel = rng.choice(["general", "jeux"])
+        if rng.random() < 0.2:
+            command = rng.choice(["meteo", "emojis"])
+            events.append({"at": at, "type": "message", "channel": channel, "author": rng.choice(members), "content": f"<@{guild.me.id}> {command}", "handler": command})
+        else:
+            content = " ".join(rng.choice(chat_words) for _ in range(rng.randint(3, 10))) + " miaou"
+            events.append({"at": at, "type": "message", "channel": channel, "author": rng.choice(members), "content": content})
+    return events
+
+def test_flood_sheds_autoreacts_first(loop, monkeypatch, api, bot, guild_client, fake_guild):
+    # The bot's own rate limits are in place: a flood of 150 messages per second for 3 seconds
+    api.latency = 0.005
+    bot.web_client.latency = 0.1
+    bot.web_client.payloads[grocha.openweather_base_url + "/data/2.5/onecall"] = lambda url: onecall_payload(int(time.time()))
+    bot.openweather.onecall_cache.ttl = 0 # Every forecast is fetched, so that commands stay in flight
+    miaou = next(e for e in fake_guild.emojis if e.name == "miaou")
+    for emoji in [str(miaou), "😺", "👍"]:
+        guild_client.memory_store.set_autoreact("miaou", emoji)
+    guild_client.autoreact_matcher.add("miaou")
+    random.seed(24)
+
+    counts = []
+    count = grocha.metrics.count
+    def record_count(kind, name, amount = 1):
+        counts.append((kind, name))
+        count(kind, name, amount)
+    monkeypatch.setattr(grocha.metrics, "count", record_count)
+
+    report = loop.run_until_complete(Replayer(guild_client, fake_guild, speed = 1, overlap = True).replay(flood_events(fake_guild, 450, 150)))
+    assert ("shed", "autoreact") in counts and ("shed", "command") in counts
+    assert ("deduplicated", "meteo") in counts or ("deduplicated", "emojis") in counts
+    assert counts.index(("shed", "autoreact")) < counts.index(("shed", "command")) # Autoreacts give way first
+
+    # Commands that got through were answered quickly, whatever the flood
+    for name in ["meteo", "emojis"]:
+        assert report.histograms[name].percentile(99) < 0.5
+    queued = counts.count(("queued", "meteo")) + counts.count(("queued", "emojis"))
+    assert 0 < queued < report.histograms["meteo"].count + report.histograms["emojis"].count
+    assert len(fake_guild.api.calls) < 3 * 450 # Far fewer REST calls than an answer and three reactions to everything
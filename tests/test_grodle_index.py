@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+import grocha
+
+def french_like_words(rng, count, alphabet = None):
+    # Syllables as French spells them, without accents like grodle words
+    onsets = alphabet or ["", "B", "C", "CH", "D", "F", "G", "GU", "J", "L", "M", "N", "P", "QU", "R", "S", "T", "V", "BR", "TR", "PL", "GR"]
+    vowels = ["A", "E", "I", "O", "U", "OU", "AI", "AU", "EAU", "ON", "AN", "IN", "EU"]
+    codas = ["", "", "", "S", "T", "R", "L", "X", "NT"]
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(onsets) + rng.choice(vowels) + rng.choice(codas) for _ in range(rng.randint(1, 4))))
+    return sorted(words)
+
+def brute_force_count(words, guesses, grodle):
+    # Every word of the grodle's length that would have given the same feedback to every guess
+    feedback = [grocha.grodle_feedback(guess, grodle) for guess in guesses]
+    return sum(1 for word in words if len(word) == len(grodle) and all(grocha.grodle_feedback(guess, word) == f for guess, f in zip(guesses, feedback)))
+
+def random_game(rng, words_by_length):
+    length = rng.choice([l for l, words in words_by_length.items() if len(words) > 10])
+    words = words_by_length[length]
+    return [rng.choice(words) for _ in range(rng.randint(0, 4))], rng.choice(words)
+
+def group_by_length(words):
+    words_by_length = {}
+    for word in words:
+        words_by_length.setdefault(len(word), []).append(word)
+    return words_by_length
+
+def test_count_candidates_matches_brute_force():
+    # Few letters, so that words are full of repeated letters and the counts of each letter matter
+    rng = random.Random(23)
+    words = french_like_words(rng, 3000, alphabet = ["", "B", "L", "N"]) + ["AAAAA", "ABABA", "BAAAB", "BBBBA"]
+    index = grocha.GrodleIndex(words)
+    words_by_length = group_by_length(words)
+    for i in range(400):
+        guesses, grodle = random_game(rng, words_by_length)
+        assert index.count_candidates(guesses, grodle) == brute_force_count(words, guesses, grodle)
+
+@pytest.fixture(scope = "module")
+def big_word_list():
+    return french_like_words(random.Random(23), 300000)
+
+def test_build_benchmark(benchmark, big_word_list):
+    index = benchmark.pedantic(grocha.GrodleIndex, args = (big_word_list,), rounds = 1, iterations = 1)
+    assert sum(map(len, index.words.values())) == 300000
+
+@pytest.mark.parametrize("count", ["index", "brute_force"])
+def test_count_benchmark(benchmark, big_word_list, count):
+    # Three guesses on the most common length, as get_grodle_candidates_message counts them
+    index = grocha.GrodleIndex(big_word_list)
+    words_by_length = group_by_length(big_word_list)
+    length = max(words_by_length, key = lambda l: len(words_by_length[l]))
+    rng = random.Random(23)
+    grodle = rng.choice(words_by_length[length])
+    guesses = rng.sample(words_by_length[length], 3)
+    if count == "index":
+        candidates = benchmark(index.count_candidates, guesses, grodle)
+    else:
+        candidates = benchmark.pedantic(brute_force_count, args = (words_by_length[length], guesses, grodle), rounds = 3, iterations = 1)
+    benchmark.extra_info["words of that length"] = len(words_by_length[length])
+    assert candidates >= 1
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import pytest
+
+import grocha
+from conftest import build_guild
+from replay import Replayer, synthetic_events
+
+slow_command_seconds = 0.5
+
+def add_guilds(loop, bot, api, fake_guild, count):
+    # More fake guilds on the same bot and the same fake Discord, all seeing the bot as the same user
+    guilds = [fake_guild]
+    for i in range(count - 1):
+        guild = build_guild(api)
+        guild.me = fake_guild.me
+        bot._connection._guilds[guild.id] = guild
+        guilds.append(guild)
+    return [(loop.run_until_complete(bot.get_guild_client(guild.id)), guild) for guild in guilds]
+
+def slow_update_events(guild, count, every):
+    # "update" mentions from the admin, whose work goes to the blocking pool
+    return [{"at": every * (i + 0.5), "type": "message", "channel": "general", "author": "admin", "content": f"<@{guild.me.id}> update", "handler": "update"} for i in range(count)]
+
+@pytest.fixture
+def slow_update(bot, monkeypatch):
+    # A pull that takes long in a worker thread, like git and pip would
+    async def update_code(on_output):
+        await bot.loop.run_in_executor(bot.blocking_executor, time.sleep, slow_command_seconds)
+        return "Already up to date."
+    monkeypatch.setattr(bot, "update_code", update_code)
+    monkeypatch.setitem(grocha.GrochaGuild.commands, "update", grocha.GrochaGuild.commands["update"]._replace(cooldown = 0))
+
+@pytest.mark.parametrize("with_slow_command", [False, True])
+def test_slow_guild_has_bounded_impact(benchmark, loop, unlimited_rates, slow_update, bot, api, fake_guild, with_slow_command):
+    # Four guilds chat at once, in real time; the first one also runs slow updates in one variant
+    api.latency = 0.002
+    bot.web_client.payloads["https://fr.wiktionary.org/"] = {"query": {"search": [{"title": "sieste"}]}}
+    guild_clients = add_guilds(loop, bot, api, fake_guild, 4)
+    streams = [synthetic_events(guild, 150, rate = 75, seed = i) for i, (guild_client, guild) in enumerate(guild_clients)]
+    if with_slow_command:
+        streams[0] = sorted(streams[0] + slow_update_events(fake_guild, 3, 0.6), key = lambda e: e["at"])
+    async def replay_all():
+        return await asyncio.gather(*[Replayer(guild_client, guild, speed = 1).replay(events) for (guild_client, guild), events in zip(guild_clients, streams)])
+    reports = benchmark.pedantic(lambda: loop.run_until_complete(replay_all()), rounds = 1, iterations = 1)
+    for i, report in enumerate(reports):
+        benchmark.extra_info[f"guild {i}"] = report.summary()
+    if with_slow_command:
+        assert reports[0].histograms["update"].max >= slow_command_seconds
+    for report in reports[1:]:
+        assert report.overall.percentile(50) < 0.05
+        assert report.overall.percentile(99) < slow_command_seconds / 5
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import threading
+
+import pytest
+
+import grocha
+
+def crash():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+def run_and_crash(changes, crash_point):
+    # In a child process: apply changes with no flush in sight, then die at crash_point without any cleanup
+    async def main():
+        memory = grocha.JsonGuildMemory("memory-1.json", flush_delay = 3600)
+        for path, value in changes:
+            if value is None:
+                memory.delete(path)
+            else:
+                memory.set(path, value)
+        if crash_point == "before_rename":
+            os.replace = lambda *args: crash()
+            memory.flush_now()
+        elif crash_point == "before_truncate":
+            memory.truncate_journal = lambda seq: crash()
+            memory.flush_now()
+        crash()
+    asyncio.run(main())
+
+def crash_in_child(changes, crash_point = None):
+    process = multiprocessing.get_context("fork").Process(target = run_and_crash, args = (changes, crash_point))
+    process.start()
+    process.join()
+    assert process.exitcode == -signal.SIGKILL
+
+changes = [(["autoreact", "miaou", "😺"], True), (["autoreact", "sieste", "😴"], True), (["grodle_games", "1", "1"], {"word": "CHATS", "guesses": []}),
+    (["autoreact", "miaou"], None), (["grodle_games", "1", "1", "guesses"], ["CHIEN"]), (["votes"], {})]
+expected = {"autoreact": {"sieste": {"😴": True}}, "grodle_games": {"1": {"1": {"word": "CHATS", "guesses": ["CHIEN"]}}}, "votes": {}}
+
+@pytest.mark.parametrize("crash_point", [None, "before_rename", "before_truncate"])
+def test_recovers_after_crash(crash_point):
+    crash_in_child(changes, crash_point)
+    memory = grocha.JsonGuildMemory("memory-1.json")
+    assert memory.data == expected
+    assert memory.journal_seq == len(changes)
+
+    # Recovery leaves a full snapshot and an empty journal
+    with open("memory-1.json") as memory_file:
+        assert json.load(memory_file) == {**expected, "_journal_seq": len(changes)}
+    assert os.path.getsize("memory-1.journal") == 0
+
+def test_crash_after_snapshot_before_later_changes():
+    # The snapshot holds the first changes, the journal the later ones
+    memory = grocha.JsonGuildMemory("memory-1.json")
+    for path, value in changes[:3]:
+        memory.set(path, value)
+    memory.flush_now()
+    memory.journal_file.close()
+    crash_in_child(changes[3:])
+    assert grocha.JsonGuildMemory("memory-1.json").data == expected
+
+def test_torn_journal_line():
+    crash_in_child(changes)
+    with open("memory-1.journal", "a") as journal_file:
+        journal_file.write('{"seq": 7, "path": ["votes", "12')
+    memory = grocha.JsonGuildMemory("memory-1.json")
+    assert memory.data == expected
+    assert memory.journal_seq == len(changes)
+
+def test_leftover_temp_file_is_ignored():
+    crash_in_child(changes[:3], "before_rename")
+    assert os.path.exists("memory-1.json.tmp")
+    crash_in_child(changes[3:])
+    assert grocha.JsonGuildMemory("memory-1.json").data == expected
+
+def test_background_flush_overtaken_by_flush_now(loop):
+    # A background flush still writing older contents must not undo what flush_now wrote after it
+    memory = grocha.JsonGuildMemory("memory-1.json", flush_delay = 3600)
+    release = threading.Event()
+    write_snapshot = memory.write_snapshot
+    def slow_write_snapshot(contents, seq):
+        if seq == 1:
+            release.wait(5)
+        write_snapshot(contents, seq)
+    memory.write_snapshot = slow_write_snapshot
+
+    async def race():
+        memory.set(["autoreact"], {"miaou": {"😺": True}})
+        flush = asyncio.ensure_future(memory.flush())
+        await asyncio.sleep(0.05) # The flush is now waiting in its thread
+        memory.set(["autoreact", "sieste"], {"😴": True})
+        memory.flush_now()
+        release.set()
+        await flush
+    loop.run_until_complete(race())
+    memory.journal_file.close()
+
+    with open("memory-1.json") as memory_file:
+        assert json.load(memory_file)["autoreact"] == {"miaou": {"😺": True}, "sieste": {"😴": True}}
+    assert grocha.JsonGuildMemory("memory-1.json").data["autoreact"] == {"miaou": {"😺": True}, "sieste": {"😴": True}}
+
+def test_changes_are_flushed_after_the_delay(loop):
+    memory = grocha.JsonGuildMemory("memory-1.json", flush_delay = 0.05)
+    async def change():
+        for path, value in changes:
+            memory.delete(path) if value is None else memory.set(path, value)
+        await asyncio.sleep(0.2)
+    loop.run_until_complete(change())
+    with open("memory-1.json") as memory_file:
+        assert json.load(memory_file) == {**expected, "_journal_seq": len(changes)}
+    assert os.path.getsize("memory-1.journal") == 0
+
+def big_memory(size):
+    return {"autoreact": {f"mot{i}": {"😺": True, "<:lick:123456789012345678>": True} for i in range(size)}}
+
+@pytest.mark.parametrize("size", [100, 10000])
+def test_benchmark_change(benchmark, loop, size):
+    # A change is one journal append, whatever the size of the memory
+    memory = grocha.JsonGuildMemory("memory-1.json", flush_delay = 3600)
+    memory.data.update(big_memory(size))
+    async def change():
+        memory.set(["grodle_games", "1", "1", "guesses"], ["CHIEN"])
+    benchmark(lambda: loop.run_until_complete(change()))
+    memory.flush_handle.cancel()
+    memory.journal_file.close()
+
+@pytest.mark.parametrize("size", [100, 10000])
+def test_benchmark_snapshot(benchmark, size):
+    memory = grocha.JsonGuildMemory("memory-1.json")
+    memory.data.update(big_memory(size))
+    benchmark(memory.flush_now)
+    memory.journal_file.close()
@@ -0,0 +1,103 @@
+import asyncio
+import math
+import random
+
+import pytest
+
+import grocha
+
+async def old_reply_large(message, reply_contents):
+    # reply_large before chunks were built by split_message
+    reply_body = ""
+    for reply_line in reply_contents.split("\n"):
+        new_reply_body = f"{reply_body}{reply_line}\n"
+        if len(new_reply_body) > 2000:
+            await message.reply(reply_body)
+            reply_body = f"{reply_line}\n"
+        else:
+            reply_body = new_reply_body
+    if len(reply_body) > 0:
+        await message.reply(reply_body)
+
+def get_general(fake_guild):
+    return next(c for c in fake_guild.channels if c.name == "general")
+
+def test_in_flight_content_is_not_sent_again(loop, api, fake_guild):
+    api.latency = 0.01
+    general = get_general(fake_guild)
+    skipped_before = grocha.metrics.counters[("skipped_edits", "message")]
+    async def edit():
+        editor = grocha.MessageEditor(await general.send("E-MAOU-jis..."))
+        editor.edit("E-MAOU-jis : 1")
+        await asyncio.sleep(0) # The edit is now being sent
+        editor.edit("E-MAOU-jis : 1")
+        editor.edit("E-MAOU-jis : 2")
+        editor.edit("E-MAOU-jis : 2")
+        await editor.flush()
+        return editor.message
+    message = loop.run_until_complete(edit())
+    assert message.content == "E-MAOU-jis : 2"
+    assert api.calls.count("PATCH /channels/{channel_id}/messages/{message_id}") == 2
+    assert grocha.metrics.counters[("skipped_edits", "message")] - skipped_before == 2
+
+@pytest.mark.parametrize("coalesced", [False, True])
+def test_leaderboard_edits(benchmark, loop, api, fake_guild, guild_client, coalesced):
+    # A backfill updating its leaderboard after each page, against Discord's 5 edits per 5 seconds (a hundred times faster)
+    for i in range(100):
+        fake_guild.add_emoji(f"chat{i}")
+    api.rate_limit = (5, 0.05)
+    general = get_general(fake_guild)
+    author = fake_guild.members[1]
+    rng = random.Random(18)
+    edits = []
+    async def backfill():
+        response = await general.send("E-MAOU-jis...")
+        editor = grocha.MessageEditor(response)
+        for page in range(100):
+            await asyncio.sleep(0.002) # Reading the next page
+            for i in range(20):
+                emoji = rng.choice(fake_guild.emojis)
+                guild_client.count_emoji_usage(general.id, author.id, response.created_at, emoji.id)
+            leaderboard = grocha.split_message("E-MAOU-jis : (calcul en cours)\n" + guild_client.get_emojis_leaderboard(await guild_client.memory_store.get_emoji_usage()))[0]
+            edits.append(leaderboard)
+            if coalesced:
+                editor.edit(leaderboard)
+            else:
+                await response.edit(content = leaderboard)
+        await editor.flush()
+    def run():
+        api.calls.clear()
+        edits.clear()
+        loop.run_until_complete(backfill())
+    benchmark.pedantic(run, rounds = 3, iterations = 1)
+    patch_calls = api.calls.count("PATCH /channels/{channel_id}/messages/{message_id}")
+    benchmark.extra_info["edit() calls"] = len(edits)
+    benchmark.extra_info["PATCH calls"] = patch_calls
+    if coalesced:
+        assert patch_calls < len(edits) / 2
+    else:
+        assert patch_calls == len(edits)
+
+@pytest.mark.parametrize("reply_large", ["old", "new"])
+def test_autoreact_digest_messages(benchmark, loop, api, fake_guild, guild_client, reply_large):
+    emojis = [str(e) for e in fake_guild.emojis] + ["😺", "👍"]
+    for i in range(2000):
+        for emoji in emojis[i % 5:i % 5 + 3]:
+            guild_client.memory_store.set_autoreact(f"mot{i}", emoji)
+    if reply_large == "old":
+        guild_client.reply_large = old_reply_large
+    general = get_general(fake_guild)
+    message = general.post(fake_guild.members[1], f"<@{fake_guild.me.id}> autoreact")
+    def run():
+        api.calls.clear()
+        general.messages.clear()
+        general.messages.append(message)
+        loop.run_until_complete(guild_client.on_message_autoreact(message, message.content.split()))
+    benchmark.pedantic(run, rounds = 3, iterations = 1)
+    post_calls = api.calls.count("POST /channels/{channel_id}/messages")
+    benchmark.extra_info["POST calls"] = post_calls
+    replies = [m.content for m in general.messages if m.reference is message]
+    assert all(len(r) <= grocha.message_max_length for r in replies)
+    assert sum(r.count("`mot") for r in replies) == 2000
+    digest_length = sum(len(r) + 1 for r in replies)
+    assert post_calls == len(replies) <= math.ceil(digest_length / grocha.message_max_length) + 1
@@ -0,0 +1,18 @@
+import grocha
+
+def worker_metrics(members, latency):
+    worker = grocha.Metrics()
+    worker.set_gauge("cached_members", "", lambda: members)
+    worker.record("command", "meteo", latency)
+    worker.count("shed", "command")
+    return worker
+
+def test_merge_adds_up_workers():
+    merged = grocha.Metrics()
+    for state in [worker_metrics(100, 0.01).get_state(), worker_metrics(200, 0.5).get_state()]:
+        merged.merge(state)
+    assert merged.gauges[("cached_members", "")]() == 300
+    assert merged.counters[("shed", "command")] == 2
+    h = merged.histograms[("command", "meteo")]
+    assert h.count == 2 and h.max == 0.5
+    assert 'grocha_cached_members{name=""} 300' in merged.to_prometheus()
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+import grocha
+from fake_discord import onecall_payload
+
+@pytest.fixture
+def weather_server(loop):
+    # A local stand-in for api.openweathermap.org that counts the requests it receives, slow enough for them to overlap
+    calls = {"geo": 0, "onecall": 0}
+    async def geocode(request):
+        calls["geo"] += 1
+        await asyncio.sleep(0.05)
+        return web.json_response([{"name": request.query["q"].split(",")[0], "lat": 45.75, "lon": 4.85, "country": "FR"}])
+    async def onecall(request):
+        calls["onecall"] += 1
+        await asyncio.sleep(0.05)
+        return web.json_response(onecall_payload(int(time.time())))
+    app = web.Application()
+    app.router.add_get("/geo/1.0/direct", geocode)
+    app.router.add_get("/data/2.5/onecall", onecall)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    web_client = grocha.WebClient()
+    yield grocha.OpenWeatherClient(web_client, f"http://127.0.0.1:{port}"), calls
+    loop.run_until_complete(web_client.close())
+    loop.run_until_complete(runner.cleanup())
+
+def test_concurrent_requests_share_one_fetch(loop, weather_server):
+    openweather, calls = weather_server
+    async def ask_weather():
+        geo = (await openweather.geocode("Lyon"))[0]
+        return await openweather.forecast(geo["lat"], geo["lon"])
+    forecasts = loop.run_until_complete(asyncio.gather(*[ask_weather() for i in range(20)]))
+    assert calls == {"geo": 1, "onecall": 1}
+    assert all(forecast is forecasts[0] for forecast in forecasts)
+    assert "MAOU-téo" in forecasts[0].render("Lyon", "feels_like")
+
+def test_cache_keys(loop, weather_server):
+    openweather, calls = weather_server
+    async def ask_weather():
+        await openweather.geocode("Lyon")
+        await openweather.geocode("LYON") # Same city
+        await openweather.geocode("Paris")
+        await openweather.forecast(45.751, 4.849) # Same place once rounded
+        await openweather.forecast(45.75, 4.85)
+        await openweather.forecast(48.85, 2.35)
+    loop.run_until_complete(ask_weather())
+    assert calls == {"geo": 2, "onecall": 2}
+
+def test_forecast_expires(loop, weather_server):
+    openweather, calls = weather_server
+    openweather.onecall_cache.ttl = 0.1
+    loop.run_until_complete(openweather.forecast(45.75, 4.85))
+    loop.run_until_complete(openweather.forecast(45.75, 4.85))
+    assert calls["onecall"] == 1
+    loop.run_until_complete(asyncio.sleep(0.15))
+    loop.run_until_complete(openweather.forecast(45.75, 4.85))
+    assert calls["onecall"] == 2
+
+def test_prefetch_refreshes_and_keeps_longer(loop, weather_server):
+    openweather, calls = weather_server
+    openweather.onecall_cache.ttl = 0.1
+    loop.run_until_complete(openweather.forecast(45.75, 4.85))
+    loop.run_until_complete(openweather.forecast(45.75, 4.85, prefetch_ttl = 10))
+    assert calls["onecall"] == 2 # Prefetching always fetches
+    loop.run_until_complete(asyncio.sleep(0.15))
+    loop.run_until_complete(openweather.forecast(45.75, 4.85))
+    assert calls["onecall"] == 2
+
+def test_web_errors_are_not_cached(loop, weather_server):
+    openweather, calls = weather_server
+    openweather.base_url += "/missing"
+    for i in range(2):
+        with pytest.raises(Exception):
+            loop.run_until_complete(openweather.forecast(45.75, 4.85))
+    assert openweather.onecall_cache.entries == {}
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import stat
+import time
+
+import pytest
+
+import grocha
+
+fake_git = """#!/bin/sh
+echo "git $*" >> "$OPS_LOG"
+case "$1" in
+    pull)
+        for i in 1 2 3 4 5; do echo "Receiving objects: ${i}0%"; sleep 0.1; done
+        if [ -n "$HANG" ]; then sleep 30 & echo $! > "$HANG"; wait; fi
+        echo "Fast-forward" ;;
+    rev-parse) echo "c0ffee$(grep -c pull "$OPS_LOG")" ;;
+    log) echo "abc1234 - Miaou (2 hours ago) <chat>" ;;
+esac
+"""
+
+fake_systemctl = """#!/bin/sh
+echo "systemctl $*" >> "$OPS_LOG"
+"""
+
+@pytest.fixture
+def ops_log(tmp_path, monkeypatch, bot):
+    # git and systemctl found first on the PATH are shell scripts writing what they were asked to a log
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, script in [("git", fake_git), ("systemctl", fake_systemctl)]:
+        (bin_dir / name).write_text(script)
+        (bin_dir / name).chmod(stat.S_IRWXU)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("OPS_LOG", str(tmp_path / "ops.log"))
+    (tmp_path / "ops.log").write_text("")
+    bot.ops.entries.pop("build_info", None)
+    return lambda: (tmp_path / "ops.log").read_text().splitlines()
+
+async def watch_loop(until, lags):
+    # How late the event loop wakes up a task sleeping 10ms at a time
+    while not until.done():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - start - 0.01)
+
+def test_slow_pull_keeps_the_loop_responsive(loop, bot, ops_log):
+    outputs = []
+    lags = []
+    async def update():
+        update_task = asyncio.ensure_future(bot.update_code(outputs.append))
+        await asyncio.gather(update_task, watch_loop(update_task, lags))
+        return update_task.result()
+    output = loop.run_until_complete(update())
+
+    assert output.endswith("Fast-forward")
+    assert len(lags) > 20 and max(lags) < 0.1
+    assert len(outputs) == 6 and outputs[0] == "Receiving objects: 10%" # Streamed line by line
+    assert ops_log() == ["git pull --rebase --autostash"]
+
+def test_concurrent_updates_share_one_pull(loop, bot, ops_log):
+    outputs_a, outputs_b = [], []
+    async def updates():
+        return await asyncio.gather(bot.update_code(outputs_a.append), bot.update_code(outputs_b.append))
+    output_a, output_b = loop.run_until_complete(updates())
+    assert output_a == output_b
+    assert outputs_a == outputs_b and outputs_a
+    assert ops_log().count("git pull --rebase --autostash") == 1
+
+def test_build_info_is_read_again_after_an_update(loop, bot, ops_log):
+    async def read_twice():
+        return [await bot.get_build_info(), await bot.get_build_info()]
+    first, second = loop.run_until_complete(read_twice())
+    assert first is second and first["sha1"] == "c0ffee0"
+    assert ops_log().count("git rev-parse HEAD") == 1
+
+    loop.run_until_complete(bot.update_code(lambda output: None))
+    assert loop.run_until_complete(bot.get_build_info())["sha1"] == "c0ffee1"
+
+def test_timeout_kills_the_process_and_its_children(loop, ops_log, tmp_path, monkeypatch):
+    monkeypatch.setenv("HANG", str(tmp_path / "hang.pid"))
+    start = time.perf_counter()
+    output = loop.run_until_complete(grocha.run_process(["git", "pull"], timeout = 0.8))
+    assert time.perf_counter() - start < 5
+    assert output.endswith("(killed after 0.8s)")
+    sleep_pid = int((tmp_path / "hang.pid").read_text())
+    time.sleep(0.1)
+    assert get_process_state(sleep_pid) in [None, "Z"] # Gone, or dead and waiting for init to reap it
+
+def get_process_state(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            return stat_file.read().rsplit(")", 1)[1].split()[0]
+    except FileNotFoundError:
+        return None
+
+def test_update_version_and_restart_commands(loop, bot, guild_client, fake_guild, ops_log):
+    channel = next(c for c in fake_guild.channels if c.name == "general")
+    admin = fake_guild.members[0]
+    def command(content):
+        message = channel.post(admin, f"<@{fake_guild.me.id}> {content}")
+        loop.run_until_complete(guild_client.on_message(message))
+        loop.run_until_complete(asyncio.gather(*guild_client.command_tasks))
+        return next(m for m in channel.messages if m.reference is message)
+
+    assert "c0ffee0" in command("version").content
+    reply = command("update")
+    loop.run_until_complete(asyncio.sleep(0.05)) # Last edit
+    assert "Fast-forward" in reply.content and "Miaou" in reply.content
+    assert "c0ffee1" in command("version").content
+    command("restart")
+    assert ops_log()[-1] == "systemctl --user restart bot-grocha"
@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import pytest
+
+import grocha
+
+@pytest.fixture
+def reloaded_source(tmp_path, monkeypatch):
+    # load_new_code reads the file grocha was loaded from: a copy, with extra lines when a test needs them
+    def write(extra = ""):
+        file_name = tmp_path / "grocha.py"
+        with open(grocha.__file__, encoding = "utf-8") as source_file:
+            file_name.write_text(source_file.read() + "\n" + extra, encoding = "utf-8")
+        monkeypatch.setattr(grocha, "__file__", str(file_name))
+    return write
+
+def test_command_downtime_during_reload(loop, unlimited_rates, bot, guild_client, fake_guild, reloaded_source):
+    reloaded_source("GrochaGuild.on_reload = lambda self: setattr(self, 'reloaded', True)")
+    channel = next(c for c in fake_guild.channels if c.name == "general")
+    guild_client.memory_store.set(["votes", "123"], {"kind": "greet", "members": [1], "voters": {}})
+    old_class = guild_client.__class__
+
+    latencies = []
+    async def send_commands(until):
+        # A command every few milliseconds, each timed until its reply, from a little before the reload to a little after
+        while not until.done():
+            message = channel.post(fake_guild.members[1], f"<@{fake_guild.me.id}> weekend")
+            sent = time.perf_counter()
+            await guild_client.on_message(message)
+            await asyncio.gather(*guild_client.command_tasks)
+            assert any(m.reference is message for m in channel.messages)
+            latencies.append(time.perf_counter() - sent)
+            await asyncio.sleep(0.002)
+    async def reload():
+        async def reload_then_wait():
+            await asyncio.sleep(0.05)
+            await bot.reload_code()
+            await asyncio.sleep(0.05)
+        reload_task = asyncio.ensure_future(reload_then_wait())
+        await asyncio.gather(reload_task, send_commands(reload_task))
+    loop.run_until_complete(reload())
+
+    print(f"{len(latencies)} commands around the reload, slowest answered in {max(latencies) * 1000:.1f} ms")
+    assert max(latencies) < 1
+    assert guild_client.__class__ is not old_class and guild_client.__class__.__name__ == "GrochaGuild"
+    assert bot.__class__ is not grocha.GrochaBot
+    assert guild_client.reloaded
+    assert guild_client.memory["votes"]["123"]["kind"] == "greet" # State carried over
+    assert bot.guild_clients[fake_guild.id] is guild_client
+
+    # Commands run from the new code afterwards
+    message = channel.post(fake_guild.members[1], f"<@{fake_guild.me.id}> weekend")
+    loop.run_until_complete(guild_client.on_message(message))
+    loop.run_until_complete(asyncio.gather(*guild_client.command_tasks))
+    assert "weekend" in channel.messages[-1].content
+
+def test_broken_code_keeps_the_old_one(loop, bot, guild_client, reloaded_source):
+    reloaded_source("def broken(:\n    pass")
+    with pytest.raises(SyntaxError):
+        loop.run_until_complete(bot.reload_code())
+    assert guild_client.__class__ is grocha.GrochaGuild
+    assert bot.__class__ is grocha.GrochaBot
+
+def test_failing_on_reload_rolls_back(loop, bot, guild_client, reloaded_source):
+    reloaded_source("def on_reload(self):\n    raise Exception('miaou')\nGrochaGuild.on_reload = on_reload")
+    with pytest.raises(Exception, match = "miaou"):
+        loop.run_until_complete(bot.reload_code())
+    assert guild_client.__class__ is grocha.GrochaGuild
+    assert bot.__class__ is grocha.GrochaBot
+
+def test_hot_reload_reply(loop, bot, guild_client, fake_guild, reloaded_source):
+    reloaded_source("raise ImportError('miaou')")
+    channel = next(c for c in fake_guild.channels if c.name == "general")
+    message = channel.post(fake_guild.members[1], "update")
+    loop.run_until_complete(guild_client.hot_reload(message))
+    assert "je garde l'ancien" in channel.messages[-1].content
+    assert guild_client.__class__ is grocha.GrochaGuild
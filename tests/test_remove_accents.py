@@ -0,0 +1,54 @@
+import random
+import re
+import unicodedata
+
+import grocha
+from replay import chat_words
+
+def old_remove_accents(str):
+    # remove_accents as it was, one character at a time
+    return "".join(map(lambda c:
+        c if re.search(grocha.native_emoji_regex, c)
+        else unicodedata.normalize('NFKD', c).encode('ASCII', 'ignore').decode('ascii'), str))
+
+def random_text(rng):
+    # Mostly chat-like text, with characters from anywhere in Unicode mixed in
+    pieces = []
+    for i in range(rng.randint(0, 40)):
+        roll = rng.random()
+        if roll < 0.5:
+            pieces.append(rng.choice(chat_words))
+        elif roll < 0.7:
+            pieces.append(rng.choice(["😺", "👍🏽", "🇫🇷", "❤️", "Œuvre", "ﬁn", "Ａ", "½", "İ", "ß", "́", "\t", "<:lick:42>"]))
+        else:
+            pieces.append("".join(chr(rng.choice([rng.randint(0, 0x2fff), rng.randint(0, 0xd7ff), rng.randint(0xe000, 0x10ffff)])) for _ in range(rng.randint(1, 5))))
+    return rng.choice(["", " ", "\n"]).join(pieces)
+
+def test_same_as_before_on_random_text():
+    rng = random.Random(8)
+    for i in range(5000):
+        text = random_text(rng)
+        assert grocha.remove_accents(text) == old_remove_accents(text), repr(text)
+
+def test_same_as_before_for_every_character():
+    # Both map characters one by one, so agreeing on each one is agreeing on every string
+    for code in range(0x110000):
+        if not 0xd800 <= code < 0xe000: # Surrogates can't be encoded on their own
+            c = chr(code)
+            assert grocha.remove_accents(c) == old_remove_accents(c), hex(code)
+
+def test_ascii_is_returned_as_is():
+    text = "miaou les croquettes"
+    assert grocha.remove_accents(text) is text
+
+def chat_corpus():
+    rng = random.Random(0)
+    return [" ".join(rng.choice(chat_words + ["😺", "<:lick:123456789012345678>"]) for _ in range(rng.randint(3, 25))) for i in range(2000)]
+
+def test_benchmark_remove_accents(benchmark):
+    corpus = chat_corpus()
+    benchmark(lambda: [grocha.remove_accents(text) for text in corpus])
+
+def test_benchmark_old_remove_accents(benchmark):
+    corpus = chat_corpus()
+    benchmark.pedantic(lambda: [old_remove_accents(text) for text in corpus], rounds = 3)
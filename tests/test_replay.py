@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+import grocha
+from replay import Replayer, load_events, save_events, synthetic_events
+
+def get_errors(fake_guild):
+    debug_channel = next(c for c in fake_guild.channels if c.name == "debug")
+    return [m.content for m in debug_channel.messages if "bobo" in m.content]
+
+def run_replay(benchmark, loop, guild_client, fake_guild, events, **kwargs):
+    # Each round replays the whole stream, the report of the last one goes with the benchmark results
+    reports = []
+    def replay():
+        reports.append(loop.run_until_complete(Replayer(guild_client, fake_guild, **kwargs).replay(events)))
+    benchmark.pedantic(replay, rounds = 3, iterations = 1)
+    benchmark.extra_info["report"] = reports[-1].summary()
+    assert get_errors(fake_guild) == []
+    return reports[-1]
+
+@pytest.fixture
+def wiktionary_payload(bot):
+    bot.web_client.payloads["https://fr.wiktionary.org/"] = {"query": {"search": [{"title": "sieste"}]}}
+
+def test_replay_on_message(benchmark, loop, unlimited_rates, guild_client, fake_guild):
+    events = synthetic_events(fake_guild, 500, commands = ())
+    report = run_replay(benchmark, loop, guild_client, fake_guild, events)
+    assert report.event_count == 500
+    assert report.histograms["on_message"].count > 300
+
+def test_replay_autoreact(benchmark, loop, unlimited_rates, guild_client, fake_guild):
+    miaou = next(e for e in fake_guild.emojis if e.name == "miaou")
+    for word in ["miaou", "sieste", "ce soir"]:
+        guild_client.memory_store.set_autoreact(word, str(miaou))
+        guild_client.memory_store.set_autoreact(word, "😺")
+        guild_client.autoreact_matcher.add(word)
+    events = synthetic_events(fake_guild, 500, commands = ())
+    run_replay(benchmark, loop, guild_client, fake_guild, events)
+    general = next(c for c in fake_guild.channels if c.name == "general")
+    assert any(m.reactions for m in general.messages)
+
+def test_replay_autoreact_command(benchmark, loop, unlimited_rates, guild_client, fake_guild):
+    events = synthetic_events(fake_guild, 300, commands = ("autoreact",))
+    report = run_replay(benchmark, loop, guild_client, fake_guild, events)
+    assert report.histograms["autoreact"].count > 0
+    assert loop.run_until_complete(guild_client.memory_store.get_autoreact_emojis())
+
+def test_replay_emojis(benchmark, loop, unlimited_rates, guild_client, fake_guild):
+    events = synthetic_events(fake_guild, 300, commands = ("emojis",))
+    report = run_replay(benchmark, loop, guild_client, fake_guild, events)
+    assert report.histograms["emojis"].count > 0
+    assert loop.run_until_complete(guild_client.memory_store.get_emoji_usage())
+
+def test_replay_grodle(benchmark, loop, unlimited_rates, wiktionary_payload, guild_client, fake_guild):
+    events = synthetic_events(fake_guild, 300, commands = ("grodle",))
+    report = run_replay(benchmark, loop, guild_client, fake_guild, events)
+    assert report.histograms["grodle"].count > 0
+
+def test_replay_reactions(benchmark, loop, unlimited_rates, guild_client, fake_guild):
+    events = synthetic_events(fake_guild, 500, commands = ())
+    report = run_replay(benchmark, loop, guild_client, fake_guild, events)
+    assert report.histograms["raw_reaction_add"].count > 0
+    assert report.histograms["raw_reaction_remove"].count > 0
+
+def test_allocation_counts(loop, unlimited_rates, guild_client, fake_guild):
+    events = synthetic_events(fake_guild, 100, commands = ("emojis",))
+    report = loop.run_until_complete(Replayer(guild_client, fake_guild, trace_allocations = True).replay(events))
+    assert report.peak_bytes["on_message"] > 0
+    assert "blocks kept/event" in report.summary()
+
+def test_recorded_stream_at_speed(loop, unlimited_rates, guild_client, fake_guild, tmp_path):
+    events = synthetic_events(fake_guild, 50, commands = ())
+    save_events(events, tmp_path / "events.jsonl")
+    recorded = load_events(tmp_path / "events.jsonl")
+    assert recorded == events
+
+    report = loop.run_until_complete(Replayer(guild_client, fake_guild, speed = 20).replay(recorded))
+    assert report.duration >= events[-1]["at"] / 20
+    assert report.event_count == 50
+
+def test_fake_discord_latency_and_rate_limit(loop, api, fake_guild):
+    api.latency = 0.01
+    api.rate_limit = (5, 0.1)
+    general = next(c for c in fake_guild.channels if c.name == "general")
+    async def send_many():
+        await asyncio.gather(*[general.send(f"miaou {i}") for i in range(12)])
+    time_start = loop.time()
+    loop.run_until_complete(send_many())
+    assert loop.time() - time_start >= 0.2 # 12 calls, 5 per 0.1s
+    assert api.rate_limited > 0
+    assert api.calls.count("POST /channels/{channel_id}/messages") == 12
+
+def test_history_pagination(loop, api, fake_guild):
+    general = next(c for c in fake_guild.channels if c.name == "general")
+    author = fake_guild.members[0]
+    for i in range(250):
+        general.post(author, f"miaou {i}")
+    reader = grocha.HistoryReader(grocha.TokenBucket(1e9, 1e9), page_size = 100)
+    pages = []
+    async def on_page(channel, messages):
+        pages.append(messages)
+    loop.run_until_complete(reader.read([(general, None)], on_page))
+    assert list(map(len, pages)) == [100, 100, 50]
+    assert [m.content for page in pages for m in page] == [f"miaou {i}" for i in reversed(range(250))]
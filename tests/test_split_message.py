@@ -0,0 +1,60 @@
+import random
+import re
+
+import grocha
+
+emoji_regex = "<a?:\\w+:\\d+>"
+
+def random_contents(rng):
+    # Words, custom emojis, code blocks (some with a language) and lines too long for a single message
+    lines = []
+    in_fence = False
+    for i in range(rng.randint(1, 80)):
+        roll = rng.random()
+        if roll < 0.1 and not (lines and lines[-1].startswith("```")):
+            lines.append("```" if in_fence else rng.choice(["```", "```py", "```diff"]))
+            in_fence = not in_fence
+        elif roll < 0.15:
+            lines.append("".join(rng.choice("abcdef") for _ in range(rng.randint(1000, 4500))))
+        elif roll < 0.2:
+            lines.append("".join(f"<:chat{j}:{rng.randint(10**17, 10**18)}>" for j in range(rng.randint(10, 120))))
+        else:
+            words = [rng.choice(["miaou", "croquettes", "sieste", "<:lick:123456789012345678>", "<a:ronron:42>", "é", "`x`"]) for _ in range(rng.randint(0, 400))]
+            lines.append(" ".join(words))
+    if in_fence:
+        lines.append("miaou")
+        lines.append("```")
+    return "\n".join(lines)
+
+def visible_text(text):
+    # What must survive the split: everything but whitespace and fences
+    return "".join(re.sub("```\\w*", "", text).split())
+
+def test_split_message_random():
+    rng = random.Random(18)
+    for i in range(300):
+        contents = random_contents(rng)
+        limit = rng.choice([grocha.message_max_length, 200, 60])
+        chunks = grocha.split_message(contents, limit)
+        for chunk in chunks:
+            assert len(chunk) <= limit
+            assert chunk.count("```") % 2 == 0
+            assert not re.search("```\\w*\n```", chunk) # No empty code block
+            assert chunk.strip()
+        assert sum(len(re.findall(emoji_regex, chunk)) for chunk in chunks) == len(re.findall(emoji_regex, contents))
+        assert "".join(map(visible_text, chunks)).replace("```", "") == visible_text(contents)
+
+def test_split_message_code_block_fills_chunk():
+    # Only the line opening the block fits before the limit: the block starts in the next chunk
+    contents = "a" * 1990 + "\n```\n" + "b" * 100 + "\n```"
+    chunks = grocha.split_message(contents)
+    assert chunks == ["a" * 1990, "```\n" + "b" * 100 + "\n```"]
+
+def test_split_message_long_code_block():
+    contents = "```py\n" + "\n".join(["print('miaou')"] * 400) + "\n```"
+    chunks = grocha.split_message(contents)
+    assert len(chunks) > 1
+    assert chunks[0].startswith("```py\n")
+    for chunk in chunks:
+        assert len(chunk) <= grocha.message_max_length
+        assert chunk.startswith("```") and chunk.endswith("```")
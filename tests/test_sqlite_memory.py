@@ -0,0 +1,133 @@
+import json
+import random
+import sqlite3
+
+import pytest
+
+import grocha
+from replay import Replayer, synthetic_events
+
+async def fill_memory(memory_store):
+    # The same changes as the bot makes them, with a few overwrites and deletions
+    memory_store.set(["votes", "123"], {"kind": "greet", "members": [1], "voters": {}})
+    memory_store.set(["votes", "456"], {"kind": "kick", "members": [2], "voters": {"3": True}})
+    memory_store.delete(["votes", "456"])
+    memory_store.set(["emoji_index_start"], 42)
+    for word, emoji in [("miaou", "😺"), ("miaou", "<:miaou:1>"), ("sieste", "😴"), ("ce soir", "<:lune:2>"), ("sieste", "<:ronron:3>")]:
+        memory_store.set_autoreact(word, emoji)
+    memory_store.delete_autoreact("sieste", "😴")
+    memory_store.delete_autoreact("ce soir", "<:lune:2>")
+    memory_store.delete_autoreact("absent")
+    for channel_id, user_id, day, emoji_id, delta in [("10", "1", "2026-10-01", "1", 1), ("10", "1", "2026-10-01", "1", 1), ("10", "2", "2026-10-02", "3", 1),
+            ("11", "2", "2026-10-02", "1", 1), ("11", "2", "2026-10-02", "3", -1), ("11", "1", "2026-10-03", "3", 1), ("10", "2", "2026-10-02", "3", -1)]:
+        memory_store.count_emoji_usage(channel_id, user_id, day, emoji_id, delta)
+
+async def read_memory(memory_store):
+    usage = lambda channel_ids = None, user_ids = None: memory_store.get_emoji_usage(channel_ids, user_ids)
+    return {
+        "votes": memory_store.data.get("votes"),
+        "emoji_index_start": memory_store.data.get("emoji_index_start"),
+        "autoreact": await memory_store.get_autoreact_emojis(),
+        "autoreact miaou": await memory_store.get_autoreact_emojis(["miaou", "ce soir", "absent"]),
+        "usage": {k: v for k, v in (await usage()).items() if v},
+        "usage 10": {k: v for k, v in (await usage({"10"})).items() if v},
+        "usage 2": {k: v for k, v in (await usage(user_ids = {"2"})).items() if v},
+        "usage 11 1": {k: v for k, v in (await usage({"11"}, {"1"})).items() if v},
+    }
+
+expected_memory = {
+    "votes": {"123": {"kind": "greet", "members": [1], "voters": {}}},
+    "emoji_index_start": 42,
+    "autoreact": {"miaou": ["😺", "<:miaou:1>"], "sieste": ["<:ronron:3>"]},
+    "autoreact miaou": {"miaou": ["😺", "<:miaou:1>"]},
+    "usage": {"1": 3, "3": 1},
+    "usage 10": {"1": 2},
+    "usage 2": {"1": 1},
+    "usage 11 1": {"3": 1},
+}
+
+@pytest.mark.parametrize("backend", [grocha.JsonGuildMemory, grocha.SqliteGuildMemory])
+def test_memory_round_trip(loop, backend):
+    # Both backends answer the same, before and after reopening the file
+    file_name = "memory-1.json" if backend is grocha.JsonGuildMemory else "memory-1.sqlite"
+    async def run():
+        memory_store = backend(file_name)
+        await fill_memory(memory_store)
+        assert await read_memory(memory_store) == expected_memory
+        memory_store.flush_now()
+        assert await read_memory(backend(file_name)) == expected_memory
+    loop.run_until_complete(run())
+
+def test_sqlite_tables(loop):
+    # Autoreacts and emoji usage are rows of their own tables, not tree leaves
+    async def run():
+        memory_store = grocha.SqliteGuildMemory("memory-1.sqlite")
+        await fill_memory(memory_store)
+        memory_store.flush_now()
+    loop.run_until_complete(run())
+    assert not "autoreact" in grocha.SqliteGuildMemory("memory-1.sqlite").data
+    connection = sqlite3.connect("memory-1.sqlite")
+    assert connection.execute("SELECT COUNT(*) FROM memory WHERE path LIKE 'autoreact%' OR path LIKE 'emoji_usage%'").fetchone() == (0,)
+    assert connection.execute("SELECT COUNT(*) FROM autoreact").fetchone() == (3,)
+    assert connection.execute("SELECT count FROM emoji_usage WHERE channel_id = '10' AND user_id = '2'").fetchall() == [(0,)]
+    plan = " ".join(row[-1] for row in connection.execute("EXPLAIN QUERY PLAN SELECT emoji_id, SUM(count) FROM emoji_usage WHERE user_id IN ('1') GROUP BY emoji_id"))
+    assert "emoji_usage_by_user" in plan
+
+def test_sqlite_moves_tree_rows_to_tables(loop):
+    # A file written before the tables existed has autoreacts and emoji usage as tree leaves
+    connection = sqlite3.connect("memory-1.sqlite")
+    connection.execute("CREATE TABLE memory (path TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    rows = [(["autoreact", "miaou", "😺"], True), (["emoji_usage", "10", "1", "2026-10-01", "1"], 4), (["votes", "123", "kind"], "greet")]
+    connection.executemany("INSERT INTO memory (path, value) VALUES (?, ?)", [("\x1f".join(path), json.dumps(value)) for path, value in rows])
+    connection.commit()
+    connection.close()
+    async def run():
+        memory_store = grocha.SqliteGuildMemory("memory-1.sqlite")
+        assert memory_store.data == {"votes": {"123": {"kind": "greet"}}}
+        assert await memory_store.get_autoreact_emojis() == {"miaou": ["😺"]}
+        assert await memory_store.get_emoji_usage() == {"1": 4}
+    loop.run_until_complete(run())
+
+def test_migrate_memory_files(loop):
+    async def run():
+        json_memory = grocha.JsonGuildMemory("memory-1.json")
+        await fill_memory(json_memory)
+        json_memory.flush_now()
+        json_memory.set(["emoji_backfill"], {"10": 99}) # Still in the journal only
+        grocha.migrate_memory_files()
+        memory_store = grocha.SqliteGuildMemory("memory-1.sqlite")
+        assert await read_memory(memory_store) == expected_memory
+        assert memory_store.data["emoji_backfill"] == {"10": 99}
+    loop.run_until_complete(run())
+
+def test_replay_with_sqlite_memory(loop, monkeypatch, unlimited_rates, bot, fake_guild):
+    monkeypatch.setattr(grocha.config, "MEMORY_BACKEND", "sqlite", raising = False)
+    guild_client = loop.run_until_complete(bot.get_guild_client(fake_guild.id))
+    assert isinstance(guild_client.memory_store, grocha.SqliteGuildMemory)
+    events = synthetic_events(fake_guild, 300, commands = ("emojis", "autoreact"))
+    report = loop.run_until_complete(Replayer(guild_client, fake_guild).replay(events))
+    assert report.histograms["autoreact"].count > 0
+    assert loop.run_until_complete(guild_client.memory_store.get_autoreact_emojis())
+    assert loop.run_until_complete(guild_client.memory_store.get_emoji_usage())
+    debug_channel = next(c for c in fake_guild.channels if c.name == "debug")
+    assert not [m.content for m in debug_channel.messages if "bobo" in m.content]
+
+def test_emoji_usage_backends_agree(loop):
+    # The JSON store answers from running totals, the SQLite one by summing rows: random counts and filters, before and after reopening
+    rng = random.Random(1)
+    channel_ids, user_ids, emoji_ids = ["10", "11", "12"], [str(i) for i in range(8)], [str(i) for i in range(20)]
+    filters = [(None, None)] + [(rng.choice([None, set(rng.sample(channel_ids, rng.randint(1, 3)))]), rng.choice([None, set(rng.sample(user_ids, rng.randint(1, 8))) | {"absent"}]))
+        for i in range(30)]
+    async def run():
+        memory_stores = [grocha.JsonGuildMemory("memory-1.json"), grocha.SqliteGuildMemory("memory-1.sqlite")]
+        for i in range(2000):
+            row = (rng.choice(channel_ids), rng.choice(user_ids), f"2026-10-{rng.randint(1, 28):02}", rng.choice(emoji_ids), rng.choice([1, 1, 1, -1]))
+            for memory_store in memory_stores:
+                memory_store.count_emoji_usage(*row)
+        for memory_store in memory_stores:
+            memory_store.flush_now()
+        for memory_stores in [memory_stores, [grocha.JsonGuildMemory("memory-1.json"), grocha.SqliteGuildMemory("memory-1.sqlite")]]:
+            for channel_filter, user_filter in filters:
+                json_usage, sqlite_usage = [await m.get_emoji_usage(channel_filter, user_filter) for m in memory_stores]
+                assert {k: v for k, v in json_usage.items() if v} == {k: v for k, v in sqlite_usage.items() if v}
+    loop.run_until_complete(run())
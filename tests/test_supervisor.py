@@ -0,0 +1,80 @@
+import asyncio
+import multiprocessing
+import os
+import stat
+import threading
+
+import pytest
+
+import grocha
+from fake_gateway import read_log, run_fake_worker, wait_for
+
+fake_git = """#!/bin/sh
+echo "Receiving objects: 100%"
+echo "Fast-forward"
+"""
+
+@pytest.fixture
+def supervisor(tmp_path, monkeypatch):
+    # run_supervisor in its own process, with fake workers and a fake git; killing it ends the workers too
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "git").write_text(fake_git)
+    (bin_dir / "git").chmod(stat.S_IRWXU)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_WORKER_LOG", str(tmp_path / "workers.log"))
+    (tmp_path / "workers.log").write_text("")
+    process = multiprocessing.get_context("fork").Process(target = grocha.run_supervisor, args = (2, 2, run_fake_worker))
+    process.start()
+    yield process
+    process.kill()
+    process.join()
+
+def test_supervisor_protocol(supervisor):
+    wait_for(lambda: read_log().count("start 1") == 3) # First start, restart, then restart after its exit
+    wait_for(lambda: read_log().count("metrics 1") == 3 and read_log().count("metrics 0") == 2)
+    log = read_log()
+    assert "profile 2 300" in log # Both workers' states
+    assert log.index("updated 0") < log.index("update replied Fast-forward") # Build info is refreshed before the answer
+    assert "updated 1" in log
+    assert log.count("start 0") == 2 # Restarted along with every worker
+    assert log.index("exit 1") < len(log) - 1 - log[::-1].index("start 1")
+
+def test_worker_side(loop, bot):
+    # A GrochaBot with a supervisor: update is asked through the pipe, the "updated" notice refreshes build info
+    connection, bot.supervisor = multiprocessing.Pipe()
+    requests = []
+    def supervise():
+        while True:
+            try:
+                request = connection.recv()
+            except EOFError:
+                return
+            requests.append(request["op"])
+            if request["op"] == "update":
+                connection.send({"op": "updated"})
+                connection.send({"op": "reply", "value": "Fast-forward"})
+            elif request["op"] == "profile":
+                connection.send({"op": "reply", "value": [request["state"], request["state"]]})
+            elif request["op"] == "stop":
+                return connection.close()
+    supervisor_thread = threading.Thread(target = supervise, daemon = True)
+    supervisor_thread.start()
+
+    async def talk():
+        assert "build_info" in bot.ops.entries
+        assert await bot.update_code(lambda output: None) == "Fast-forward"
+        assert not "build_info" in bot.ops.entries
+        states = await bot.ask_supervisor({"op": "profile", "state": grocha.metrics.get_state()})
+        assert len(states) == 2
+
+        # No supervisor anymore: the worker closes, to be started again by the next supervisor
+        await bot.loop.run_in_executor(None, bot.supervisor.send, {"op": "stop"})
+        for i in range(100):
+            if bot.is_closed():
+                break
+            await asyncio.sleep(0.01)
+        assert bot.is_closed()
+    loop.run_until_complete(talk())
+    supervisor_thread.join(5)
+    assert requests == ["update", "profile", "stop"]
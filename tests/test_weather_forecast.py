@@ -0,0 +1,152 @@
+import glob
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import grocha
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+def old_render(weather, city_name, temp_type):
+    # The weather report as on_message_weather built it before WeatherForecast
+    def get_datetime(dt):
+        return datetime.fromtimestamp(dt, timezone(timedelta(seconds=weather['timezone_offset'])))
+    def is_day_time(dt):
+        return len([d for d in weather['daily'] if d['sunrise'] < dt and dt < d['sunset']]) > 0
+    def get_night_sky_emoji(dt):
+        for d in [d for d in weather['daily'] if d['moonrise'] < dt and dt < d['moonset']]:
+            phase = round(d["moon_phase"] * 4)
+            if phase == 1: return ":first_quarter_moon:"
+            elif phase == 2: return ":full_moon:"
+            elif phase == 3: return ":last_quarter_moon:"
+            else: return ":new_moon:"
+        return ":night_with_stars:" # No moon in the sky
+    def get_weather_emoji(dt, id):
+        day_time = is_day_time(dt)
+        weather_emoji = [
+            (200, ":thunder_cloud_rain:"),
+            (300, ":cloud_rain:"),
+            (600, ":cloud_snow:"),
+            (800, ":sunny:" if day_time else get_night_sky_emoji(dt)),
+            (801, ":white_sun_small_cloud:" if day_time else ":cloud:"),
+            (802, ":white_sun_cloud:" if day_time else ":cloud:"),
+            (803, ":white_sun_cloud:" if day_time else ":cloud:"),
+            (804, ":cloud:"),
+        ]
+        weather_emoji.reverse()
+        # Take first value equal or below id
+        for pair in weather_emoji:
+            if pair[0] <= id:
+                return pair[1]
+
+    def get_temp(temp_block):
+        if type(temp_block) == dict:
+            return f"{round(min(temp_block.values()))}°/{round(max(temp_block.values()))}°".rjust(6)
+        else:
+            return f"{format(temp_block, '.1f')}°".rjust(6)
+    def get_weather_desc(weather_block):
+        return f"{get_weather_emoji(weather_block['dt'], weather_block['weather'][0]['id'])}`{get_temp(weather_block[temp_type])}`"
+
+    current_time = weather['current']['dt']
+    current_date = get_datetime(current_time)
+
+    response = f"MAOU-téo:"
+    response += f"\nEn ce moment à {city_name} ({current_date}) : {get_weather_desc(weather['current'])}"
+
+    # Rain in the next hour
+    active_minutely = list(filter(lambda m: m['precipitation'] > 0, weather['minutely']))
+    if len(active_minutely) > 0:
+        minutes_to_rain = round((active_minutely[0]['dt'] - current_time) / 60)
+        if minutes_to_rain > 0:
+            response += f"\nPluie dans {minutes_to_rain} minutes :umbrella:"
+        else:
+            inactive_minutely = list(filter(lambda m: m['precipitation'] == 0, weather['minutely']))
+            if len(inactive_minutely) > 0:
+                minutes_to_clear = round((inactive_minutely[0]['dt'] - current_time) / 60)
+                response += f"\nLa pluie s'arrêtera dans {minutes_to_clear} minutes :umbrella:"
+            else:
+                response += f"\nLa pluie s'arrêtera dans plus d'une heure :umbrella:"
+    else:
+        response += f"\nPas de pluie prévue dans l'heure :muscle:"
+
+    # Weather per hour
+    response += "\n"
+    def get_weather_for_hour(hour):
+        weather_block = weather['hourly'][hour]
+        date = get_datetime(weather_block['dt'])
+        return f"`{format(date.hour, '0>2')}h:`{get_weather_desc(weather_block)}"
+    for hour in range(0, min(16, len(weather['hourly'])), 4):
+        response += "\n" + " ".join([get_weather_for_hour(h) for h in range(hour, hour + 4)])
+
+    # Weather per day
+    response += "\n"
+    def get_weather_for_day(day):
+        day_name = ("Lun", "Mar", "Mer", "Jeu", "Ven", "Sam", "Dim")
+        weather_block = weather['daily'][day]
+        date = get_datetime(weather_block['dt'])
+        return f"`{day_name[date.weekday()]}:`{get_weather_desc(weather_block)}"
+    response += "\n" + " ".join([get_weather_for_day(day) for day in range(min(6, len(weather['daily'])))])
+    return response
+
+def random_payload(rng):
+    # Overlapping and touching sun and moon intervals, times on their bounds, any condition id and rain pattern
+    now = rng.randint(1600000000, 1700000000)
+    times = [now + rng.randint(-2, 40) * 1800 for i in range(20)]
+    def at():
+        return rng.choice(times) if rng.random() < 0.3 else now + rng.randint(-3600, 8 * 86400)
+    def block(dt, temp):
+        return {"dt": dt, "weather": [{"id": rng.choice([199, 200, 211, 300, 521, 600, 622, 700, 800, 801, 802, 803, 804, 900])}], "temp": temp, "feels_like": temp}
+    def daily_temp():
+        return {name: rng.uniform(-15, 40) for name in rng.sample(["day", "min", "max", "night", "eve", "morn"], rng.randint(1, 6))}
+    rain_start, rain_end = sorted(rng.randint(-5, 70) for i in range(2))
+    daily = []
+    for i in range(rng.randint(1, 8)):
+        sunrise = at()
+        moonrise = at()
+        daily.append(dict(block(now + 86400 * i, daily_temp()), sunrise = sunrise, sunset = sunrise + rng.choice([0, 1800, 12 * 3600, 3 * 86400]),
+            moonrise = moonrise, moonset = moonrise + rng.choice([0, 3600, 13 * 3600, 86400]), moon_phase = rng.random()))
+    return {
+        "timezone_offset": rng.randint(-12, 14) * 3600 + rng.choice([0, 1800]),
+        "current": block(rng.choice([now, at()]), rng.uniform(-20, 45)),
+        "minutely": [{"dt": now + 60 * i, "precipitation": rng.choice([0.2, 1.0]) if rain_start <= i < rain_end else 0} for i in range(rng.choice([0, 60, 61]))],
+        "hourly": [block(now + 3600 * i, rng.uniform(-20, 45)) for i in range(rng.choice([4, 8, 16, 48]))],
+        "daily": daily,
+    }
+
+def recorded_payloads():
+    payloads = []
+    for file_name in sorted(glob.glob(os.path.join(data_dir, "onecall_*.json"))):
+        with open(file_name, encoding = "utf-8") as payload_file:
+            payloads.append(json.load(payload_file))
+    return payloads
+
+def test_render_matches_old_renderer():
+    rng = random.Random(19)
+    for i in range(500):
+        weather = random_payload(rng)
+        for temp_type in ["feels_like", "temp"]:
+            assert grocha.WeatherForecast(weather).render("Lyon", temp_type) == old_render(weather, "Lyon", temp_type)
+
+def test_render_recorded_payloads():
+    for weather in recorded_payloads():
+        forecast = grocha.WeatherForecast(weather)
+        for temp_type in ["feels_like", "temp"]:
+            assert forecast.render("Paris", temp_type) == old_render(weather, "Paris", temp_type)
+            assert forecast.render("Paris", temp_type) is forecast.render("Paris", temp_type)
+
+@pytest.mark.parametrize("renderer", ["old", "parsed", "cached"])
+def test_render_benchmark(benchmark, renderer):
+    payloads = recorded_payloads()
+    forecasts = [grocha.WeatherForecast(weather) for weather in payloads]
+    def render():
+        for weather, forecast in zip(payloads, forecasts):
+            if renderer == "old":
+                old_render(weather, "Paris", "feels_like")
+            elif renderer == "parsed": # A fresh payload: parsed then rendered
+                grocha.WeatherForecast(weather).render("Paris", "feels_like")
+            else:
+                forecast.render("Paris", "feels_like")
+    benchmark(render)
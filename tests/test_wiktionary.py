@@ -0,0 +1,33 @@
+import json
+import threading
+
+import grocha
+from fake_discord import FakeWebClient
+
+def test_word_list_is_read_off_the_loop(loop, tmp_path):
+    (tmp_path / "mots.txt").write_text("été\nChat\n\nsieste\n", encoding = "utf-8")
+    reading_threads = []
+    class WatchedWiktionaryClient(grocha.WiktionaryClient):
+        def read_word_list(self):
+            reading_threads.append(threading.current_thread())
+            return grocha.WiktionaryClient.read_word_list(self)
+    web_client = FakeWebClient()
+    wiktionary = WatchedWiktionaryClient(web_client, word_list_file_name = str(tmp_path / "mots.txt"))
+    assert wiktionary.word_list == {} # Nothing read yet
+
+    async def find_words():
+        return await grocha.asyncio.gather(wiktionary.find_word("ETE"), wiktionary.find_word("chat"))
+    assert loop.run_until_complete(find_words()) == ["https://fr.wiktionary.org/wiki/%C3%A9t%C3%A9", "https://fr.wiktionary.org/wiki/chat"]
+    assert reading_threads and reading_threads[0] is not threading.main_thread()
+    assert len(reading_threads) == 1 # Read once for both
+    assert web_client.calls == []
+
+def test_unknown_words_are_looked_up_and_cached(loop):
+    web_client = FakeWebClient({"https://fr.wiktionary.org/": {"query": {"search": [{"title": "croquette"}]}}})
+    wiktionary = grocha.WiktionaryClient(web_client)
+    assert loop.run_until_complete(wiktionary.find_word("croquette")) == "https://fr.wiktionary.org/wiki/croquette"
+    assert loop.run_until_complete(wiktionary.find_word("miaouuu")) is None
+    assert len(web_client.calls) == 2
+    with open(grocha.wiktionary_cache_file_name) as cache_file:
+        assert json.load(cache_file) == {"croquette": "https://fr.wiktionary.org/wiki/croquette", "miaouuu": None}
+    assert grocha.WiktionaryClient(web_client).cache["miaouuu"] is None
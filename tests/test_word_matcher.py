@@ -0,0 +1,70 @@
+import random
+import re
+
+import pytest
+
+import grocha
+from replay import chat_words, synthetic_events
+
+def random_words(rng, count):
+    # French-looking words made of syllables
+    syllables = ["ma", "ou", "chat", "ron", "mi", "te", "pa", "lu", "sie", "ste", "croq", "ette", "son", "vent", "bou", "gre", "li", "on", "que", "tion"]
+    return ["".join(rng.choice(syllables) for _ in range(rng.randint(1, 4))) for i in range(count)]
+
+def autoreact_triggers(rng, count):
+    # Single words and a few phrases, as stored by the autoreact command
+    words = [grocha.remove_accents(w) for w in chat_words] + random_words(rng, count)
+    triggers = set()
+    while len(triggers) < count:
+        triggers.add(" ".join(rng.sample(words, 2)) if rng.random() < 0.2 else rng.choice(words))
+    return sorted(triggers)
+
+def corpus(fake_guild, count = 2000):
+    # Messages as on_message hands them to the matcher
+    events = synthetic_events(fake_guild, count, commands = ())
+    return [" ".join(grocha.remove_accents(e["content"]).lower().split()) for e in events if e["type"] == "message"]
+
+def test_find_matches_brute_force(fake_guild):
+    rng = random.Random(7)
+    triggers = autoreact_triggers(rng, 2000)
+    matcher = grocha.WordMatcher(triggers)
+    patterns = [(t, re.compile("(?<!\\w)" + re.escape(t))) for t in triggers]
+    texts = corpus(fake_guild, 60) + [" ".join(rng.sample(triggers, 5)) + " " + "".join(rng.sample(triggers, 3)) for i in range(20)]
+    for text in texts:
+        assert matcher.find(text) == {t for t, pattern in patterns if pattern.search(text)}
+
+def scan_triggers(triggers, text):
+    # Every trigger looked for on its own, then checked to start a word
+    return {t for t in triggers if t in text and re.search("(?<!\\w)" + re.escape(t), text)}
+
+@pytest.mark.parametrize("lookup", ["words", "scan", "matcher"])
+def test_find_benchmark(benchmark, fake_guild, lookup):
+    # 10k triggers over a chat. "words" is the lookup from before the matcher, one dict access per word of the message:
+    # the fastest, but blind to phrases, prefixes and punctuation. "scan" finds what the matcher finds, one trigger at a time.
+    triggers = autoreact_triggers(random.Random(7), 10000)
+    autoreact = dict.fromkeys(triggers)
+    matcher = grocha.WordMatcher(triggers)
+    texts = corpus(fake_guild)
+    def find_all():
+        if lookup == "words":
+            return [{w for w in text.split() if w in autoreact} for text in texts]
+        if lookup == "scan":
+            return [scan_triggers(triggers, text) for text in texts]
+        return [matcher.find(text) for text in texts]
+    found = benchmark.pedantic(find_all, rounds = 5, iterations = 1)
+    benchmark.extra_info["messages"] = len(texts)
+    benchmark.extra_info["matches"] = sum(map(len, found))
+    if lookup == "matcher":
+        assert found[:200] == [scan_triggers(triggers, text) for text in texts[:200]]
+
+def test_build_after_change_benchmark(benchmark, fake_guild):
+    # An autoreact command added a trigger: the next message pays for rebuilding the failure links
+    triggers = autoreact_triggers(random.Random(7), 10000)
+    matcher = grocha.WordMatcher(triggers)
+    text = corpus(fake_guild, 10)[0]
+    matcher.find(text)
+    def change():
+        matcher.add("miaouchat")
+        matcher.remove("miaouchat")
+    benchmark.pedantic(matcher.find, args = (text,), setup = change, rounds = 50)
+    assert not matcher.dirty